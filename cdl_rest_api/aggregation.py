@@ -0,0 +1,195 @@
+"""
+Aggregation of ExperimentResults over parameter sweeps.
+
+Results are grouped by one compute setting of their Experiment (theta or phi
+of an encoded qubit, or the value of a circuit angle) and the detector count
+rates and selected coincidence counts are summed in the database with a
+single GROUP BY query, so clients no longer have to download every result.
+Only compactly stored coincidence counts are summed while streaming them.
+"""
+
+import math
+import re
+
+from django.conf import settings
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast
+
+from cdl_rest_api import coincidences
+from cdl_rest_api.export import DETECTORS
+
+COMPUTE_SETTINGS = "experiment__ComputeSettings__"
+
+# parameter query parameter -> (lookup of the value, lookup of the item
+# selector, selector query parameter, default selector)
+PARAMETERS = {
+    "theta": (
+        COMPUTE_SETTINGS + "encodedQubitMeasurements__theta",
+        COMPUTE_SETTINGS + "encodedQubitMeasurements__encodedQubitIndex",
+        "qubit",
+        "1",
+    ),
+    "phi": (
+        COMPUTE_SETTINGS + "encodedQubitMeasurements__phi",
+        COMPUTE_SETTINGS + "encodedQubitMeasurements__encodedQubitIndex",
+        "qubit",
+        "1",
+    ),
+    "circuitAngleValue": (
+        COMPUTE_SETTINGS + "qubitComputing__circuitAngles__circuitAngleValue",
+        COMPUTE_SETTINGS + "qubitComputing__circuitAngles__circuitAngleName",
+        "angle",
+        None,
+    ),
+}
+COINCIDENCE_KEY = re.compile(r"^[A-Za-z0-9_]{1,32}$")
+MAX_COINCIDENCES = 64
+
+
+def _float(expression):
+    # sums of squares overflow 32 bit integer columns
+    return Cast(expression, FloatField())
+
+
+def parse_coincidences(value):
+    """
+    Returns the coincidenceCounts keys of a comma separated list. Raises
+    ValueError for invalid keys.
+    """
+    if not value:
+        return []
+    keys = [key.strip() for key in value.split(",") if key.strip()]
+    if len(keys) > MAX_COINCIDENCES or not all(
+        COINCIDENCE_KEY.match(key) for key in keys
+    ):
+        raise ValueError("Invalid coincidences.")
+    return list(dict.fromkeys(keys))
+
+
+def aggregate_sweep(queryset, params):
+    """
+    Groups the results by the compute setting of the parameter query
+    parameter and returns the sum, mean and standard deviation of every
+    detector count rate and of the coincidenceCounts keys listed in
+    coincidences, per distinct parameter value. Raises ValueError for
+    invalid parameters.
+    """
+    parameter = params.get("parameter")
+    if parameter not in PARAMETERS:
+        raise ValueError("Invalid parameter.")
+    value_lookup, selector_lookup, selector_param, default = PARAMETERS[parameter]
+    selector = params.get(selector_param, default)
+    if not selector:
+        raise ValueError("Invalid {}.".format(selector_param))
+    if selector_param == "qubit" and not selector.isdigit():
+        raise ValueError("Invalid qubit.")
+    keys = parse_coincidences(params.get("coincidences"))
+
+    metrics = {
+        ("countratePerDetector", detector): _float(
+            "experimentData__countratePerDetector__" + detector
+        )
+        for detector in DETECTORS
+    }
+    for key in keys:
+        metrics[("coincidenceCounts", key)] = _float(
+            KeyTextTransform(key, "experimentData__coincidenceCounts")
+        )
+
+    aggregates = {}
+    for i, expression in enumerate(metrics.values()):
+        aggregates["n{}".format(i)] = Count(expression)
+        aggregates["sum{}".format(i)] = Sum(expression)
+        aggregates["sumsq{}".format(i)] = Sum(expression * expression)
+
+    # filter and values share the join to the selected item
+    queryset = queryset.filter(**{selector_lookup: selector})
+    rows = list(
+        queryset.values(value=F(value_lookup))
+        .annotate(results=Count("id"), **aggregates)
+        .order_by("value")
+    )
+    if keys:
+        _add_compact_coincidences(rows, queryset, value_lookup, keys, len(DETECTORS))
+
+    groups = []
+    for row in rows:
+        group = {
+            "value": None if row["value"] is None else str(row["value"]),
+            "results": row["results"],
+            "countratePerDetector": {},
+            "coincidenceCounts": {},
+        }
+        for i, (section, name) in enumerate(metrics):
+            group[section][name] = _statistics(
+                row["n{}".format(i)],
+                row["sum{}".format(i)],
+                row["sumsq{}".format(i)],
+            )
+        groups.append(group)
+
+    visibility = {"countratePerDetector": {}, "coincidenceCounts": {}}
+    for section, name in metrics:
+        visibility[section][name] = _visibility(groups, section, name)
+
+    return {
+        "parameter": parameter,
+        selector_param: selector,
+        "groups": groups,
+        "visibility": visibility,
+    }
+
+
+def _add_compact_coincidences(rows, queryset, value_lookup, keys, first):
+    """
+    Adds the compactly stored counts of the keys (see coincidences.py) to the
+    grouped rows. The database can't sum packed counts, so they are read in
+    chunks and summed here, reading only the requested keys of every row.
+    """
+    readers = [coincidences.key_reader(key) for key in keys]
+    groups = {row["value"]: row for row in rows}
+    compact = (
+        queryset.filter(experimentData__coincidencePattern__isnull=False)
+        .values_list(
+            value_lookup,
+            "experimentData__coincidencePattern",
+            "experimentData__coincidenceValues",
+        )
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    for value, pattern_id, data in compact:
+        row = groups[value]
+        for i, read in enumerate(readers, first):
+            count = read(pattern_id, data)
+            if count is not None:
+                count = float(count)
+                row["n{}".format(i)] += 1
+                row["sum{}".format(i)] = (row["sum{}".format(i)] or 0) + count
+                row["sumsq{}".format(i)] = (row["sumsq{}".format(i)] or 0) + count**2
+
+
+def _statistics(count, total, total_squares):
+    """
+    Sum, mean and (population) standard deviation from the count, sum and
+    sum of squares of the values
+    """
+    if not count:
+        return {"count": 0, "sum": None, "mean": None, "std": None}
+    mean = total / count
+    variance = max(total_squares / count - mean * mean, 0.0)
+    return {"count": count, "sum": total, "mean": mean, "std": math.sqrt(variance)}
+
+
+def _visibility(groups, section, name):
+    """
+    Visibility (max - min) / (max + min) of the group means over the sweep
+    """
+    means = [
+        group[section][name]["mean"]
+        for group in groups
+        if group[section][name]["mean"] is not None
+    ]
+    if not means or max(means) + min(means) == 0:
+        return None
+    return (max(means) - min(means)) / (max(means) + min(means))
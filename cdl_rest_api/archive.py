@@ -0,0 +1,304 @@
+"""
+Bulk deletion and archival of Experiments.
+
+Both work on the Experiments matching the filters of the bulk endpoints and
+process them in chunks of EXPERIMENT_BULK_CHUNK_SIZE, each in its own
+transaction, so no request holds locks on more than one chunk.
+
+Archiving moves finished Experiments (DONE or FAILED) into the
+ArchivedExperiment table: the Experiment, its ComputeSettings, its results
+with their ExperimentData and its count rate samples become one zlib
+compressed JSON document. The hot tables then only hold the working set of
+the queue and list views, the detached result rows are deleted by the
+garbage collector (see orphans.py). Archived Experiments are restored when
+they are accessed via their ID.
+"""
+
+import json
+import zlib
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from cdl_rest_api import (cache, coincidences, configurations, models,
+                          serializers, stats)
+from cdl_rest_api.export import DETECTORS
+
+# statuses of the Experiments that can be archived
+ARCHIVE_STATUSES = ("DONE", "FAILED")
+# filters of the bulk endpoints
+FILTERS = ("user_id", "projectId", "status", "since", "until")
+RESULT_FIELDS = (
+    "startTime",
+    "totalCounts",
+    "numberOfDetectors",
+    "singlePhotonRate",
+    "totalTime",
+)
+# the ids are kept, they are the cursors of the samples endpoint
+SAMPLE_FIELDS = ("id", "time", "interval") + DETECTORS
+
+
+def filter_experiments(queryset, params, origin_user):
+    """
+    Applies the filters of the bulk query parameters: user_id (admin users
+    only, other users always get their own Experiments), projectId, status,
+    since and until (ISO 8601 timestamps on created). Raises ValueError for
+    invalid parameters.
+    """
+    if origin_user.is_admin:
+        if params.get("user_id"):
+            queryset = queryset.filter(user_id=params["user_id"])
+    else:
+        queryset = queryset.filter(user_id=origin_user.id)
+    if params.get("projectId"):
+        queryset = queryset.filter(projectId=params["projectId"])
+    if params.get("status"):
+        queryset = queryset.filter(status=params["status"])
+    for param, lookup in (("since", "created__gte"), ("until", "created__lt")):
+        if params.get(param):
+            timestamp = parse_datetime(params[param])
+            if timestamp is None:
+                raise ValueError("Invalid {}.".format(param))
+            queryset = queryset.filter(**{lookup: timestamp})
+    return queryset
+
+
+def _chunks(queryset, chunk_size):
+    """
+    Yields the primary keys of the queryset in chunks, in primary key order
+    """
+    if chunk_size is None:
+        chunk_size = settings.EXPERIMENT_BULK_CHUNK_SIZE
+    queryset = queryset.order_by("pk").values_list("pk", flat=True)
+    pks = list(queryset[:chunk_size])
+    while pks:
+        yield pks
+        pks = list(queryset.filter(pk__gt=pks[-1])[:chunk_size])
+
+
+def delete_experiments(queryset, chunk_size=None):
+    """
+    Deletes the Experiments of the queryset chunk by chunk and returns their
+    number
+    """
+    deleted = 0
+    for pks in _chunks(queryset, chunk_size):
+        with transaction.atomic():
+            # locked and filtered again, see _delete_experiment in views.py
+            experiments = list(queryset.select_for_update().filter(pk__in=pks))
+            stats.experiments_deleted(experiments)
+            models.Experiment.objects.filter(
+                pk__in=[experiment.pk for experiment in experiments]
+            ).delete()
+        cache.invalidate_experiment(*pks)
+        deleted += len(experiments)
+    return deleted
+
+
+def _experiment_fields():
+    return [
+        field
+        for field in models.Experiment._meta.concrete_fields
+        if field.name not in ("id", "experimentbase_ptr", "ComputeSettings")
+    ]
+
+
+class _Encoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder drops the microseconds beyond milliseconds
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _pack(document):
+    return zlib.compress(
+        json.dumps(document, cls=_Encoder, separators=(",", ":")).encode()
+    )
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def _documents(experiments):
+    """
+    Returns the archive documents of the Experiments, by experimentId
+    """
+    documents = {}
+    for experiment in experiments:
+        documents[experiment.pk] = {
+            "experiment": {
+                field.attname: field.value_from_object(experiment)
+                for field in _experiment_fields()
+            },
+            "ComputeSettings": configurations.compute_settings_data(
+                experiment.ComputeSettings
+            ),
+            "results": [],
+            "samples": [],
+        }
+    results = (
+        models.ExperimentResult.objects.filter(experiment__in=list(documents))
+        .select_related("experimentData__countratePerDetector")
+        .order_by("id")
+    )
+    for result in results:
+        experimentData = result.experimentData
+        document = {field: getattr(result, field) for field in RESULT_FIELDS}
+        if experimentData is not None:
+            countrates = experimentData.countratePerDetector
+            document["experimentData"] = {
+                "countratePerDetector": {
+                    detector: getattr(countrates, detector) for detector in DETECTORS
+                }
+                if countrates is not None
+                else None,
+                "coincidenceCounts": coincidences.get_counts(experimentData),
+            }
+        documents[result.experiment_id]["results"].append(document)
+    samples = (
+        models.CountrateSample.objects.filter(experiment__in=list(documents))
+        .order_by("id")
+        .values_list("experiment", *SAMPLE_FIELDS)
+    )
+    for sample in samples:
+        documents[sample[0]]["samples"].append(sample[1:])
+    return documents
+
+
+def archive_experiments(queryset, chunk_size=None):
+    """
+    Moves the finished Experiments of the queryset into the archive chunk
+    by chunk and returns their number
+    """
+    queryset = queryset.filter(status__in=ARCHIVE_STATUSES)
+    archived = 0
+    for pks in _chunks(queryset, chunk_size):
+        with transaction.atomic():
+            pks = list(
+                queryset.select_for_update()
+                .filter(pk__in=pks)
+                .values_list("pk", flat=True)
+            )
+            experiments = list(
+                models.Experiment.objects.with_compute_settings().filter(pk__in=pks)
+            )
+            documents = _documents(experiments)
+            models.ArchivedExperiment.objects.bulk_create(
+                [
+                    models.ArchivedExperiment(
+                        experimentId=experiment.pk,
+                        user_id=experiment.user_id,
+                        projectId=experiment.projectId,
+                        experimentName=experiment.experimentName,
+                        status=experiment.status,
+                        created=experiment.created,
+                        data=_pack(documents[experiment.pk]),
+                    )
+                    for experiment in experiments
+                ]
+            )
+            stats.experiments_deleted(experiments)
+            models.Experiment.objects.filter(pk__in=pks).delete()
+        cache.invalidate_experiment(*pks)
+        archived += len(experiments)
+    return archived
+
+
+def _get_archived(origin_user, experiment_id):
+    queryset = models.ArchivedExperiment.objects.select_for_update()
+    if not origin_user.is_admin:
+        queryset = queryset.filter(user_id=origin_user.id)
+    try:
+        return queryset.filter(experimentId=experiment_id).first()
+    except ValidationError:
+        # not a UUID
+        return None
+
+
+def restore(origin_user, experiment_id):
+    """
+    Moves an archived Experiment the user may access back into the hot
+    tables. Returns the Experiment, or None if there is no such archived
+    Experiment.
+    """
+    with transaction.atomic():
+        archived = _get_archived(origin_user, experiment_id)
+        if archived is None:
+            return None
+        document = _unpack(archived.data)
+
+        computeSettings = None
+        if document["ComputeSettings"] is not None:
+            # shared with identical stored trees, see ComputeSettingsSerializer
+            serializer = serializers.ComputeSettingsSerializer(
+                data=document["ComputeSettings"]
+            )
+            serializer.is_valid(raise_exception=True)
+            computeSettings = serializer.save()
+        experiment = models.Experiment(
+            ComputeSettings=computeSettings,
+            **{
+                field.attname: field.to_python(document["experiment"][field.attname])
+                for field in _experiment_fields()
+            }
+        )
+        # created is overwritten on insert (auto_now_add)
+        created = experiment.created
+        experiment.save(force_insert=True)
+        models.Experiment.objects.filter(pk=experiment.pk).update(created=created)
+        experiment.created = created
+
+        for result in document["results"]:
+            experimentData = None
+            data = result.pop("experimentData", None)
+            if data is not None:
+                countrates = None
+                if data["countratePerDetector"] is not None:
+                    countrates = models.Countrates.objects.create(
+                        **data["countratePerDetector"]
+                    )
+                experimentData = models.ExperimentData.objects.create(
+                    countratePerDetector=countrates,
+                    **coincidences.storage_fields(data["coincidenceCounts"])
+                )
+            startTime = parse_datetime(result.pop("startTime"))
+            experimentResult = models.ExperimentResult.objects.create(
+                experiment=experiment, experimentData=experimentData, **result
+            )
+            # startTime is overwritten on insert (auto_now_add)
+            models.ExperimentResult.objects.filter(pk=experimentResult.pk).update(
+                startTime=startTime
+            )
+
+        models.CountrateSample.objects.bulk_create(
+            [
+                models.CountrateSample(
+                    experiment=experiment, **dict(zip(SAMPLE_FIELDS, sample))
+                )
+                for sample in document["samples"]
+            ],
+            batch_size=1000,
+        )
+        archived.delete()
+        stats.experiments_restored([experiment])
+    return experiment
+
+
+def delete_archived(origin_user, experiment_id):
+    """
+    Deletes an archived Experiment the user may access, returns whether
+    there was one
+    """
+    with transaction.atomic():
+        archived = _get_archived(origin_user, experiment_id)
+        if archived is None:
+            return False
+        archived.delete()
+    return True
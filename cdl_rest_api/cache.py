@@ -0,0 +1,98 @@
+"""
+Cached representations of the Experiment detail and result views, which are
+polled by the frontend until an Experiment is DONE.
+
+Every entry stores the rendered data, the owner of the Experiment (checked
+against the requesting user before an entry is served) and an ETag. Entries
+have to be invalidated with invalidate_experiment whenever the Experiment or
+its results change.
+
+A request can read the Experiment before a change commits and store its
+representation after the invalidation ran. Entries are therefore tagged
+with the version of the Experiment read before rendering. Invalidating
+replaces the version with a new random one, and entries of another version
+are never served. Versions are kept for twice EXPERIMENT_CACHE_TIMEOUT,
+so they outlive every entry that was stored within EXPERIMENT_CACHE_TIMEOUT
+after the invalidation.
+
+The cache is shared by all processes that change Experiments (web workers,
+flush_results, archive_experiments, collect_orphans, ...). Caching is off
+with EXPERIMENT_CACHE_TIMEOUT = 0, which production.py sets if no shared
+cache backend is configured.
+"""
+
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+def _key(experiment_id, view):
+    # the same Experiment ID can be spelled differently in URLs
+    try:
+        experiment_id = uuid.UUID(str(experiment_id))
+    except ValueError:
+        # memcached keys must not contain spaces or control characters
+        experiment_id = hashlib.sha1(str(experiment_id).encode()).hexdigest()
+    return "cdl:experiment:{}:{}".format(experiment_id, view)
+
+
+def get_representation(experiment_id, view, origin_user):
+    """
+    Returns the cached entry of a view for the requesting user and the
+    current version of the Experiment, to be passed to set_representation.
+    The entry is None if there is none, it is of an older version or the
+    Experiment belongs to another user.
+    """
+    if not settings.EXPERIMENT_CACHE_TIMEOUT:
+        return None, None
+    key = _key(experiment_id, view)
+    version_key = _key(experiment_id, "version")
+    values = cache.get_many([key, version_key])
+    entry = values.get(key)
+    version = values.get(version_key)
+    if entry is None or entry["version"] != version:
+        return None, version
+    if not origin_user.is_admin and entry["user_id"] != origin_user.id:
+        return None, version
+    return entry, version
+
+
+def set_representation(experiment_id, view, user_id, data, version):
+    """
+    Stores the rendered data of a view and returns the new entry, version is
+    the one returned by get_representation before the Experiment was read
+    """
+    encoded = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    entry = {
+        "user_id": user_id,
+        "data": data,
+        "etag": '"{}"'.format(hashlib.sha1(encoded.encode()).hexdigest()),
+        "version": version,
+    }
+    if settings.EXPERIMENT_CACHE_TIMEOUT:
+        cache.set(
+            _key(experiment_id, view), entry, settings.EXPERIMENT_CACHE_TIMEOUT
+        )
+    return entry
+
+
+def invalidate_experiment(*experiment_ids):
+    """
+    Gives the Experiments a new version once the current transaction
+    commits, which makes all their cached representations stale
+    """
+    if not settings.EXPERIMENT_CACHE_TIMEOUT or not experiment_ids:
+        return
+    keys = [_key(experiment_id, "version") for experiment_id in experiment_ids]
+
+    def invalidate():
+        version = uuid.uuid4().hex
+        cache.set_many(
+            {key: version for key in keys}, 2 * settings.EXPERIMENT_CACHE_TIMEOUT
+        )
+
+    transaction.on_commit(invalidate)
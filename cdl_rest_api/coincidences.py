@@ -0,0 +1,155 @@
+"""
+Compact storage of ExperimentData.coincidenceCounts.
+
+With COINCIDENCES_COMPACT enabled, the keys of a coincidenceCounts dict are
+stored once in the shared CoincidencePattern dictionary and the counts as a
+packed little-endian uint32 array in key order (coincidenceValues). The time
+tagger reports the same detector combinations for every run, so a handful
+of patterns serve all rows and each row stores 4 bytes per count instead of
+the key names. Counts that don't fit into uint32 are still stored as JSON,
+so every dict round-trips unchanged.
+"""
+
+import hashlib
+import json
+import struct
+import sys
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+
+from cdl_rest_api import models
+
+UINT32_MAX = 2 ** 32 - 1
+
+# patterns never change, so they are cached for the lifetime of the process:
+# digest -> pattern id, pattern id -> keys
+_pattern_ids = {}
+_pattern_keys = {}
+
+
+def _digest(keys):
+    return hashlib.sha1(json.dumps(keys).encode()).hexdigest()
+
+
+def _remember(pattern_id, digest, keys):
+    # only committed patterns are cached, a rolled back id could be reused
+    def remember():
+        _pattern_ids[digest] = pattern_id
+        _pattern_keys[pattern_id] = keys
+
+    transaction.on_commit(remember)
+
+
+def get_pattern_id(keys):
+    """
+    Returns the id of the CoincidencePattern of the ordered keys, created on
+    first use
+    """
+    keys = list(keys)
+    digest = _digest(keys)
+    pattern_id = _pattern_ids.get(digest)
+    if pattern_id is None:
+        pattern, created = models.CoincidencePattern.objects.get_or_create(
+            digest=digest, defaults={"keys": keys}
+        )
+        pattern_id = pattern.pk
+        _remember(pattern_id, digest, keys)
+    return pattern_id
+
+
+def pattern_keys(pattern_id):
+    """
+    Returns the keys of a CoincidencePattern
+    """
+    keys = _pattern_keys.get(pattern_id)
+    if keys is None:
+        keys = models.CoincidencePattern.objects.values_list("keys", flat=True).get(
+            pk=pattern_id
+        )
+        _remember(pattern_id, _digest(keys), keys)
+    return keys
+
+
+def _compactable(counts):
+    return (
+        isinstance(counts, dict)
+        and counts
+        and all(
+            type(value) is int and 0 <= value <= UINT32_MAX
+            for value in counts.values()
+        )
+    )
+
+
+def storage_fields(counts, compact=None):
+    """
+    Returns the ExperimentData fields that store the coincidenceCounts dict:
+    compact if enabled (COINCIDENCES_COMPACT, unless compact is given) and
+    possible, otherwise as JSON
+    """
+    if compact is None:
+        compact = settings.COINCIDENCES_COMPACT
+    if not compact or not _compactable(counts):
+        return {"coincidenceCounts": counts}
+    values = array("I", counts.values())
+    if sys.byteorder != "little":
+        values.byteswap()
+    return {
+        "coincidenceCounts": {},
+        "coincidencePattern_id": get_pattern_id(counts),
+        "coincidenceValues": values.tobytes(),
+    }
+
+
+def unpack(pattern_id, data):
+    """
+    Returns the coincidenceCounts dict of compactly stored counts
+    """
+    values = array("I")
+    values.frombytes(bytes(data))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return dict(zip(pattern_keys(pattern_id), values))
+
+
+def counts(coincidenceCounts, pattern_id, data):
+    """
+    Returns the coincidenceCounts dict of the three coincidence columns of an
+    ExperimentData row, whichever way it is stored
+    """
+    if pattern_id is None:
+        return coincidenceCounts
+    return unpack(pattern_id, data)
+
+
+def get_counts(experimentData):
+    """
+    Returns the coincidenceCounts dict of an ExperimentData
+    """
+    return counts(
+        experimentData.coincidenceCounts,
+        experimentData.coincidencePattern_id,
+        experimentData.coincidenceValues,
+    )
+
+
+def key_reader(key):
+    """
+    Returns a function that reads the count of one key from compactly
+    stored counts without unpacking the others, or None if the pattern does
+    not contain the key
+    """
+    offsets = {}
+
+    def read(pattern_id, data):
+        if pattern_id not in offsets:
+            keys = pattern_keys(pattern_id)
+            offsets[pattern_id] = 4 * keys.index(key) if key in keys else None
+        offset = offsets[pattern_id]
+        if offset is None:
+            return None
+        return struct.unpack_from("<I", data, offset)[0]
+
+    return read
@@ -0,0 +1,252 @@
+"""
+Canonical hashing of Experiment configurations and reuse of recent results.
+
+Two Experiments with the same circuitId and ComputeSettings tree (clusterState,
+the theta and phi of every encoded qubit and the circuit angles, in any
+order) measure the same thing. Their SHA-256 over a canonical JSON encoding
+is stored in Experiment.configurationHash when the Experiment is submitted.
+
+Submissions with "reuseResult": true are not queued if an identical
+configuration with the same maxRuntime finished within
+EXPERIMENT_REUSE_WINDOW seconds. They are DONE at once, with a copy of that
+result that shares its ExperimentData. The hardware time saved this way is
+counted in the statistics (see stats.py).
+"""
+
+import hashlib
+import json
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from cdl_rest_api import models
+
+
+def _decimal(value, places):
+    # 45, 45.0 and 45.00 are the same angle
+    if value is None:
+        return None
+    return "{:.{}f}".format(Decimal(value), places)
+
+
+def _sorted(items):
+    return sorted(items, key=json.dumps)
+
+
+def canonical_settings(computeSettings):
+    """
+    Returns the canonical form of a ComputeSettings tree, computeSettings is
+    the nested dict of the ComputeSettingsSerializer format
+    """
+    clusterState = computeSettings.get("clusterState") or {}
+    circuitAngles = (computeSettings.get("qubitComputing") or {}).get(
+        "circuitAngles"
+    ) or []
+    return {
+        "clusterState": [
+            clusterState.get("amountQubits"),
+            clusterState.get("presetSettings"),
+        ],
+        "encodedQubitMeasurements": _sorted(
+            [
+                measurement.get("encodedQubitIndex"),
+                _decimal(measurement.get("theta"), 2),
+                _decimal(measurement.get("phi"), 2),
+            ]
+            for measurement in computeSettings.get("encodedQubitMeasurements") or []
+        ),
+        "circuitAngles": _sorted(
+            [angle.get("circuitAngleName"), _decimal(angle.get("circuitAngleValue"), 3)]
+            for angle in circuitAngles
+        ),
+    }
+
+
+def canonical(circuitId, computeSettings):
+    """
+    Returns the canonical form of a configuration, see canonical_settings
+    """
+    return dict(canonical_settings(computeSettings), circuitId=circuitId)
+
+
+def _sha256(data):
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def configuration_hash(circuitId, computeSettings):
+    """
+    Returns the configurationHash of a configuration, see canonical
+    """
+    if computeSettings is None:
+        return None
+    return _sha256(canonical(circuitId, computeSettings))
+
+
+def settings_hash(computeSettings):
+    """
+    Returns the settingsHash of a ComputeSettings tree, under which the tree
+    is stored only once (see ComputeSettingsSerializer.create)
+    """
+    return _sha256(canonical_settings(computeSettings))
+
+
+def compute_settings_data(computeSettings):
+    """
+    Returns the nested dict of a stored ComputeSettings, for configuration_hash
+    """
+    if computeSettings is None:
+        return None
+    clusterState = computeSettings.clusterState
+    qubitComputing = computeSettings.qubitComputing
+    return {
+        "clusterState": {
+            "amountQubits": clusterState.amountQubits,
+            "presetSettings": clusterState.presetSettings,
+        }
+        if clusterState is not None
+        else None,
+        "qubitComputing": {
+            "circuitAngles": [
+                {
+                    "circuitAngleName": angle.circuitAngleName,
+                    "circuitAngleValue": angle.circuitAngleValue,
+                }
+                for angle in qubitComputing.circuitAngles.all()
+            ]
+        }
+        if qubitComputing is not None
+        else None,
+        "encodedQubitMeasurements": [
+            {
+                "encodedQubitIndex": measurement.encodedQubitIndex,
+                "theta": measurement.theta,
+                "phi": measurement.phi,
+            }
+            for measurement in computeSettings.encodedQubitMeasurements.all()
+        ],
+    }
+
+
+def experiment_hash(experiment):
+    """
+    Returns the configurationHash of a stored Experiment
+    """
+    return configuration_hash(
+        experiment.circuitId, compute_settings_data(experiment.ComputeSettings)
+    )
+
+
+def share_compute_settings(batch_size=1000):
+    """
+    Merges the ComputeSettings trees stored without settingsHash: the first
+    tree of every hash gets the hash, the Experiments of identical trees are
+    moved to it. Returns the number of hashed and of merged trees, merged
+    trees are left without Experiments.
+    """
+    queryset = (
+        models.ComputeSettings.objects.filter(
+            Exists(
+                models.ExperimentBase.objects.filter(ComputeSettings=OuterRef("pk"))
+            ),
+            settingsHash__isnull=True,
+        )
+        .select_related("clusterState", "qubitComputing")
+        .prefetch_related(
+            "encodedQubitMeasurements", "qubitComputing__circuitAngles"
+        )
+        .order_by("id")
+    )
+    hashed = merged = 0
+    computeSettings = list(queryset[:batch_size])
+    while computeSettings:
+        settingsHashes = [
+            settings_hash(compute_settings_data(computeSetting))
+            for computeSetting in computeSettings
+        ]
+        with transaction.atomic():
+            stored = dict(
+                models.ComputeSettings.objects.filter(
+                    settingsHash__in=set(settingsHashes)
+                ).values_list("settingsHash", "id")
+            )
+            first = []
+            moved = defaultdict(list)
+            for computeSetting, settingsHash in zip(computeSettings, settingsHashes):
+                if settingsHash in stored:
+                    moved[stored[settingsHash]].append(computeSetting.pk)
+                else:
+                    computeSetting.settingsHash = settingsHash
+                    stored[settingsHash] = computeSetting.pk
+                    first.append(computeSetting)
+            models.ComputeSettings.objects.bulk_update(first, ["settingsHash"])
+            for target, pks in moved.items():
+                models.ExperimentBase.objects.filter(ComputeSettings__in=pks).update(
+                    ComputeSettings=target
+                )
+        hashed += len(first)
+        merged += len(computeSettings) - len(first)
+        computeSettings = list(
+            queryset.filter(id__gt=computeSettings[-1].pk)[:batch_size]
+        )
+    return hashed, merged
+
+
+def reuse_results(experiments):
+    """
+    Finishes the new Experiments for which an identical configuration with
+    the same maxRuntime finished within EXPERIMENT_REUSE_WINDOW seconds,
+    with a copy of the latest such result. Returns the created
+    ExperimentResults, their Experiments are DONE and have reusedFrom set.
+    """
+    experiments = [
+        experiment for experiment in experiments if experiment.configurationHash
+    ]
+    if not experiments:
+        return []
+    since = timezone.now() - timedelta(seconds=settings.EXPERIMENT_REUSE_WINDOW)
+    candidates = (
+        models.ExperimentResult.objects.filter(
+            experiment__configurationHash__in={
+                experiment.configurationHash for experiment in experiments
+            },
+            experiment__status="DONE",
+            # results of reused Experiments point to the original result
+            experiment__reusedFrom__isnull=True,
+            experimentData__isnull=False,
+            startTime__gte=since,
+        )
+        .select_related("experiment")
+        .order_by("-id")
+    )
+    sources = {}
+    for result in candidates:
+        key = (result.experiment.configurationHash, result.experiment.maxRuntime)
+        sources.setdefault(key, result)
+
+    experimentResults = []
+    reused = []
+    for experiment in experiments:
+        source = sources.get((experiment.configurationHash, experiment.maxRuntime))
+        if source is None:
+            continue
+        experiment.status = "DONE"
+        experiment.reusedFrom_id = source.experiment_id
+        reused.append(experiment)
+        experimentResults.append(
+            models.ExperimentResult(
+                experiment=experiment,
+                experimentData_id=source.experimentData_id,
+                totalCounts=source.totalCounts,
+                numberOfDetectors=source.numberOfDetectors,
+                singlePhotonRate=source.singlePhotonRate,
+                totalTime=source.totalTime,
+            )
+        )
+    models.Experiment.objects.bulk_update(reused, ["status", "reusedFrom"])
+    return models.ExperimentResult.objects.bulk_create(experimentResults)
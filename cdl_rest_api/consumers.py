@@ -0,0 +1,149 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from cdl_rest_api import models, queue, samples, scheduler
+from cdl_webservice.middlewares import get_origin_user
+
+
+def get_scope_user(scope):
+    """
+    Returns the origin user of the token of a websocket connection, or None.
+    Browsers cannot set headers on websocket connections, so the token can
+    also be passed as ?token=<jwt>.
+    """
+    headers = dict(scope.get("headers", []))
+    query = parse_qs(scope.get("query_string", b"").decode())
+    if b"authorization" in headers:
+        token = headers[b"authorization"].decode().split(" ")[-1]
+    elif "token" in query:
+        token = query["token"][0]
+    else:
+        return None
+    return get_origin_user(token)
+
+
+class ExperimentQueueConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes an "experiment.enqueued" event to connected workers whenever a new
+    Experiment is put into the queue, so they don't need to poll the queue
+    endpoint. Workers then claim the Experiment via experiments/queue/claim.
+    The token is read by get_scope_user.
+    """
+
+    async def connect(self):
+        if not self.is_admin():
+            await self.close()
+            return
+        await self.accept()
+        self.listen_task = asyncio.ensure_future(self.listen())
+
+    async def disconnect(self, code):
+        if hasattr(self, "listen_task"):
+            self.listen_task.cancel()
+
+    async def listen(self):
+        # woken by the queue dispatcher of the process, the consumer holds
+        # neither a thread nor a database connection while it waits
+        await sync_to_async(queue.dispatcher.start, thread_sensitive=False)()
+        enqueued = queue.dispatcher.subscribe(asyncio.get_event_loop())
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(
+                        enqueued.wait(), settings.EXPERIMENT_QUEUE_MAX_WAIT
+                    )
+                except asyncio.TimeoutError:
+                    # reminds idle workers of Experiments still queued
+                    if not await database_sync_to_async(self.queue_is_empty)():
+                        await self.send_json({"type": "experiment.enqueued"})
+                    continue
+                enqueued.clear()
+                await self.send_json({"type": "experiment.enqueued"})
+        finally:
+            queue.dispatcher.unsubscribe(enqueued)
+
+    def queue_is_empty(self):
+        return not scheduler.queued_experiments().exists()
+
+    def is_admin(self):
+        user = get_scope_user(self.scope)
+        return bool(user is not None and user.is_admin)
+
+
+class ExperimentSampleConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Streams the count rate samples of an Experiment as "samples" events
+    while it runs (see samples.py), starting after the cursor ?since= (all
+    samples by default). Once the Experiment is DONE or FAILED and all its
+    samples were sent, an "experiment.finished" event is sent and the
+    connection is closed. Authenticated like ExperimentQueueConsumer.
+    """
+
+    async def connect(self):
+        user = get_scope_user(self.scope)
+        if user is None:
+            await self.close()
+            return
+        experiment_id = self.scope["url_route"]["kwargs"]["experiment_id"]
+        self.experiment = await database_sync_to_async(
+            models.Experiment.objects.only("experimentId", "user_id").get_accessible
+        )(user, experiment_id)
+        if self.experiment is None:
+            await self.close()
+            return
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.cursor = query.get("since", ["0"])[0]
+        if not self.cursor.isdigit():
+            await self.close()
+            return
+        await self.accept()
+        self.stream_task = asyncio.ensure_future(self.stream())
+
+    @classmethod
+    async def encode_json(cls, content):
+        # sample times are datetimes
+        return json.dumps(content, cls=DjangoJSONEncoder)
+
+    async def disconnect(self, code):
+        if hasattr(self, "stream_task"):
+            self.stream_task.cancel()
+
+    async def stream(self):
+        while True:
+            # status first, samples stored before the Experiment finished
+            # are then part of the read
+            status, data = await database_sync_to_async(self.read)()
+            if data["samples"]:
+                await self.send_json(dict(data, type="samples"))
+            if status is None:
+                # the Experiment was deleted
+                await self.close()
+                return
+            if not data["more"]:
+                if status in ("DONE", "FAILED"):
+                    await self.send_json(
+                        {"type": "experiment.finished", "status": status}
+                    )
+                    await self.close()
+                    return
+                await asyncio.sleep(settings.SAMPLE_POLL_INTERVAL)
+
+    def read(self):
+        status = (
+            models.Experiment.objects.filter(pk=self.experiment.pk)
+            .values_list("status", flat=True)
+            .first()
+        )
+        data = samples.read(
+            models.CountrateSample.objects.filter(experiment=self.experiment),
+            {"since": str(self.cursor)},
+        )
+        self.cursor = data["cursor"]
+        return status, data
@@ -0,0 +1,342 @@
+"""
+Streaming export of ExperimentResults for offline analysis.
+
+Rows are read with a server-side cursor (QuerySet.iterator) and written to
+the response chunk by chunk, so memory use does not depend on the number of
+exported results.
+"""
+
+import csv
+import datetime
+import json
+import shutil
+import sys
+import tempfile
+import zipfile
+from array import array
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+from cdl_rest_api import coincidences
+
+DETECTORS = ("d1", "d2", "d3", "d4", "d5", "d6", "d7", "d8")
+
+# exported columns and the lookups they are read from
+RESULT_COLUMNS = (
+    ("resultId", "id"),
+    ("experiment", "experiment_id"),
+    ("projectId", "experiment__projectId"),
+    ("user_id", "experiment__user_id"),
+    ("startTime", "startTime"),
+    ("totalCounts", "totalCounts"),
+    ("numberOfDetectors", "numberOfDetectors"),
+    ("singlePhotonRate", "singlePhotonRate"),
+    ("totalTime", "totalTime"),
+)
+COUNTRATE_LOOKUP = "experimentData__countratePerDetector__{}"
+# coincidenceCounts as JSON or compact, see coincidences.counts
+COINCIDENCES_LOOKUPS = (
+    "experimentData__coincidenceCounts",
+    "experimentData__coincidencePattern",
+    "experimentData__coincidenceValues",
+)
+
+
+def filter_results(queryset, params, origin_user):
+    """
+    Applies the filters of the export query parameters: projectId, user_id
+    (admin users only, other users always get their own results), since and
+    until (ISO 8601 timestamps on startTime). Raises ValueError for invalid
+    parameters.
+    """
+    if origin_user.is_admin:
+        if params.get("user_id"):
+            queryset = queryset.filter(experiment__user_id=params["user_id"])
+    else:
+        queryset = queryset.filter(experiment__user_id=origin_user.id)
+    if params.get("projectId"):
+        queryset = queryset.filter(experiment__projectId=params["projectId"])
+    for param, lookup in (("since", "startTime__gte"), ("until", "startTime__lt")):
+        if params.get(param):
+            timestamp = parse_datetime(params[param])
+            if timestamp is None:
+                raise ValueError("Invalid {}.".format(param))
+            queryset = queryset.filter(**{lookup: timestamp})
+    return queryset
+
+
+def iter_result_rows(queryset):
+    """
+    Yields one dict per ExperimentResult with all exported columns
+    """
+    lookups = (
+        [lookup for column, lookup in RESULT_COLUMNS]
+        + [COUNTRATE_LOOKUP.format(detector) for detector in DETECTORS]
+        + list(COINCIDENCES_LOOKUPS)
+    )
+    rows = (
+        queryset.order_by("id")
+        .values_list(*lookups)
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    for row in rows:
+        result = {
+            column: value for (column, lookup), value in zip(RESULT_COLUMNS, row)
+        }
+        offset = len(RESULT_COLUMNS)
+        result["countratePerDetector"] = dict(
+            zip(DETECTORS, row[offset : offset + len(DETECTORS)])
+        )
+        result["coincidenceCounts"] = coincidences.counts(*row[-3:])
+        yield result
+
+
+def iter_ndjson(queryset):
+    """
+    Yields the results as newline delimited JSON, one result per line
+    """
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for result in iter_result_rows(queryset):
+        yield encoder.encode(result) + "\n"
+
+
+class _Echo:
+    """
+    File-like object for csv.writer that returns the written line instead of
+    buffering it
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset):
+    """
+    Yields the results as CSV with one column per detector and the
+    coincidence counts as JSON object
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(
+        [column for column, lookup in RESULT_COLUMNS]
+        + list(DETECTORS)
+        + ["coincidenceCounts"]
+    )
+    for result in iter_result_rows(queryset):
+        yield writer.writerow(
+            [_csv_value(result[column]) for column, lookup in RESULT_COLUMNS]
+            + [result["countratePerDetector"][detector] for detector in DETECTORS]
+            + [json.dumps(result["coincidenceCounts"], sort_keys=True)]
+        )
+
+
+def _csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _epoch_microseconds(value):
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+# columns of the npz export: (array name, dtype, array typecode, converter)
+# startTime is stored as microseconds since the epoch (numpy datetime64[us])
+NPZ_COLUMNS = (
+    ("resultId", "<i8", "q", int),
+    ("startTime", "<M8[us]", "q", _epoch_microseconds),
+    ("totalCounts", "<u4", "I", int),
+    ("numberOfDetectors", "<u4", "I", int),
+    ("singlePhotonRate", "<f8", "d", float),
+    ("totalTime", "<u4", "I", int),
+)
+
+
+class _NpyColumn:
+    """
+    Collects the values of one array in a temporary file, so the export
+    does not keep the arrays in memory
+    """
+
+    def __init__(self, dtype, typecode, shape=()):
+        self.dtype = dtype
+        self.typecode = typecode
+        self.shape = shape
+        self.rows = 0
+        self.buffer = array(typecode)
+        self.file = tempfile.TemporaryFile()
+
+    def append(self, values):
+        self.buffer.extend(values)
+        self.rows += 1
+        if len(self.buffer) >= 65536:
+            self.flush()
+
+    def flush(self):
+        if sys.byteorder != "little":
+            self.buffer.byteswap()
+        self.file.write(self.buffer.tobytes())
+        self.buffer = array(self.typecode)
+
+    def write_npy(self, archive, name):
+        """
+        Writes the column as .npy file (format version 1.0) into the zip
+        archive
+        """
+        self.flush()
+        self.file.seek(0)
+        with archive.open(name + ".npy", "w", force_zip64=True) as npy:
+            npy.write(_npy_header(self.dtype, (self.rows,) + self.shape))
+            shutil.copyfileobj(self.file, npy)
+        self.file.close()
+
+
+def _npy_header(dtype, shape):
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format(
+        dtype, repr(shape)
+    )
+    # magic, version, header length, header padded to a multiple of 64 bytes
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header
+
+
+def coincidence_patterns(queryset):
+    """
+    Returns the sorted keys of all coincidenceCounts of the results, which
+    define the column order of the coincidence matrix
+    """
+    patterns = set()
+    rows = (
+        queryset.filter(experimentData__coincidencePattern__isnull=True)
+        .values_list(COINCIDENCES_LOOKUPS[0], flat=True)
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    for coincidenceCounts in rows:
+        if coincidenceCounts:
+            patterns.update(coincidenceCounts)
+    # compactly stored counts only need their pattern dictionary entries
+    pattern_ids = (
+        queryset.filter(experimentData__coincidencePattern__isnull=False)
+        .values_list(COINCIDENCES_LOOKUPS[1], flat=True)
+        .distinct()
+    )
+    for pattern_id in pattern_ids:
+        patterns.update(coincidences.pattern_keys(pattern_id))
+    return sorted(patterns)
+
+
+INT64_MIN = -(2 ** 63)
+INT64_MAX = 2 ** 63 - 1
+
+
+def _coincidence_row(coincidenceCounts, patterns):
+    """
+    Returns the counts of the patterns (0 if missing), or None if they
+    don't fit into an int64 array
+    """
+    if not coincidenceCounts:
+        return [0] * len(patterns)
+    if not isinstance(coincidenceCounts, dict):
+        return None
+    counts = []
+    for pattern in patterns:
+        try:
+            count = int(coincidenceCounts.get(pattern, 0))
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if not INT64_MIN <= count <= INT64_MAX:
+            return None
+        counts.append(count)
+    return counts
+
+
+def write_npz(queryset, fileobj):
+    """
+    Writes the results column by column into an uncompressed npz archive
+    that can be loaded with numpy.load:
+
+    resultId, startTime, totalCounts, ...  one value per result
+    experiment                             Experiment IDs as 36 byte strings
+    countrates                             (N, 8) uint32 detector count rates
+    coincidences                           (N, K) int64 coincidence counts
+    patterns                               the K coincidence keys, in column
+                                           order of coincidences
+    skipped                                resultIds of the results left out
+
+    coincidenceCounts are free-form JSON, results with counts that are no
+    integers or out of the int64 range are left out instead of failing the
+    export.
+    """
+    patterns = coincidence_patterns(queryset)
+    columns = {
+        name: _NpyColumn(dtype, typecode)
+        for name, dtype, typecode, converter in NPZ_COLUMNS
+    }
+    experiments = tempfile.TemporaryFile()
+    countrates = _NpyColumn("<u4", "I", (len(DETECTORS),))
+    coincidenceColumns = _NpyColumn("<i8", "q", (len(patterns),))
+    skipped = _NpyColumn("<i8", "q")
+
+    for result in iter_result_rows(queryset):
+        counts = _coincidence_row(result["coincidenceCounts"], patterns)
+        if counts is None:
+            skipped.append((result["resultId"],))
+            continue
+        for name, dtype, typecode, converter in NPZ_COLUMNS:
+            columns[name].append((converter(result[name]),))
+        experiments.write(
+            str(result["experiment"] or "").encode().ljust(36, b"\0")
+        )
+        countrates.append(
+            result["countratePerDetector"][detector] or 0 for detector in DETECTORS
+        )
+        coincidenceColumns.append(counts)
+
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_STORED) as archive:
+        for name, column in columns.items():
+            column.write_npy(archive, name)
+        countrates.write_npy(archive, "countrates")
+        coincidenceColumns.write_npy(archive, "coincidences")
+        skipped.write_npy(archive, "skipped")
+
+        experiments.seek(0)
+        with archive.open("experiment.npy", "w", force_zip64=True) as npy:
+            npy.write(_npy_header("|S36", (countrates.rows,)))
+            shutil.copyfileobj(experiments, npy)
+        experiments.close()
+
+        encoded = [pattern.encode() for pattern in patterns]
+        width = max([len(pattern) for pattern in encoded] + [1])
+        archive.writestr(
+            "patterns.npy",
+            _npy_header("|S{}".format(width), (len(encoded),))
+            + b"".join(pattern.ljust(width, b"\0") for pattern in encoded),
+        )
+
+
+def iter_npz(queryset):
+    """
+    Yields the npz archive of write_npz. The archive is assembled in a
+    temporary file first, zip needs the array sizes before their data.
+    """
+    with tempfile.TemporaryFile() as archive:
+        write_npz(queryset, archive)
+        archive.seek(0)
+        while True:
+            block = archive.read(65536)
+            if not block:
+                break
+            yield block
+
+
+# output query parameter -> (generator, content type, file extension)
+FORMATS = {
+    "ndjson": (iter_ndjson, "application/x-ndjson", "ndjson"),
+    "csv": (iter_csv, "text/csv", "csv"),
+    "npz": (iter_npz, "application/zip", "npz"),
+}
@@ -0,0 +1,160 @@
+"""
+Asynchronous batch ingestion of ExperimentResults.
+
+The batch endpoint only stores the posted results in the StagedResult table
+with one INSERT and acknowledges them. The flush worker (python3 manage.py
+flush_results) validates them and moves them into Countrates, ExperimentData
+and ExperimentResult with a few bulk INSERTs per batch, so the hardware
+controller never waits for the result tables.
+"""
+
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from cdl_rest_api import cache, coincidences, models, serializers, stats
+
+
+def stage(payloads):
+    """
+    Stores posted results for the flush worker and returns their number
+    """
+    models.StagedResult.objects.bulk_create(
+        [models.StagedResult(payload=payload) for payload in payloads],
+        batch_size=1000,
+    )
+    return len(payloads)
+
+
+def pending():
+    """
+    Returns the number of staged results waiting to be stored and of
+    invalid staged results
+    """
+    staged = models.StagedResult.objects
+    return {
+        "pending": staged.filter(error__isnull=True).count(),
+        "failed": staged.filter(error__isnull=False).count(),
+    }
+
+
+def flush(batch_size=None):
+    """
+    Stores up to batch_size staged results in one transaction and returns
+    the number of stored and of invalid results. Invalid results keep their
+    validation errors and are not retried. Concurrent workers take different
+    results (SELECT ... FOR UPDATE SKIP LOCKED on Postgres).
+    """
+    if batch_size is None:
+        batch_size = settings.RESULT_FLUSH_BATCH_SIZE
+    with transaction.atomic():
+        staged = list(
+            models.StagedResult.objects.select_for_update(skip_locked=True)
+            .filter(error__isnull=True)
+            .order_by("id")[:batch_size]
+        )
+        if not staged:
+            return 0, 0
+
+        valid = []
+        failed = []
+        for row in staged:
+            serializer = serializers.StagedResultSerializer(data=row.payload)
+            if serializer.is_valid():
+                valid.append((row, serializer.validated_data))
+            else:
+                row.error = json.dumps(serializer.errors)
+                failed.append(row)
+
+        experimentIds = {
+            data["experiment"] for row, data in valid if data.get("experiment")
+        }
+        experiments = models.Experiment.objects.only(
+            "experimentId", "user_id", "projectId", "reusedFrom"
+        ).in_bulk(experimentIds)
+        stored = []
+        for row, data in valid:
+            experimentId = data.pop("experiment", None)
+            if experimentId is not None and experimentId not in experiments:
+                # same message as ExperimentResultPostSerializer
+                message = 'Invalid pk "{}" - object does not exist.'
+                row.error = json.dumps({"experiment": [message.format(experimentId)]})
+                failed.append(row)
+                continue
+            stored.append((row, experiments.get(experimentId), data))
+
+        try:
+            with transaction.atomic():
+                experimentResults = _store(
+                    [(experiment, data) for row, experiment, data in stored]
+                )
+        except DatabaseError:
+            # a value the database rejects fails the whole batch, store the
+            # results one by one to only fail that one
+            experimentResults, stored = _store_each(stored, failed)
+        stats.results_added(experimentResults)
+        cache.invalidate_experiment(
+            *{experiment.pk for row, experiment, data in stored if experiment}
+        )
+
+        models.StagedResult.objects.filter(
+            pk__in=[row.pk for row, experiment, data in stored]
+        ).delete()
+        models.StagedResult.objects.bulk_update(failed, ["error"])
+    return len(stored), len(failed)
+
+
+def _store_each(stored, failed):
+    """
+    Stores the results one by one, the rows of results the database
+    rejects are added to failed. Returns the results and the stored rows.
+    """
+    experimentResults = []
+    stored_rows = []
+    for row, experiment, data in stored:
+        try:
+            with transaction.atomic():
+                experimentResults += _store([(experiment, data)])
+        except DatabaseError as e:
+            row.error = json.dumps({"non_field_errors": [str(e)]})
+            failed.append(row)
+        else:
+            stored_rows.append((row, experiment, data))
+    return experimentResults, stored_rows
+
+
+def _store(items):
+    """
+    Inserts the validated results, one bulk INSERT per table
+    """
+    countrates = models.bulk_create_with_pks(
+        models.Countrates,
+        [
+            models.Countrates(**data["experimentData"]["countratePerDetector"])
+            for experiment, data in items
+        ],
+    )
+    experimentData = models.bulk_create_with_pks(
+        models.ExperimentData,
+        [
+            models.ExperimentData(
+                countratePerDetector=countratePerDetector,
+                **coincidences.storage_fields(
+                    data["experimentData"].get("coincidenceCounts", {})
+                )
+            )
+            for (experiment, data), countratePerDetector in zip(items, countrates)
+        ],
+    )
+    experimentResults = []
+    for (experiment, data), experimentDataItem in zip(items, experimentData):
+        fields = {
+            field: value for field, value in data.items() if field != "experimentData"
+        }
+        experimentResults.append(
+            models.ExperimentResult(
+                experiment=experiment, experimentData=experimentDataItem, **fields
+            )
+        )
+    return models.ExperimentResult.objects.bulk_create(experimentResults)
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cdl_rest_api import archive, models
+
+
+class Command(BaseCommand):
+    """
+    Moves finished Experiments created more than --days days ago
+    (EXPERIMENT_ARCHIVE_DAYS by default) into the archive (see archive.py).
+    Run it e.g. nightly, followed by collect_orphans.
+
+    python3 manage.py archive_experiments
+    """
+
+    help = "Archives old finished Experiments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None)
+        parser.add_argument("--chunk-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        if days is None:
+            days = settings.EXPERIMENT_ARCHIVE_DAYS
+        queryset = models.Experiment.objects.filter(
+            created__lt=timezone.now() - timedelta(days=days)
+        )
+        archived = archive.archive_experiments(queryset, options["chunk_size"])
+        self.stdout.write("Archived {} Experiments".format(archived))
@@ -0,0 +1,330 @@
+import json
+import os
+import random
+import time
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from cdl_rest_api import cache, ingest, models, scheduler, serializers, stats
+from cdl_rest_api.export import DETECTORS
+
+# prefix of the cdl_rest_api routes, see cdl_webservice/urls.py
+API = "/api2/"
+# statuses of the seeded population, the queue is seeded per measured depth
+STATUSES = ["DONE"] * 85 + ["FAILED"] * 5 + ["RUNNING"] * 10
+
+
+class Command(BaseCommand):
+    """
+    Load generator for the REST API: seeds --users users with --experiments
+    Experiments (most of them DONE with a result including count rates and
+    coincidences), then sends --requests requests to each endpoint through
+    the URL routes and the middleware with signed JWTs, and reports the
+    latency percentiles, queries per request and throughput per endpoint.
+    The queue is measured with exactly --queue-depths queued Experiments,
+    each depth seeded in a savepoint that is rolled back afterwards.
+
+    --save-baseline writes the results as JSON, --baseline compares them
+    with a saved baseline and fails if the p95 latency of an endpoint grew
+    by more than --tolerance or it needs more queries. --queries-only only
+    compares the queries, e.g. with a baseline saved on another machine
+    (see tests.py). All data is created in a transaction that is rolled
+    back at the end.
+
+    python3 manage.py benchmark_api --experiments 5000 --baseline api.json
+    """
+
+    help = "Measures latency, queries and throughput of the API endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--experiments", type=int, default=2000)
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument(
+            "--queue-depths", type=int, nargs="+", default=[100, 1000, 10000]
+        )
+        parser.add_argument("--baseline", default=None)
+        parser.add_argument("--save-baseline", default=None)
+        parser.add_argument("--tolerance", type=float, default=0.25)
+        parser.add_argument("--queries-only", action="store_true")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        self.user = self.client("benchmark-user-0")
+        self.admin = self.client("benchmark-admin", admin=True)
+        results = {}
+        with transaction.atomic():
+            self.computeSettings = [
+                self.compute_settings(rng) for i in range(options["users"])
+            ]
+            experiments = self.seed(rng, options["experiments"], options["users"])
+            # before the endpoints, their submissions are queued as well
+            for depth in sorted(set(options["queue_depths"])):
+                with transaction.atomic():
+                    self.seed(rng, depth, options["users"], "IN QUEUE")
+                    name = "GET experiments/queue depth={}".format(depth)
+                    results[name] = self.measure(
+                        name,
+                        lambda i: self.admin.get(API + "experiments/queue"),
+                        options["requests"],
+                    )
+                    transaction.set_rollback(True)
+            for name, request in self.endpoints(rng, experiments):
+                results[name] = self.measure(name, request, options["requests"])
+            seeded = list(models.Experiment.objects.values_list("pk", flat=True))
+            transaction.set_rollback(True)
+        # the cached representations of the rolled back Experiments
+        cache.invalidate_experiment(*seeded)
+
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options["baseline"]:
+            self.compare(
+                results,
+                options["baseline"],
+                options["tolerance"],
+                options["queries_only"],
+            )
+
+    def client(self, user_id, admin=False):
+        token = jwt.encode(
+            {"sub": user_id, "is_admin": admin, "is_staff": admin},
+            settings.SECRET_KEY,
+        )
+        if isinstance(token, bytes):
+            token = token.decode()
+        return Client(HTTP_AUTHORIZATION="Bearer " + token)
+
+    def endpoints(self, rng, experiments):
+        """
+        Returns (name, function sending the i-th request) of the measured
+        endpoints
+        """
+        own = [e for e in experiments if e.user_id == "benchmark-user-0"]
+        running = [e for e in experiments if e.status == "RUNNING"]
+
+        def post(client, path, data):
+            return client.post(API + path, data, content_type="application/json")
+
+        return [
+            (
+                "POST experiments",
+                lambda i: post(self.user, "experiments", self.experiment(rng)),
+            ),
+            (
+                "POST experiments/bulk (10)",
+                lambda i: post(
+                    self.user,
+                    "experiments/bulk",
+                    [self.experiment(rng) for j in range(10)],
+                ),
+            ),
+            (
+                "GET experiments?limit=100",
+                lambda i: self.user.get(API + "experiments", {"limit": 100}),
+            ),
+            (
+                "GET experiments?fields=summary",
+                lambda i: self.user.get(API + "experiments", {"fields": "summary"}),
+            ),
+            (
+                "GET experiments/<id>",
+                lambda i: self.user.get(
+                    API + "experiments/{}".format(own[i % len(own)].pk)
+                ),
+            ),
+            (
+                "GET experiments/<id>/results",
+                lambda i: self.user.get(
+                    API + "experiments/{}/results".format(own[i % len(own)].pk)
+                ),
+            ),
+            (
+                "GET experiments/stats",
+                lambda i: self.user.get(API + "experiments/stats"),
+            ),
+            (
+                "POST results",
+                lambda i: post(
+                    self.admin,
+                    "results",
+                    self.result(rng, running[i % len(running)]),
+                ),
+            ),
+            (
+                "POST results/batch (100)",
+                lambda i: post(
+                    self.admin,
+                    "results/batch",
+                    [
+                        self.result(rng, running[j % len(running)])
+                        for j in range(i, i + 100)
+                    ],
+                ),
+            ),
+        ]
+
+    def measure(self, name, request, count):
+        """
+        Sends count requests and returns the latency percentiles in ms, the
+        mean number of queries and the throughput in requests/s
+        """
+        timings = []
+        queries = 0
+        for i in range(count):
+            # the query log is bounded, a full log would count 0 queries
+            reset_queries()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = request(i)
+                timings.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise CommandError(
+                    "{} failed with {}: {}".format(
+                        name, response.status_code, response.content[:200]
+                    )
+                )
+            queries += len(context)
+        timings.sort()
+        result = {
+            "p50": 1000 * _percentile(timings, 50),
+            "p95": 1000 * _percentile(timings, 95),
+            "p99": 1000 * _percentile(timings, 99),
+            "queries": queries / count,
+            "throughput": count / sum(timings),
+        }
+        self.stdout.write(
+            "{:<40} p50={p50:8.2f} ms  p95={p95:8.2f} ms  p99={p99:8.2f} ms  "
+            "queries={queries:6.1f}  {throughput:8.1f} req/s".format(name, **result)
+        )
+        return result
+
+    def compare(self, results, path, tolerance, queries_only=False):
+        """
+        Compares the results with the baseline at path, fails on regressions
+        """
+        if not os.path.exists(path):
+            raise CommandError("No baseline at {}.".format(path))
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if not queries_only and result["p95"] > before["p95"] * (1 + tolerance):
+                regressions.append(
+                    "{}: p95 {:.2f} ms, baseline {:.2f} ms".format(
+                        name, result["p95"], before["p95"]
+                    )
+                )
+            if result["queries"] > before["queries"]:
+                regressions.append(
+                    "{}: {:.1f} queries per request, baseline {:.1f}".format(
+                        name, result["queries"], before["queries"]
+                    )
+                )
+        for regression in regressions:
+            self.stderr.write(regression)
+        if regressions:
+            raise CommandError("{} regressions.".format(len(regressions)))
+        self.stdout.write("No regressions against {}".format(path))
+
+    def seed(self, rng, count, users, status=None):
+        """
+        Creates count Experiments spread over users users, the DONE ones
+        with a result, and returns them
+        """
+        experiments = models.Experiment.objects.bulk_create(
+            [
+                models.Experiment(
+                    experimentName="benchmark",
+                    circuitId=rng.randint(1, 23),
+                    maxRuntime=rng.randint(1, 120),
+                    status=status or rng.choice(STATUSES),
+                    user_id="benchmark-user-{}".format(rng.randrange(users)),
+                    projectId="benchmark-project-{}".format(rng.randrange(5)),
+                    ComputeSettings=rng.choice(self.computeSettings),
+                )
+                for i in range(count)
+            ]
+        )
+        stats.experiments_created(experiments)
+        queued = {}
+        for e in experiments:
+            if e.status == "IN QUEUE":
+                queued.setdefault(e.user_id, []).append(e.pk)
+        for user_id, experimentIds in queued.items():
+            scheduler.register_submission(user_id, experimentIds)
+        # results through the batch ingestion, as posted by the hardware
+        ingest.stage(
+            [self.result(rng, e) for e in experiments if e.status == "DONE"]
+        )
+        while sum(ingest.flush()):
+            pass
+        return experiments
+
+    def compute_settings(self, rng):
+        serializer = serializers.ComputeSettingsSerializer(
+            data=self.experiment(rng)["ComputeSettings"]
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def experiment(self, rng):
+        return {
+            "experimentName": "benchmark",
+            "circuitId": rng.randint(1, 23),
+            "projectId": "benchmark-project-{}".format(rng.randrange(5)),
+            "maxRuntime": rng.randint(1, 120),
+            "ComputeSettings": {
+                "clusterState": {"amountQubits": 4, "presetSettings": "linear"},
+                "qubitComputing": {
+                    "circuitAngles": [
+                        {
+                            "circuitAngleName": "alpha",
+                            "circuitAngleValue": rng.randrange(360),
+                        }
+                    ]
+                },
+                "encodedQubitMeasurements": [
+                    {
+                        "encodedQubitIndex": index,
+                        "theta": rng.randrange(180),
+                        "phi": rng.randrange(360),
+                    }
+                    for index in range(1, 5)
+                ],
+            },
+        }
+
+    def result(self, rng, experiment):
+        return {
+            "experiment": str(experiment.pk),
+            "totalCounts": rng.randrange(100000),
+            "numberOfDetectors": 8,
+            "singlePhotonRate": "{:.2f}".format(rng.uniform(0, 1000)),
+            "totalTime": experiment.maxRuntime,
+            "experimentData": {
+                "countratePerDetector": {
+                    detector: rng.randrange(100000) for detector in DETECTORS
+                },
+                "coincidenceCounts": {
+                    a + b: rng.randrange(1000)
+                    for a in DETECTORS
+                    for b in DETECTORS
+                    if a < b
+                },
+            },
+        }
+
+
+def _percentile(timings, percent):
+    # nearest rank of the sorted timings
+    return timings[min(len(timings) - 1, int(len(timings) * percent / 100))]
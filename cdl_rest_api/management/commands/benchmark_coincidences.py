@@ -0,0 +1,102 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Func, Sum
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, Length
+
+from cdl_rest_api import coincidences, models
+
+
+class Command(BaseCommand):
+    """
+    Compares the storage size of coincidenceCounts stored as JSON and stored
+    compactly against the pattern dictionary (see coincidences.py), and the
+    time to sum one coincidence over all rows. All data is created in a
+    transaction that is rolled back at the end.
+
+    python3 manage.py benchmark_coincidences --rows 50000 --detectors 8
+    """
+
+    help = "Compares JSON and compact storage of coincidenceCounts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000)
+        # all pairs of detectors are reported as coincidences
+        parser.add_argument("--detectors", type=int, default=8)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        keys = [
+            "d{}d{}".format(a, b)
+            for a, b in itertools.combinations(range(1, options["detectors"] + 1), 2)
+        ]
+        key = keys[0]
+        with transaction.atomic():
+            for compact in (False, True):
+                models.ExperimentData.objects.bulk_create(
+                    [
+                        models.ExperimentData(
+                            **coincidences.storage_fields(
+                                {k: rng.randrange(100000) for k in keys},
+                                compact=compact,
+                            )
+                        )
+                        for i in range(options["rows"])
+                    ],
+                    batch_size=1000,
+                )
+
+            rows = models.ExperimentData.objects.all()
+            json_rows = rows.filter(coincidencePattern__isnull=True)
+            compact_rows = rows.filter(coincidencePattern__isnull=False)
+            json_bytes = self.size(json_rows, "coincidenceCounts")
+            # plus the 4 byte pattern reference
+            compact_bytes = self.size(compact_rows, "coincidenceValues") + 4
+
+            start = time.perf_counter()
+            json_sum = json_rows.aggregate(
+                total=Sum(
+                    Cast(KeyTextTransform(key, "coincidenceCounts"), FloatField())
+                )
+            )["total"]
+            json_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            read = coincidences.key_reader(key)
+            compact_sum = sum(
+                read(pattern_id, data)
+                for pattern_id, data in compact_rows.values_list(
+                    "coincidencePattern", "coincidenceValues"
+                ).iterator(chunk_size=2000)
+            )
+            compact_time = time.perf_counter() - start
+
+            self.stdout.write(
+                "{} rows, {} coincidences per row".format(options["rows"], len(keys))
+            )
+            self.stdout.write(
+                "json     {:8.1f} bytes/row  sum({})={:.0f} in {:8.1f} ms".format(
+                    json_bytes, key, json_sum, json_time * 1000
+                )
+            )
+            self.stdout.write(
+                "compact  {:8.1f} bytes/row  sum({})={:.0f} in {:8.1f} ms".format(
+                    compact_bytes, key, compact_sum, compact_time * 1000
+                )
+            )
+            transaction.set_rollback(True)
+
+    def size(self, queryset, field):
+        """
+        Average stored size of a column in bytes
+        """
+        if connection.vendor == "postgresql":
+            size = Func(F(field), function="pg_column_size")
+        else:
+            size = Length(field)
+        result = queryset.aggregate(total=Sum(size))["total"]
+        return result / queryset.count()
@@ -0,0 +1,89 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cdl_rest_api import ingest, models, serializers, views
+from cdl_rest_api.export import DETECTORS
+
+
+class Command(BaseCommand):
+    """
+    Compares the result throughput of storing every result on the request
+    thread (POST results) with staging batches (POST results/batch) and
+    flushing them in bulk. All data is created in a transaction that is
+    rolled back at the end.
+
+    python3 manage.py benchmark_ingest --results 5000 --batch 500
+    """
+
+    help = "Measures results/sec of single and batched result ingestion"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--results", type=int, default=5000)
+        parser.add_argument("--batch", type=int, default=500)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with transaction.atomic():
+            experiment = models.Experiment.objects.create(
+                experimentName="benchmark",
+                circuitId=1,
+                status="RUNNING",
+                user_id="benchmark-user",
+            )
+            payloads = [
+                self.payload(rng, experiment) for i in range(options["results"])
+            ]
+
+            # one request per result, as ResultView.create
+            view = views.ResultView()
+            start = time.perf_counter()
+            for payload in payloads:
+                serializer = serializers.ExperimentResultPostSerializer(data=payload)
+                serializer.is_valid(raise_exception=True)
+                view.perform_create(serializer)
+            single = time.perf_counter() - start
+
+            # staged batches, then flushed by the worker
+            start = time.perf_counter()
+            acknowledged = []
+            for i in range(0, len(payloads), options["batch"]):
+                batch_start = time.perf_counter()
+                ingest.stage(payloads[i : i + options["batch"]])
+                acknowledged.append(time.perf_counter() - batch_start)
+            staged = time.perf_counter() - start
+            while sum(ingest.flush()):
+                pass
+            batched = time.perf_counter() - start
+
+            count = len(payloads)
+            self.stdout.write(
+                "single   {:10.0f} results/s".format(count / single)
+            )
+            self.stdout.write(
+                "batched  {:10.0f} results/s acknowledged, {:.0f} results/s "
+                "stored, {:.1f} ms per batch of {}".format(
+                    count / staged,
+                    count / batched,
+                    1000 * sum(acknowledged) / len(acknowledged),
+                    options["batch"],
+                )
+            )
+            transaction.set_rollback(True)
+
+    def payload(self, rng, experiment):
+        return {
+            "experiment": str(experiment.experimentId),
+            "totalCounts": rng.randrange(100000),
+            "numberOfDetectors": 8,
+            "singlePhotonRate": "{:.2f}".format(rng.uniform(0, 1000)),
+            "totalTime": rng.randint(1, 120),
+            "experimentData": {
+                "countratePerDetector": {
+                    detector: rng.randrange(100000) for detector in DETECTORS
+                },
+                "coincidenceCounts": {"d1d2": rng.randrange(1000)},
+            },
+        }
@@ -0,0 +1,66 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cdl_rest_api import models, scheduler
+
+
+class Command(BaseCommand):
+    """
+    Measures how long the scheduler needs to pick the next Experiment
+    depending on the number of queued Experiments. All data is created in a
+    transaction that is rolled back at the end.
+
+    python3 manage.py benchmark_scheduler --depths 100 1000 10000
+    """
+
+    help = "Measures the pick latency of the scheduler against queue depth"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--depths", type=int, nargs="+", default=[100, 1000, 10000]
+        )
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with transaction.atomic():
+            depth = 0
+            for target in sorted(options["depths"]):
+                self.seed(rng, target - depth, options["users"])
+                depth = target
+                timings = self.measure(options["repeat"])
+                self.stdout.write(
+                    "depth={:>8}  median={:8.3f} ms  p95={:8.3f} ms  max={:8.3f} ms".format(
+                        depth,
+                        statistics.median(timings),
+                        timings[int(len(timings) * 0.95) - 1],
+                        timings[-1],
+                    )
+                )
+            transaction.set_rollback(True)
+
+    def seed(self, rng, count, users):
+        for i in range(count):
+            user_id = "benchmark-user-{}".format(rng.randrange(users))
+            experiment = models.Experiment.objects.create(
+                experimentName="benchmark",
+                circuitId=1,
+                maxRuntime=rng.randint(1, 120),
+                priority=1 if rng.random() < 0.05 else 0,
+                status="IN QUEUE",
+                user_id=user_id,
+            )
+            scheduler.register_submission(user_id, [experiment.experimentId])
+
+    def measure(self, repeat):
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            scheduler.pick_next()
+            timings.append((time.perf_counter() - start) * 1000)
+        return sorted(timings)
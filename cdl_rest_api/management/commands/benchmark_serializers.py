@@ -0,0 +1,145 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from cdl_rest_api import models, representations, serializers
+
+
+class Command(BaseCommand):
+    """
+    Compares the rendering of Experiment listings by ExperimentSerializer
+    with the fast read path of representations.py on --experiments
+    Experiments, with the full representation and the ?fields=summary
+    subset. Fails if the two responses differ in a single byte. All data is
+    created in a transaction that is rolled back at the end.
+
+    python3 manage.py benchmark_serializers --experiments 10000
+    """
+
+    help = "Compares ExperimentSerializer with the fast Experiment read path"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--experiments", type=int, default=10000)
+        # distinct ComputeSettings trees, the Experiments share them
+        parser.add_argument("--trees", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with transaction.atomic():
+            self.seed(rng, options["experiments"], options["trees"])
+            queryset = models.Experiment.objects.order_by("created", "experimentId")
+            for name, fields in (
+                ("full", None),
+                ("summary", serializers.ExperimentSerializer.SUMMARY_FIELDS),
+            ):
+                drf = self.measure(
+                    lambda: self.render_serializer(queryset, fields),
+                    options["repeat"],
+                )
+                fast = self.measure(
+                    lambda: representations.render_json(
+                        representations.experiments(
+                            representations.experiment_values(queryset), fields
+                        )
+                    ),
+                    options["repeat"],
+                )
+                if drf["content"] != fast["content"]:
+                    raise CommandError(
+                        "The {} representations differ.".format(name)
+                    )
+                self.stdout.write(
+                    "{:<8} serializer {:8.1f} ms {:6d} queries   "
+                    "fast path {:8.1f} ms {:6d} queries   {:5.1f}x  {} bytes".format(
+                        name,
+                        drf["time"],
+                        drf["queries"],
+                        fast["time"],
+                        fast["queries"],
+                        drf["time"] / fast["time"],
+                        len(fast["content"]),
+                    )
+                )
+            transaction.set_rollback(True)
+
+    def render_serializer(self, queryset, fields):
+        # as ExperimentListView renders it without the fast path, from a
+        # fresh queryset without the rows of the previous run
+        queryset = queryset.all()
+        if fields is None:
+            queryset = queryset.with_compute_settings()
+        serializer = serializers.ExperimentSerializer(
+            queryset, many=True, fields=fields
+        )
+        return JSONRenderer().render(serializer.data)
+
+    def measure(self, render, repeat):
+        """
+        Returns the best time in ms of repeat renders, their queries and the
+        rendered content
+        """
+        best = None
+        for i in range(repeat):
+            # the query log is bounded, a full log would count 0 queries
+            reset_queries()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                content = render()
+                elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return {"time": 1000 * best, "queries": len(context), "content": content}
+
+    def seed(self, rng, count, trees):
+        """
+        Creates count Experiments sharing trees ComputeSettings trees
+        """
+        computeSettings = []
+        for i in range(trees):
+            serializer = serializers.ComputeSettingsSerializer(
+                data={
+                    "clusterState": {"amountQubits": 4, "presetSettings": "linear"},
+                    "qubitComputing": {
+                        "circuitAngles": [
+                            {
+                                "circuitAngleName": name,
+                                "circuitAngleValue": "{:.3f}".format(
+                                    rng.uniform(0, 360)
+                                ),
+                            }
+                            for name in ("alpha", "beta")
+                        ]
+                    },
+                    "encodedQubitMeasurements": [
+                        {
+                            "encodedQubitIndex": index,
+                            "theta": "{:.2f}".format(rng.uniform(0, 180)),
+                            "phi": "{:.2f}".format(rng.uniform(0, 360)),
+                        }
+                        for index in range(1, 5)
+                    ],
+                }
+            )
+            serializer.is_valid(raise_exception=True)
+            computeSettings.append(serializer.save())
+        # in chunks, the parent rows are inserted in one statement
+        for start in range(0, count, 1000):
+            models.Experiment.objects.bulk_create(
+                [
+                    models.Experiment(
+                        experimentName="benchmark – {}".format(i),
+                        circuitId=rng.randint(1, 23),
+                        maxRuntime=rng.randint(1, 120),
+                        status=rng.choice(["DONE", "FAILED", "IN QUEUE", "RUNNING"]),
+                        user_id="benchmark-user-{}".format(rng.randrange(20)),
+                        projectId="benchmark-project-{}".format(rng.randrange(5)),
+                        ComputeSettings=rng.choice(computeSettings),
+                    )
+                    for i in range(start, min(start + 1000, count))
+                ]
+            )
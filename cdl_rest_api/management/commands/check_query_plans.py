@@ -0,0 +1,308 @@
+import random
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from cdl_rest_api import archive, export, models, scheduler
+from cdl_rest_api.pagination import ExperimentPagination
+
+# sequential scans in the EXPLAIN output, by vendor: Postgres prints
+# "Seq Scan on <table>", sqlite "SCAN <table>" unless it scans an index
+SEQUENTIAL_SCANS = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"SCAN (?:TABLE )?(\w+)\b(?! USING (?:COVERING )?INDEX)"),
+}
+
+
+class Command(BaseCommand):
+    """
+    Runs EXPLAIN on the hot queries of the views against a synthetic dataset
+    of --experiments Experiments and fails if one of them reads a large table
+    sequentially, i.e. if an index the query relies on is missing or not
+    used. All data is created in a transaction that is rolled back at the
+    end. Supports Postgres and sqlite.
+
+    python3 manage.py check_query_plans --experiments 20000
+    """
+
+    help = "Checks that the hot queries of the views use indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--experiments", type=int, default=20000)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--verbose-plans", action="store_true")
+
+    def handle(self, *args, **options):
+        pattern = SEQUENTIAL_SCANS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(
+                "EXPLAIN checks are not supported on {}.".format(connection.vendor)
+            )
+        failed = []
+        with transaction.atomic():
+            user_id, experimentId = self.seed(
+                random.Random(0), options["experiments"], options["users"]
+            )
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            all_tables = set(connection.introspection.table_names())
+            for view, queryset, tables in self.queries(user_id, experimentId):
+                plan = queryset.explain()
+                tables = {model._meta.db_table for model in tables}
+                # sqlite names the tables of subqueries by their alias (U0),
+                # which is counted as well
+                scanned = {
+                    table
+                    for table in pattern.findall(plan)
+                    if table in tables or table not in all_tables
+                }
+                verdict = "seq scan on " + ", ".join(sorted(scanned)) if scanned else "ok"
+                self.stdout.write("{:<60} {}".format(view, verdict))
+                if scanned:
+                    failed.append(view)
+                if scanned or options["verbose_plans"]:
+                    self.stdout.write(plan)
+            transaction.set_rollback(True)
+        if failed:
+            raise CommandError(
+                "{} queries read a table sequentially.".format(len(failed))
+            )
+
+    def queries(self, user_id, experimentId):
+        """
+        Returns (view and query, queryset, models that must not be read
+        sequentially) of the hot queries
+        """
+        experiments = models.Experiment.objects.all()
+        user = experiments.filter(user_id=user_id)
+        ordering = ExperimentPagination.ordering
+        latest = user.order_by(*ordering).last()
+        cursor = ExperimentPagination().after(
+            [str(getattr(latest, field)) for field in ordering]
+        )
+        queued = scheduler.queued_experiments()
+        results = models.ExperimentResult.objects.all()
+        Experiment = (models.Experiment, models.ExperimentBase)
+        return [
+            (
+                "ExperimentDetailView: Experiment",
+                experiments.with_compute_settings().filter(
+                    user_id=user_id, experimentId=experimentId
+                ),
+                Experiment,
+            ),
+            (
+                "ExperimentResultView: Experiment with latest result",
+                experiments.with_latest_result().filter(
+                    user_id=user_id, experimentId=experimentId
+                ),
+                Experiment + (models.ExperimentResult,),
+            ),
+            (
+                "ExperimentListView: first page of a user",
+                user.order_by(*ordering)[:100],
+                Experiment,
+            ),
+            (
+                "ExperimentListView: next page of a user",
+                user.filter(cursor).order_by(*ordering)[:100],
+                Experiment,
+            ),
+            (
+                "ExperimentListView: first page of an admin",
+                experiments.order_by(*ordering)[:100],
+                Experiment,
+            ),
+            (
+                "ExperimentBulkView: Experiments of a user in a period",
+                user.filter(created__gte=timezone.now() - timedelta(days=1)),
+                Experiment,
+            ),
+            (
+                "ExperimentArchiveView: archived Experiments of a user",
+                models.ArchivedExperiment.objects.filter(user_id=user_id).order_by(
+                    "created"
+                ),
+                (models.ArchivedExperiment,),
+            ),
+            (
+                "ExperimentArchiveView: archivable Experiments",
+                experiments.filter(
+                    status__in=archive.ARCHIVE_STATUSES,
+                    created__lt=timezone.now() - timedelta(days=365),
+                ).order_by("pk")[:500],
+                Experiment,
+            ),
+            (
+                "ExperimentQueueView: priority tier",
+                queued.order_by("-priority").values_list("priority")[:1],
+                Experiment,
+            ),
+            (
+                "ExperimentQueueView: next Experiment of a user",
+                queued.filter(priority=0, user_id=user_id).order_by(
+                    *scheduler.SCHEDULE_ORDER
+                )[:1],
+                Experiment,
+            ),
+            (
+                "ExperimentClaimView: expired leases",
+                experiments.filter(status="RUNNING", leaseExpires__lt=timezone.now()),
+                Experiment,
+            ),
+            (
+                "ExperimentListView: reusable results",
+                results.filter(
+                    experiment__configurationHash__in=["0" * 64],
+                    experiment__status="DONE",
+                    experiment__reusedFrom__isnull=True,
+                ).order_by("-id"),
+                Experiment + (models.ExperimentResult,),
+            ),
+            (
+                "ExperimentSampleView: samples after a cursor",
+                models.CountrateSample.objects.filter(
+                    experiment=experimentId, id__gt=0
+                ).order_by("id")[:1000],
+                (models.CountrateSample,),
+            ),
+            (
+                "ExperimentStatsView: statistics of a user",
+                models.ExperimentStats.objects.filter(user_id=user_id),
+                (models.ExperimentStats,),
+            ),
+            (
+                "ResultExportView: results of a user",
+                export.filter_results(results, {}, _User(user_id)).order_by("id"),
+                Experiment,
+            ),
+            (
+                "ResultBatchView: pending staged results",
+                models.StagedResult.objects.filter(error__isnull=True).order_by("id")[
+                    :500
+                ],
+                (models.StagedResult,),
+            ),
+            (
+                "collect_orphans: detached results",
+                results.filter(detached__lt=timezone.now() - timedelta(days=1)),
+                (models.ExperimentResult,),
+            ),
+        ]
+
+    def seed(self, rng, count, users):
+        """
+        Creates count Experiments of users users, most of them DONE with one
+        result, and the rows of the other hot tables. Returns a user and one
+        of their Experiments.
+        """
+        now = timezone.now()
+        statuses = ["DONE"] * 90 + ["FAILED"] * 4 + ["IN QUEUE"] * 4 + ["RUNNING"]
+        experiments = []
+        for i in range(count):
+            status = rng.choice(statuses)
+            experiments.append(
+                models.Experiment(
+                    experimentName="plan",
+                    circuitId=1,
+                    maxRuntime=rng.randint(1, 120),
+                    status=status,
+                    user_id="plan-user-{}".format(rng.randrange(users)),
+                    projectId="plan-project-{}".format(rng.randrange(users)),
+                    configurationHash="{:064x}".format(rng.getrandbits(256)),
+                    leaseExpires=now if status == "RUNNING" else None,
+                )
+            )
+        models.Experiment.objects.bulk_create(experiments)
+        # spread the submissions over two years, auto_now_add sets now
+        for experiment in experiments:
+            experiment.created = now - timedelta(minutes=rng.randrange(10 ** 6))
+        models.Experiment.objects.bulk_update(
+            experiments, ["created"], batch_size=1000
+        )
+
+        finished = [e for e in experiments if e.status == "DONE"]
+        models.ExperimentResult.objects.bulk_create(
+            [
+                models.ExperimentResult(
+                    experiment=experiment,
+                    totalCounts=100,
+                    numberOfDetectors=8,
+                    singlePhotonRate=1,
+                    totalTime=experiment.maxRuntime,
+                )
+                for experiment in finished
+            ]
+            # detached results of deleted Experiments
+            + [
+                models.ExperimentResult(
+                    totalCounts=100,
+                    numberOfDetectors=8,
+                    singlePhotonRate=1,
+                    totalTime=1,
+                    detached=now,
+                )
+                for i in range(count // 100)
+            ],
+            batch_size=1000,
+        )
+        models.CountrateSample.objects.bulk_create(
+            [
+                models.CountrateSample(
+                    experiment=experiment,
+                    time=now - timedelta(seconds=i),
+                    interval=1,
+                    d1=i,
+                )
+                for experiment in finished[:100]
+                for i in range(100)
+            ],
+            batch_size=1000,
+        )
+        models.ArchivedExperiment.objects.bulk_create(
+            [
+                models.ArchivedExperiment(
+                    experimentId=experiment.pk,
+                    user_id=experiment.user_id,
+                    experimentName="plan",
+                    created=experiment.created,
+                    data=b"",
+                )
+                for experiment in finished[: count // 2]
+            ],
+            batch_size=1000,
+        )
+        models.ExperimentStats.objects.bulk_create(
+            [
+                models.ExperimentStats(
+                    user_id="plan-user-{}".format(user),
+                    projectId="plan-project-{}".format(project),
+                )
+                for user in range(users)
+                for project in range(users)
+            ],
+            batch_size=1000,
+        )
+        models.StagedResult.objects.bulk_create(
+            [
+                models.StagedResult(payload={}, error="invalid")
+                for i in range(count // 10)
+            ],
+            batch_size=1000,
+        )
+        experiment = rng.choice(finished)
+        return experiment.user_id, experiment.experimentId
+
+
+class _User:
+    """
+    Non-admin origin user for the filters of the views
+    """
+
+    is_admin = False
+
+    def __init__(self, id):
+        self.id = id
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cdl_rest_api import orphans
+
+
+class Command(BaseCommand):
+    """
+    Deletes rows that are no longer reachable from any Experiment, e.g. the
+    results and ComputeSettings of deleted Experiments (see orphans.py).
+    --dry-run only reports them, --interval keeps running and collects every
+    given number of seconds.
+
+    python3 manage.py collect_orphans
+    """
+
+    help = "Deletes unreachable results, data and settings rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument("--chunk-size", type=int, default=None)
+        parser.add_argument("--pause", type=float, default=None)
+        parser.add_argument("--interval", type=float, default=None)
+
+    def handle(self, *args, **options):
+        if options["dry_run"]:
+            self.report("Unreachable", orphans.count())
+            return
+        while True:
+            close_old_connections()
+            started = time.monotonic()
+            deleted = orphans.collect(options["chunk_size"], options["pause"])
+            self.report("Deleted", deleted)
+            self.stdout.write(
+                "Collected {} rows in {:.1f} s".format(
+                    sum(deleted.values()), time.monotonic() - started
+                )
+            )
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
+
+    def report(self, label, rows):
+        for name, count in rows.items():
+            self.stdout.write("{} {}: {}".format(label, name, count))
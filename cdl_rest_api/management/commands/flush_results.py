@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cdl_rest_api import ingest
+
+
+class Command(BaseCommand):
+    """
+    Flush worker of the batch result ingestion: stores the results staged
+    by results/batch (see ingest.py). Runs until stopped, with --once only
+    until no staged results are left.
+
+    python3 manage.py flush_results
+    """
+
+    help = "Stores staged results in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true")
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.RESULT_FLUSH_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--interval", type=float, default=settings.RESULT_FLUSH_INTERVAL
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            stored, failed = ingest.flush(options["batch_size"])
+            if stored or failed:
+                self.stdout.write(
+                    "Stored {} results, {} invalid".format(stored, failed)
+                )
+            # a full batch means there are probably more staged results
+            if stored + failed < options["batch_size"]:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from cdl_rest_api import stats
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the materialized Experiment statistics (ExperimentStats) from
+    the Experiments and results, e.g. after changing data by hand.
+
+    python3 manage.py rebuild_stats
+    """
+
+    help = "Rebuilds the per user and project Experiment statistics"
+
+    def handle(self, *args, **options):
+        rows = stats.rebuild()
+        self.stdout.write("Rebuilt {} statistics rows".format(rows))
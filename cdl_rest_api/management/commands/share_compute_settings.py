@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from cdl_rest_api import configurations
+
+
+class Command(BaseCommand):
+    """
+    Merges identical ComputeSettings trees stored before they were shared
+    (see ComputeSettings.settingsHash). The merged trees are left without
+    Experiments and deleted by collect_orphans.
+
+    python3 manage.py share_compute_settings
+    """
+
+    help = "Merges identical ComputeSettings trees stored before they were shared"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        hashed, merged = configurations.share_compute_settings(options["batch_size"])
+        self.stdout.write(
+            "Hashed {} ComputeSettings, merged {} identical ones".format(hashed, merged)
+        )
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0011_auto_20220906_0514'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='leaseExpires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='workerId',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:15
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def copy_max_runtime(apps, schema_editor):
+    """
+    Fills runtimeEstimate of existing Experiments from ExperimentBase
+    """
+    Experiment = apps.get_model('cdl_rest_api', 'Experiment')
+    ExperimentBase = apps.get_model('cdl_rest_api', 'ExperimentBase')
+    Experiment.objects.update(
+        runtimeEstimate=models.Subquery(
+            ExperimentBase.objects.filter(
+                pk=models.OuterRef('experimentbase_ptr')
+            ).values('maxRuntime')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0012_auto_20261018_1011'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerAccount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=255, unique=True)),
+                ('weight', models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)])),
+                ('virtualTime', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='runtimeEstimate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_max_runtime, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(condition=models.Q(status='IN QUEUE'), fields=['-priority', 'user_id', 'runtimeEstimate', 'created'], name='experiment_schedule_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduleraccount',
+            index=models.Index(fields=['virtualTime'], name='scheduleraccount_vtime_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0013_auto_20261018_1015'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(fields=['created', 'experimentId'], name='experiment_created_idx'),
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:30
+
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+
+# frozen copy of stats.STATUS_FIELDS
+STATUS_FIELDS = {
+    "INITIAL": "initialCount",
+    "IN QUEUE": "inQueueCount",
+    "RUNNING": "runningCount",
+    "FAILED": "failedCount",
+    "DONE": "doneCount",
+}
+
+
+def rebuild_stats(apps, schema_editor):
+    """
+    Fills ExperimentStats from the existing Experiments and results, a
+    frozen copy of stats.rebuild at this migration
+    """
+    Experiment = apps.get_model("cdl_rest_api", "Experiment")
+    ExperimentResult = apps.get_model("cdl_rest_api", "ExperimentResult")
+    ExperimentStats = apps.get_model("cdl_rest_api", "ExperimentStats")
+
+    rows = defaultdict(Counter)
+    for row in Experiment.objects.values("user_id", "projectId", "status").annotate(
+        experiments=Count("experimentId")
+    ):
+        field = STATUS_FIELDS.get(row["status"])
+        if field is not None:
+            rows[(row["user_id"], row["projectId"] or "")][field] += row["experiments"]
+
+    for row in (
+        ExperimentResult.objects.filter(experiment__isnull=False)
+        .values("experiment__user_id", "experiment__projectId")
+        .annotate(
+            resultCount=Count("id"),
+            totalCounts=Sum("totalCounts"),
+            totalTime=Sum("totalTime"),
+        )
+    ):
+        rows[(row["experiment__user_id"], row["experiment__projectId"] or "")].update(
+            resultCount=row["resultCount"],
+            totalCounts=row["totalCounts"],
+            totalTime=row["totalTime"],
+        )
+
+    for row in (
+        Experiment.objects.filter(started__isnull=False, created__isnull=False)
+        .values("user_id", "projectId")
+        .annotate(
+            queueWaitCount=Count("experimentId"),
+            queueWaitTime=Sum(
+                ExpressionWrapper(
+                    F("started") - F("created"), output_field=DurationField()
+                )
+            ),
+        )
+    ):
+        rows[(row["user_id"], row["projectId"] or "")].update(
+            queueWaitCount=row["queueWaitCount"],
+            queueWaitTime=row["queueWaitTime"].total_seconds(),
+        )
+
+    ExperimentStats.objects.bulk_create(
+        [
+            ExperimentStats(user_id=user_id, projectId=projectId, **counters)
+            for (user_id, projectId), counters in rows.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0014_auto_20261018_1018'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperimentStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=255)),
+                ('projectId', models.CharField(blank=True, default='', max_length=255)),
+                ('initialCount', models.IntegerField(default=0)),
+                ('inQueueCount', models.IntegerField(default=0)),
+                ('runningCount', models.IntegerField(default=0)),
+                ('failedCount', models.IntegerField(default=0)),
+                ('doneCount', models.IntegerField(default=0)),
+                ('resultCount', models.IntegerField(default=0)),
+                ('totalCounts', models.BigIntegerField(default=0)),
+                ('totalTime', models.BigIntegerField(default=0)),
+                ('queueWaitCount', models.IntegerField(default=0)),
+                ('queueWaitTime', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='experimentstats',
+            index=models.Index(fields=['projectId'], name='experimentstats_project_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='experimentstats',
+            constraint=models.UniqueConstraint(fields=('user_id', 'projectId'), name='experimentstats_user_project_uniq'),
+        ),
+        migrations.RunPython(rebuild_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0015_auto_20261018_1030'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoincidencePattern',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=40, unique=True)),
+                ('keys', models.JSONField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='experimentdata',
+            name='coincidenceValues',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='experimentdata',
+            name='coincidencePattern',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='cdl_rest_api.coincidencepattern'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0016_auto_20261018_1034'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StagedResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField()),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('error', models.TextField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stagedresult',
+            index=models.Index(condition=models.Q(error__isnull=True), fields=['id'], name='stagedresult_pending_idx'),
+        ),
+    ]
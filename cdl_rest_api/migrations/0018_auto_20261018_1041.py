@@ -0,0 +1,53 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:41
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_brin_index(apps, schema_editor):
+    """
+    BRIN index on the sample time, only supported by Postgres
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX countratesample_time_brin ON "
+            "cdl_rest_api_countratesample USING brin (time)"
+        )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS countratesample_time_brin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0017_auto_20261018_1037'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountrateSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('interval', models.FloatField(validators=[django.core.validators.MinValueValidator(0)])),
+                ('d1', models.PositiveIntegerField(blank=True, null=True)),
+                ('d2', models.PositiveIntegerField(blank=True, null=True)),
+                ('d3', models.PositiveIntegerField(blank=True, null=True)),
+                ('d4', models.PositiveIntegerField(blank=True, null=True)),
+                ('d5', models.PositiveIntegerField(blank=True, null=True)),
+                ('d6', models.PositiveIntegerField(blank=True, null=True)),
+                ('d7', models.PositiveIntegerField(blank=True, null=True)),
+                ('d8', models.PositiveIntegerField(blank=True, null=True)),
+                ('experiment', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cdl_rest_api.experiment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='countratesample',
+            index=models.Index(fields=['experiment', 'id'], name='countratesample_cursor_idx'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
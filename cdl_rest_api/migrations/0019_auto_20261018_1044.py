@@ -0,0 +1,116 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:44
+
+import hashlib
+import json
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# frozen copy of the canonical hashing of configurations.py at this migration
+
+
+def _decimal(value, places):
+    if value is None:
+        return None
+    return "{:.{}f}".format(Decimal(value), places)
+
+
+def _sorted(items):
+    return sorted(items, key=json.dumps)
+
+
+def configuration_hash(experiment):
+    computeSettings = experiment.ComputeSettings
+    if computeSettings is None:
+        return None
+    clusterState = computeSettings.clusterState
+    qubitComputing = computeSettings.qubitComputing
+    canonical = {
+        "circuitId": experiment.circuitId,
+        "clusterState": [
+            clusterState.amountQubits if clusterState is not None else None,
+            clusterState.presetSettings if clusterState is not None else None,
+        ],
+        "encodedQubitMeasurements": _sorted(
+            [
+                measurement.encodedQubitIndex,
+                _decimal(measurement.theta, 2),
+                _decimal(measurement.phi, 2),
+            ]
+            for measurement in computeSettings.encodedQubitMeasurements.all()
+        ),
+        "circuitAngles": _sorted(
+            [angle.circuitAngleName, _decimal(angle.circuitAngleValue, 3)]
+            for angle in (
+                qubitComputing.circuitAngles.all()
+                if qubitComputing is not None
+                else []
+            )
+        ),
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def hash_experiments(apps, schema_editor, batch_size=1000):
+    """
+    Computes the configurationHash of the existing Experiments in batches
+    """
+    Experiment = apps.get_model("cdl_rest_api", "Experiment")
+    queryset = (
+        Experiment.objects.select_related(
+            "ComputeSettings__clusterState", "ComputeSettings__qubitComputing"
+        )
+        .prefetch_related(
+            "ComputeSettings__encodedQubitMeasurements",
+            "ComputeSettings__qubitComputing__circuitAngles",
+        )
+        .order_by("experimentId")
+    )
+    experiments = list(queryset[:batch_size])
+    while experiments:
+        for experiment in experiments:
+            experiment.configurationHash = configuration_hash(experiment)
+        Experiment.objects.bulk_update(experiments, ["configurationHash"])
+        experiments = list(
+            queryset.filter(experimentId__gt=experiments[-1].experimentId)[
+                :batch_size
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0018_auto_20261018_1041'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='configurationHash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='reusedFrom',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='cdl_rest_api.experiment'),
+        ),
+        migrations.AddField(
+            model_name='experimentstats',
+            name='reusedCount',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='experimentstats',
+            name='savedTime',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(fields=['configurationHash'], name='experiment_config_hash_idx'),
+        ),
+        migrations.RunPython(hash_experiments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0019_auto_20261018_1044'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='computesettings',
+            name='settingsHash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0020_computesettings_settingshash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedExperiment',
+            fields=[
+                ('experimentId', models.UUIDField(primary_key=True, serialize=False)),
+                ('user_id', models.CharField(max_length=255)),
+                ('projectId', models.CharField(blank=True, max_length=255, null=True)),
+                ('experimentName', models.CharField(max_length=255)),
+                ('status', models.CharField(blank=True, max_length=255, null=True)),
+                ('created', models.DateTimeField()),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='experiment',
+            name='reusedFrom',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='cdl_rest_api.experiment'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedexperiment',
+            index=models.Index(fields=['user_id', 'created'], name='archivedexperiment_user_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0021_auto_20261018_1051'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(fields=['user_id', 'created', 'experimentId'], name='experiment_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(condition=models.Q(status='RUNNING'), fields=['leaseExpires'], name='experiment_lease_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='experimentresult',
+            index=models.Index(fields=['experiment', '-id'], name='experimentresult_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='experimentresult',
+            index=models.Index(condition=models.Q(experiment__isnull=True), fields=['startTime'], name='experimentresult_detached_idx'),
+        ),
+        # the foreign key index is dropped once experimentresult_latest_idx
+        # covers its lookups
+        migrations.AlterField(
+            model_name='experimentresult',
+            name='experiment',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cdl_rest_api.experiment'),
+        ),
+    ]
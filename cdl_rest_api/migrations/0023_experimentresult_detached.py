@@ -0,0 +1,32 @@
+# Generated by Django 3.1.13 on 2026-10-18 11:57
+
+import cdl_rest_api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cdl_rest_api', '0022_auto_20261018_1055'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='experimentresult',
+            name='experimentresult_detached_idx',
+        ),
+        migrations.AddField(
+            model_name='experimentresult',
+            name='detached',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='experimentresult',
+            name='experiment',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=cdl_rest_api.models.detach_result, to='cdl_rest_api.experiment'),
+        ),
+        migrations.AddIndex(
+            model_name='experimentresult',
+            index=models.Index(condition=models.Q(detached__isnull=False), fields=['detached'], name='experimentresult_detached_idx'),
+        ),
+    ]
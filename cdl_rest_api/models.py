@@ -3,8 +3,11 @@ from builtins import dict
 
 from django.contrib.auth.models import (AbstractBaseUser, BaseUserManager,
                                         PermissionsMixin)
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
 
 
 class QubitMeasurementItem(models.Model):
@@ -141,6 +144,11 @@ class ComputeSettings(models.Model):
         on_delete=models.SET_NULL,
         null=True,
     )
+    # SHA-256 of the canonical tree (see configurations.py). Trees are
+    # immutable and stored once per hash, Experiments with identical settings
+    # share them. Empty for trees stored before, until they are merged with
+    # python3 manage.py share_compute_settings.
+    settingsHash = models.CharField(max_length=64, unique=True, blank=True, null=True)
 
 
 class ExperimentBase(models.Model):
@@ -183,6 +191,128 @@ class ExperimentBase(models.Model):
     )
 
 
+def bulk_create_with_pks(model, objs):
+    """
+    bulk_create that sets the primary keys of the created objects on all
+    backends. Backends that cannot return rows from a bulk insert (sqlite in
+    development) fall back to one INSERT per object.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs)
+    for obj in objs:
+        obj.save(force_insert=True)
+    return objs
+
+
+class ExperimentQuerySet(models.QuerySet):
+    """
+    QuerySet of the Experiment model
+    """
+
+    # relations of the ComputeSettings tree rendered by ExperimentSerializer:
+    # the one-to-one relations are joined, the lists are prefetched
+    COMPUTE_SETTINGS_JOINS = (
+        "ComputeSettings__clusterState",
+        "ComputeSettings__qubitComputing",
+    )
+    COMPUTE_SETTINGS_PREFETCHES = (
+        "ComputeSettings__encodedQubitMeasurements",
+        "ComputeSettings__qubitComputing__circuitAngles",
+    )
+
+    def with_compute_settings(self):
+        """
+        Loads the nested ComputeSettings tree rendered by ExperimentSerializer
+        with a fixed number of queries, independent of the number of
+        Experiments. Without it every Experiment lazily loads its
+        ComputeSettings, clusterState, qubitComputing, encodedQubitMeasurements
+        and circuitAngles one by one.
+        """
+        return self.select_related(*self.COMPUTE_SETTINGS_JOINS).prefetch_related(
+            *self.COMPUTE_SETTINGS_PREFETCHES
+        )
+
+    def accessible_by(self, origin_user):
+        """
+        Restricts the Experiments to those the user may access: admin users
+        access all Experiments, other users only their own
+        """
+        if origin_user.is_admin:
+            return self.all()
+        return self.filter(user_id=origin_user.id)
+
+    def with_latest_result(self):
+        """
+        Annotates the fields of the latest ExperimentResult of every
+        Experiment, so the Experiment and its latest result are read in one
+        query. Each field is a correlated subquery on the experiment foreign
+        key index, see Experiment.latest_result.
+        """
+        latest = ExperimentResult.objects.filter(experiment=OuterRef("pk")).order_by(
+            "-id"
+        )
+        return self.annotate(
+            **{
+                Experiment.LATEST_RESULT_PREFIX
+                + field.attname: Subquery(latest.values(field.attname)[:1])
+                for field in Experiment.latest_result_fields()
+            }
+        )
+
+    def get_accessible(self, origin_user, experiment_id):
+        """
+        Returns the Experiment with the given ID if the user may access it,
+        otherwise None (also for IDs that are not a UUID)
+        """
+        try:
+            return self.accessible_by(origin_user).get(experimentId=experiment_id)
+        except (self.model.DoesNotExist, ValidationError):
+            return None
+
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False):
+        """
+        Django refuses bulk_create for multi-table inherited models, as the
+        primary keys of the parent rows are needed for the child rows. This
+        inserts the ExperimentBase rows first and then all Experiment rows
+        with their parent links in batched INSERTs.
+        """
+        objs = list(objs)
+        parent_fields = [
+            field
+            for field in ExperimentBase._meta.concrete_fields
+            if not field.primary_key
+        ]
+        parents = bulk_create_with_pks(
+            ExperimentBase,
+            [
+                ExperimentBase(
+                    **{
+                        field.attname: getattr(obj, field.attname)
+                        for field in parent_fields
+                    }
+                )
+                for obj in objs
+            ],
+        )
+        for obj, parent in zip(objs, parents):
+            obj.id = obj.experimentbase_ptr_id = parent.pk
+            # see Experiment.save
+            obj.runtimeEstimate = obj.maxRuntime
+
+        fields = self.model._meta.local_concrete_fields
+        batch_size = max(batch_size or connection.ops.bulk_batch_size(fields, objs), 1)
+        for start in range(0, len(objs), batch_size):
+            self._insert(
+                objs[start : start + batch_size],
+                fields=fields,
+                ignore_conflicts=ignore_conflicts,
+            )
+        for obj in objs:
+            obj._state.adding = False
+            obj._state.db = self.db
+        return objs
+
+
 class Experiment(ExperimentBase):
     """
     Defines additional fields set by the server with ExperimentBase
@@ -211,6 +341,211 @@ class Experiment(ExperimentBase):
     # assign Results to user if needed).
     # Link to a user in iam user service.
     user_id = models.CharField(max_length=255, blank=False, null=False)
+    # identifies the hardware controller (worker) that claimed the experiment
+    # from the queue; the claim is only valid until leaseExpires, afterwards
+    # the experiment is put back into the queue (see queue.py)
+    workerId = models.CharField(max_length=255, blank=True, null=True)
+    leaseExpires = models.DateTimeField(blank=True, null=True)
+    # Experiments with higher priority are scheduled first (see scheduler.py),
+    # only admin users can set it
+    priority = models.PositiveSmallIntegerField(default=0)
+    # copy of ExperimentBase.maxRuntime, which lives in the parent table, so
+    # the queue index below covers the whole scheduling order
+    runtimeEstimate = models.PositiveIntegerField(blank=True, null=True)
+    # set when a worker claims the Experiment for the first time, the queue
+    # wait time is started - created (see stats.py)
+    started = models.DateTimeField(blank=True, null=True)
+    # SHA-256 of the canonical circuitId and ComputeSettings, equal for
+    # physically identical Experiments (see configurations.py)
+    configurationHash = models.CharField(max_length=64, blank=True, null=True)
+    # Experiment whose result was reused instead of running this one. Kept
+    # when that Experiment is deleted or archived, the statistics count the
+    # result as reused either way.
+    reusedFrom = models.ForeignKey(
+        "self",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        blank=True,
+        null=True,
+        related_name="+",
+    )
+
+    objects = ExperimentQuerySet.as_manager()
+
+    # prefix of the annotations of ExperimentQuerySet.with_latest_result
+    LATEST_RESULT_PREFIX = "latestResult_"
+
+    class Meta:
+        indexes = [
+            # partial index over the queue only: one index range per priority
+            # tier and user, shortest job first within it
+            models.Index(
+                fields=["-priority", "user_id", "runtimeEstimate", "created"],
+                name="experiment_schedule_idx",
+                condition=models.Q(status="IN QUEUE"),
+            ),
+            # keyset pagination of listings (see pagination.py)
+            models.Index(
+                fields=["created", "experimentId"],
+                name="experiment_created_idx",
+            ),
+            # listings and bulk filters of one user, in the same order
+            models.Index(
+                fields=["user_id", "created", "experimentId"],
+                name="experiment_user_created_idx",
+            ),
+            # expired leases, only over the running Experiments (see queue.py)
+            models.Index(
+                fields=["leaseExpires"],
+                name="experiment_lease_idx",
+                condition=models.Q(status="RUNNING"),
+            ),
+            models.Index(
+                fields=["configurationHash"],
+                name="experiment_config_hash_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.runtimeEstimate = self.maxRuntime
+        super().save(*args, **kwargs)
+
+    @property
+    def latest_result(self):
+        """
+        The latest ExperimentResult of the Experiment, or None. Only available
+        on Experiments loaded with ExperimentQuerySet.with_latest_result, the
+        result is built from the annotations without another query.
+        """
+        if getattr(self, self.LATEST_RESULT_PREFIX + "id") is None:
+            return None
+        fields = self.latest_result_fields()
+        result = ExperimentResult.from_db(
+            self._state.db,
+            [field.attname for field in fields],
+            [
+                getattr(self, self.LATEST_RESULT_PREFIX + field.attname)
+                for field in fields
+            ],
+        )
+        result.experiment = self
+        return result
+
+    @staticmethod
+    def latest_result_fields():
+        """
+        Fields of ExperimentResult annotated by with_latest_result, the
+        experiment is the annotated Experiment itself
+        """
+        return [
+            field
+            for field in ExperimentResult._meta.concrete_fields
+            if field.name != "experiment"
+        ]
+
+
+class ArchivedExperiment(models.Model):
+    """
+    Experiment moved out of the hot tables together with its results and
+    count rate samples, stored as one compressed document (see archive.py).
+    Restored on access.
+    """
+
+    experimentId = models.UUIDField(primary_key=True)
+    user_id = models.CharField(max_length=255)
+    projectId = models.CharField(max_length=255, blank=True, null=True)
+    experimentName = models.CharField(max_length=255)
+    status = models.CharField(max_length=255, null=True, blank=True)
+    created = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+    # zlib compressed JSON document
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user_id", "created"], name="archivedexperiment_user_idx"
+            ),
+        ]
+
+
+class SchedulerAccount(models.Model):
+    """
+    Fair-share bookkeeping of the scheduler for one user. Every scheduled
+    Experiment advances the virtual time of its user by maxRuntime / weight,
+    the user with the smallest virtual time is served next.
+    """
+
+    user_id = models.CharField(max_length=255, unique=True)
+    # share of the hardware time relative to other users
+    weight = models.PositiveIntegerField(
+        validators=[
+            MinValueValidator(1),
+        ],
+        default=1,
+    )
+    virtualTime = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["virtualTime"], name="scheduleraccount_vtime_idx"),
+        ]
+
+
+class ExperimentStats(models.Model):
+    """
+    Materialized statistics of the Experiments of one user in one project,
+    updated incrementally whenever an Experiment changes its status or a
+    result is stored (see stats.py), so reading them is a lookup of a few
+    rows instead of a scan over all Experiments and results
+    """
+
+    user_id = models.CharField(max_length=255)
+    # empty for Experiments without projectId
+    projectId = models.CharField(max_length=255, blank=True, default="")
+    # number of Experiments per status
+    initialCount = models.IntegerField(default=0)
+    inQueueCount = models.IntegerField(default=0)
+    runningCount = models.IntegerField(default=0)
+    failedCount = models.IntegerField(default=0)
+    doneCount = models.IntegerField(default=0)
+    # number of ExperimentResults and the sums of their totalCounts and
+    # totalTime (hardware time in seconds)
+    resultCount = models.IntegerField(default=0)
+    totalCounts = models.BigIntegerField(default=0)
+    totalTime = models.BigIntegerField(default=0)
+    # number of claimed Experiments and their total wait in the queue in
+    # seconds
+    queueWaitCount = models.IntegerField(default=0)
+    queueWaitTime = models.FloatField(default=0)
+    # number of results reused from identical Experiments and the hardware
+    # time in seconds they saved, not part of totalTime (see
+    # configurations.py)
+    reusedCount = models.IntegerField(default=0)
+    savedTime = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_id", "projectId"],
+                name="experimentstats_user_project_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["projectId"], name="experimentstats_project_idx"),
+        ]
+
+
+def detach_result(collector, field, sub_objs, using):
+    """
+    on_delete of ExperimentResult.experiment: SET_NULL that also records
+    when the result was detached, only these results are deleted by the
+    garbage collector (see orphans.py)
+    """
+    collector.add_field_update(field, None, sub_objs)
+    collector.add_field_update(
+        field.model._meta.get_field("detached"), timezone.now(), sub_objs
+    )
 
 
 class ExperimentResult(models.Model):
@@ -232,16 +567,92 @@ class ExperimentResult(models.Model):
         max_digits=8,
     )
     totalTime = models.PositiveIntegerField()
+    # indexed by experimentresult_latest_idx
     experiment = models.ForeignKey(
         "Experiment",
-        on_delete=models.SET_NULL,
+        on_delete=detach_result,
         blank=True,
         null=True,
+        db_index=False,
     )
+    # set when the Experiment is deleted, results posted without Experiment
+    # are not detached and kept
+    detached = models.DateTimeField(blank=True, null=True)
     experimentData = models.ForeignKey(
         "ExperimentData", on_delete=models.SET_NULL, blank=True, null=True
     )
 
+    class Meta:
+        indexes = [
+            # results of an Experiment, the latest one first (see
+            # ExperimentQuerySet.with_latest_result)
+            models.Index(
+                fields=["experiment", "-id"], name="experimentresult_latest_idx"
+            ),
+            # detached results of deleted Experiments (see orphans.py)
+            models.Index(
+                fields=["detached"],
+                name="experimentresult_detached_idx",
+                condition=models.Q(detached__isnull=False),
+            ),
+        ]
+
+
+class StagedResult(models.Model):
+    """
+    ExperimentResult accepted by the batch ingestion endpoint but not yet
+    stored. The flush worker (python3 manage.py flush_results) moves staged
+    results into ExperimentResult in bulk, see ingest.py.
+    """
+
+    # the result as posted, in the format of ExperimentResultPostSerializer
+    payload = models.JSONField()
+    received = models.DateTimeField(auto_now_add=True)
+    # validation errors, invalid results stay staged for inspection
+    error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # pending results in arrival order
+            models.Index(
+                fields=["id"],
+                name="stagedresult_pending_idx",
+                condition=models.Q(error__isnull=True),
+            ),
+        ]
+
+
+class CountrateSample(models.Model):
+    """
+    Detector count rates of one interval of a running Experiment, posted by
+    the hardware controller while the Experiment runs. Samples are only
+    appended and read in order (see samples.py). On Postgres the time column
+    has a BRIN index, which stays tiny because samples arrive in time order.
+    """
+
+    # indexed by countratesample_cursor_idx
+    experiment = models.ForeignKey(
+        "Experiment", on_delete=models.CASCADE, db_index=False
+    )
+    # end of the interval
+    time = models.DateTimeField()
+    # length of the interval in seconds
+    interval = models.FloatField(validators=[MinValueValidator(0)])
+    d1 = models.PositiveIntegerField(null=True, blank=True)
+    d2 = models.PositiveIntegerField(null=True, blank=True)
+    d3 = models.PositiveIntegerField(null=True, blank=True)
+    d4 = models.PositiveIntegerField(null=True, blank=True)
+    d5 = models.PositiveIntegerField(null=True, blank=True)
+    d6 = models.PositiveIntegerField(null=True, blank=True)
+    d7 = models.PositiveIntegerField(null=True, blank=True)
+    d8 = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # samples of an Experiment after a since= cursor
+            models.Index(fields=["experiment", "id"], name="countratesample_cursor_idx"),
+        ]
+
 
 class Countrates(models.Model):
     """
@@ -258,6 +669,17 @@ class Countrates(models.Model):
     d8 = models.PositiveIntegerField(null=True, blank=True)
 
 
+class CoincidencePattern(models.Model):
+    """
+    Shared dictionary of the keys of compactly stored coincidenceCounts (see
+    coincidences.py), one row per distinct ordered list of keys
+    """
+
+    # SHA-1 of the JSON encoded keys
+    digest = models.CharField(max_length=40, unique=True)
+    keys = models.JSONField()
+
+
 class ExperimentData(models.Model):
     """
     This model stores the experimental data
@@ -268,6 +690,13 @@ class ExperimentData(models.Model):
     )
     # no brackets for dict callable - we do not make a call, but pass the callable
     coincidenceCounts = models.JSONField(default=dict)
+    # compact storage of coincidenceCounts, used instead of the JSON if
+    # COINCIDENCES_COMPACT is enabled: the keys are stored once in the
+    # pattern dictionary, the counts packed in key order
+    coincidencePattern = models.ForeignKey(
+        "CoincidencePattern", on_delete=models.PROTECT, blank=True, null=True
+    )
+    coincidenceValues = models.BinaryField(blank=True, null=True)
 
 
 # User Manager class tells Django how to work with the customized
@@ -0,0 +1,181 @@
+"""
+Garbage collection of unreachable rows.
+
+Deleting an Experiment detaches its results (ExperimentResult.experiment is
+set to NULL and ExperimentResult.detached to the time of the deletion, see
+models.detach_result) and leaves its ComputeSettings tree behind. Nothing
+reads these rows anymore, so they are deleted here, in this order:
+
+- ExperimentResults detached more than GC_RESULT_GRACE seconds ago, results
+  posted without Experiment are kept
+- ExperimentData and Countrates of no remaining result
+- ComputeSettings trees of no Experiment: their QubitMeasurementItems,
+  ComputeSettings, clusterStates, CircuitConfigurationItems and
+  qubitComputings
+
+Reachability is an anti-join (NOT EXISTS) against the live rows of the
+referencing table, so rows that only become unreachable through this run
+are found in the same run and a dry run reports them as well. Referencing
+rows are deleted before the rows they reference. Rows are deleted in chunks
+of GC_CHUNK_SIZE, each with one DELETE statement that checks reachability
+again, so an interrupted run loses nothing and the next run continues with
+the rows left. CoincidencePatterns are never deleted, their ids are
+cached by every process (see coincidences.py).
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from cdl_rest_api import models
+
+logger = logging.getLogger(__name__)
+
+
+def _detached_results(grace):
+    return Q(detached__lt=timezone.now() - grace)
+
+
+def _delete(queryset):
+    """
+    Deletes the rows of the queryset with one DELETE ... WHERE pk IN
+    (SELECT ...) statement and returns their number. Not QuerySet.delete(),
+    its collector would apply SET_NULL to rows referencing them, e.g. null
+    the ComputeSettings of a new Experiment sharing the tree.
+    """
+    meta = queryset.model._meta
+    connection = connections[queryset.db]
+    sql, params = queryset.values("pk").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM {} WHERE {} IN ({})".format(
+                connection.ops.quote_name(meta.db_table),
+                connection.ops.quote_name(meta.pk.column),
+                sql,
+            ),
+            params,
+        )
+        return cursor.rowcount
+
+
+def orphan_querysets(grace=None):
+    """
+    Returns (name, queryset of the unreachable rows) per table in deletion
+    order
+    """
+    if grace is None:
+        grace = timedelta(seconds=settings.GC_RESULT_GRACE)
+    liveResults = models.ExperimentResult.objects.exclude(_detached_results(grace))
+    liveData = models.ExperimentData.objects.filter(
+        Exists(liveResults.filter(experimentData=OuterRef("pk")))
+    )
+    liveSettings = models.ComputeSettings.objects.filter(
+        Exists(models.ExperimentBase.objects.filter(ComputeSettings=OuterRef("pk")))
+    )
+    liveQubitComputings = models.qubitComputing.objects.filter(
+        Exists(liveSettings.filter(qubitComputing=OuterRef("pk")))
+    )
+    return [
+        (
+            "ExperimentResult",
+            models.ExperimentResult.objects.filter(_detached_results(grace)),
+        ),
+        (
+            "ExperimentData",
+            models.ExperimentData.objects.filter(
+                ~Exists(liveResults.filter(experimentData=OuterRef("pk")))
+            ),
+        ),
+        (
+            "Countrates",
+            models.Countrates.objects.filter(
+                ~Exists(liveData.filter(countratePerDetector=OuterRef("pk")))
+            ),
+        ),
+        (
+            "QubitMeasurementItem",
+            models.QubitMeasurementItem.objects.filter(
+                ~Exists(liveSettings.filter(pk=OuterRef("ComputeSettings")))
+            ),
+        ),
+        (
+            "ComputeSettings",
+            models.ComputeSettings.objects.filter(
+                ~Exists(
+                    models.ExperimentBase.objects.filter(
+                        ComputeSettings=OuterRef("pk")
+                    )
+                )
+            ),
+        ),
+        (
+            "clusterState",
+            models.clusterState.objects.filter(
+                ~Exists(liveSettings.filter(clusterState=OuterRef("pk")))
+            ),
+        ),
+        (
+            "CircuitConfigurationItem",
+            models.CircuitConfigurationItem.objects.filter(
+                ~Exists(liveQubitComputings.filter(pk=OuterRef("qubitComputing")))
+            ),
+        ),
+        (
+            "qubitComputing",
+            models.qubitComputing.objects.filter(
+                ~Exists(liveSettings.filter(qubitComputing=OuterRef("pk")))
+            ),
+        ),
+    ]
+
+
+def count():
+    """
+    Returns the number of unreachable rows per table, without deleting them
+    """
+    return {name: queryset.count() for name, queryset in orphan_querysets()}
+
+
+def collect(chunk_size=None, pause=None):
+    """
+    Deletes all unreachable rows in chunks, sleeping pause seconds between
+    two chunks. Returns the number of deleted rows per table.
+    """
+    if chunk_size is None:
+        chunk_size = settings.GC_CHUNK_SIZE
+    if pause is None:
+        pause = settings.GC_CHUNK_PAUSE
+    deleted = {}
+    for name, queryset in orphan_querysets():
+        deleted[name] = 0
+        last = None
+        while True:
+            chunk = queryset.order_by("pk")
+            if last is not None:
+                chunk = chunk.filter(pk__gt=last)
+            pks = list(chunk.values_list("pk", flat=True)[:chunk_size])
+            if not pks:
+                break
+            last = pks[-1]
+            try:
+                with transaction.atomic():
+                    # the reachability is checked again by the DELETE, a row
+                    # referenced since is not deleted
+                    rows = _delete(queryset.filter(pk__in=pks))
+            except IntegrityError:
+                # referenced by a transaction that was not committed yet when
+                # the DELETE ran, the deferred foreign key check fails; left
+                # for the next run
+                logger.warning("Skipped a chunk of %s still in use", name)
+                continue
+            deleted[name] += rows
+            if pause:
+                time.sleep(pause)
+        if deleted[name]:
+            logger.info("Deleted %d unreachable %s rows", deleted[name], name)
+    return deleted
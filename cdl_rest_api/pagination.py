@@ -0,0 +1,126 @@
+import base64
+import json
+
+from django.core import exceptions
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination: instead of an OFFSET, every page continues
+    after the ordering values of the last row of the previous page, so each
+    page is a single index range scan no matter how deep the client pages.
+
+    Pagination is opt-in with ?limit=<n>, without it the full list is
+    returned as before. Paginated responses look like
+    {"next": <url or null>, "results": [...]}.
+    """
+
+    # unique ascending ordering, subclasses need an index matching it
+    ordering = None
+    limit_query_param = "limit"
+    cursor_query_param = "cursor"
+    max_limit = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = request.query_params.get(self.limit_query_param)
+        if limit is None:
+            return None
+        try:
+            self.limit = min(int(limit), self.max_limit)
+        except ValueError:
+            raise ValidationError("Invalid limit.")
+        if self.limit < 1:
+            raise ValidationError("Invalid limit.")
+        self.request = request
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.after(self.decode_cursor(cursor, queryset.model))
+            )
+
+        # one extra row tells whether there is a next page
+        page = list(queryset[: self.limit + 1])
+        self.has_next = len(page) > self.limit
+        self.page = page[: self.limit]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        # model instances or .values() rows
+        if isinstance(last, dict):
+            values = [last[field] for field in self.ordering]
+        else:
+            values = [getattr(last, field) for field in self.ordering]
+        cursor = self.encode_cursor([str(value) for value in values])
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def after(self, values):
+        """
+        Builds the filter for all rows after the given ordering values:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            condition |= Q(**equal, **{field + "__gt": value})
+            equal[field] = value
+        return condition
+
+    def encode_cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor, model):
+        """
+        Returns the ordering values of the cursor, converted by the fields of
+        the model, so a forged cursor is rejected instead of failing in the
+        query
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise ValidationError("Invalid cursor.")
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise ValidationError("Invalid cursor.")
+        converted = []
+        for field, value in zip(self.ordering, values):
+            # encoded by get_next_link as strings
+            if not isinstance(value, str):
+                raise ValidationError("Invalid cursor.")
+            try:
+                value = model._meta.get_field(field).to_python(value)
+            except (exceptions.ValidationError, TypeError, ValueError):
+                raise ValidationError("Invalid cursor.")
+            if value is None:
+                raise ValidationError("Invalid cursor.")
+            converted.append(value)
+        return converted
+
+
+class ExperimentPagination(KeysetPagination):
+    """
+    Pagination of Experiment listings, uses experiment_created_idx
+    """
+
+    ordering = ("created", "experimentId")
+
+
+class ResultPagination(KeysetPagination):
+    """
+    Pagination of ExperimentResult listings, uses the primary key
+    """
+
+    ordering = ("id",)
@@ -0,0 +1,312 @@
+"""
+Queue operations for the hardware controllers (workers) that run the
+experiments submitted via the API
+"""
+
+import asyncio
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from cdl_rest_api import cache, models, scheduler, stats
+
+# Postgres channel used with LISTEN/NOTIFY to announce new Experiments
+QUEUE_CHANNEL = "cdl_experiment_queue"
+
+logger = logging.getLogger(__name__)
+
+
+class QueueDispatcher:
+    """
+    Fans out the queue notifications to everything waiting in this process:
+    long-poll requests (QueueListener) and websocket consumers (subscribe).
+    On Postgres a single thread holds the LISTEN connection of the process,
+    so waiting needs no database connection and the consumers need no
+    thread. Other backends (sqlite in development) are only notified by
+    _send_notification of the same process.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+        # asyncio.Events of the subscribed consumers and their event loops
+        self.events = {}
+        self.thread = None
+        self.listening = threading.Event()
+
+    def notify(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+            events = list(self.events.items())
+        for event, loop in events:
+            loop.call_soon_threadsafe(event.set)
+
+    def start(self):
+        """
+        Starts the LISTEN thread on Postgres unless it runs. Returns once it
+        listens, so no notification sent afterwards is missed.
+        """
+        if connection.vendor != "postgresql":
+            return
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._listen, name="queue-dispatcher", daemon=True
+                )
+                self.thread.start()
+        self.listening.wait(5)
+
+    def _listen(self):
+        while True:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("LISTEN {}".format(QUEUE_CHANNEL))
+                self.listening.set()
+                # notifications may have been lost while reconnecting
+                self.notify()
+                pg_connection = connection.connection
+                while True:
+                    select.select([pg_connection], [], [], 60)
+                    pg_connection.poll()
+                    if pg_connection.notifies:
+                        pg_connection.notifies.clear()
+                        self.notify()
+            except Exception:
+                logger.exception("Lost the queue notification connection")
+                self.listening.clear()
+                connection.close()
+                time.sleep(1)
+
+    def subscribe(self, loop):
+        """
+        Returns an asyncio.Event that is set on every notification, for a
+        consumer running in loop
+        """
+        event = asyncio.Event()
+        with self.condition:
+            self.events[event] = loop
+        return event
+
+    def unsubscribe(self, event):
+        with self.condition:
+            self.events.pop(event, None)
+
+
+dispatcher = QueueDispatcher()
+
+# long-poll requests of this process waiting in wait_for_experiment
+_long_polls = 0
+_long_polls_lock = threading.Lock()
+
+
+def release_expired_leases():
+    """
+    Puts RUNNING Experiments whose lease has expired back into the queue,
+    e.g. because the worker holding them crashed or lost its connection
+    """
+    with transaction.atomic():
+        # the locked rows are released by exactly this transaction, which
+        # keeps the statistics exact; experiment_lease_idx only covers the
+        # running Experiments
+        expired = list(
+            models.Experiment.objects.select_for_update(skip_locked=True)
+            .filter(
+                status="RUNNING",
+                leaseExpires__lt=timezone.now(),
+            )
+            .values_list("experimentId", "user_id", "projectId")
+        )
+        if not expired:
+            return 0
+        experimentIds = [row[0] for row in expired]
+        released = models.Experiment.objects.filter(
+            experimentId__in=experimentIds,
+            status="RUNNING",
+        ).update(status="IN QUEUE", workerId=None, leaseExpires=None)
+        stats.experiments_requeued(
+            (user_id, projectId) for experimentId, user_id, projectId in expired
+        )
+        # the owners may have been idle while their Experiments ran
+        requeued = defaultdict(list)
+        for experimentId, user_id, projectId in expired:
+            requeued[user_id].append(experimentId)
+        for user_id, userExperimentIds in requeued.items():
+            scheduler.register_submission(user_id, userExperimentIds)
+        cache.invalidate_experiment(*experimentIds)
+        notify_experiment_enqueued()
+    return released
+
+
+def notify_experiment_enqueued():
+    """
+    Wakes up all workers waiting for new Experiments. The notification is
+    sent once the current transaction commits, so a woken worker always
+    finds the new Experiment in the database.
+    """
+    transaction.on_commit(_send_notification)
+
+
+def _send_notification():
+    if connection.vendor == "postgresql":
+        # received by the dispatchers of all processes, this one included
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')", [QUEUE_CHANNEL])
+    else:
+        dispatcher.notify()
+
+
+class QueueListener:
+    """
+    Context manager that subscribes to queue notifications (see
+    QueueDispatcher). Subscribing before looking at the queue guarantees
+    that no Experiment enqueued in between is missed.
+
+    with QueueListener() as listener:
+        while scheduler.pick_next() is None:
+            if not listener.wait(timeout):
+                break
+    """
+
+    def __enter__(self):
+        dispatcher.start()
+        with dispatcher.condition:
+            self.version = dispatcher.version
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def wait(self, timeout):
+        """
+        Blocks until an Experiment is enqueued or timeout seconds passed.
+        Returns False on timeout.
+        """
+        with dispatcher.condition:
+            notified = dispatcher.condition.wait_for(
+                lambda: dispatcher.version != self.version, timeout
+            )
+            self.version = dispatcher.version
+        return notified
+
+
+@contextmanager
+def long_poll():
+    """
+    Reserves one of the EXPERIMENT_QUEUE_MAX_LONG_POLLS long-poll slots of
+    this process, yields False if all of them are taken. Every long-poll
+    request holds a server thread until it is answered.
+    """
+    global _long_polls
+    with _long_polls_lock:
+        reserved = _long_polls < settings.EXPERIMENT_QUEUE_MAX_LONG_POLLS
+        if reserved:
+            _long_polls += 1
+    try:
+        yield reserved
+    finally:
+        if reserved:
+            with _long_polls_lock:
+                _long_polls -= 1
+
+
+def wait_for_experiment(fetch, timeout):
+    """
+    Long-poll helper: calls fetch until it returns an Experiment and sleeps
+    until the next queue notification in between. Returns None if nothing
+    was found within timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    with QueueListener() as listener:
+        while True:
+            experiment = fetch()
+            if experiment is not None:
+                return experiment
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # the database connection is not needed while waiting
+            if not connection.in_atomic_block:
+                connection.close()
+            listener.wait(remaining)
+
+
+def claim_next_experiment(worker_id, lease_seconds=None):
+    """
+    Atomically takes the next Experiment out of the queue (see scheduler.py),
+    sets its status to RUNNING and records the worker holding it. Returns
+    None if the queue is empty.
+
+    Concurrent workers never receive the same Experiment: on backends that
+    support it (Postgres) the row is locked with SELECT ... FOR UPDATE SKIP
+    LOCKED, so a second worker skips it and takes the next one instead of
+    waiting. Other backends (sqlite in development) fall back to a
+    compare-and-swap UPDATE on the status column.
+    """
+    if lease_seconds is None:
+        lease_seconds = settings.EXPERIMENT_LEASE_SECONDS
+    release_expired_leases()
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            experiment = scheduler.pick_next(lock=True)
+            if experiment is None:
+                return None
+            scheduler.charge(experiment)
+            return _mark_running(experiment, worker_id, lease_seconds)
+
+    while True:
+        experiment = scheduler.pick_next()
+        if experiment is None:
+            return None
+        now = timezone.now()
+        leaseExpires = now + timedelta(seconds=lease_seconds)
+        first_claim = experiment.started is None
+        started = now if first_claim else experiment.started
+        # the UPDATE only matches if no other worker claimed the experiment
+        # in the meantime, otherwise try the next one. The charge and the
+        # statistics are stored with the claim, as on Postgres.
+        with transaction.atomic():
+            claimed = models.Experiment.objects.filter(
+                experimentId=experiment.experimentId,
+                status="IN QUEUE",
+            ).update(
+                status="RUNNING",
+                workerId=worker_id,
+                leaseExpires=leaseExpires,
+                started=started,
+            )
+            if claimed:
+                cache.invalidate_experiment(experiment.experimentId)
+                scheduler.charge(experiment)
+                experiment.status = "RUNNING"
+                experiment.workerId = worker_id
+                experiment.leaseExpires = leaseExpires
+                experiment.started = started
+                stats.experiment_claimed(experiment, "IN QUEUE", first_claim)
+                return experiment
+
+
+def _mark_running(experiment, worker_id, lease_seconds):
+    """
+    Stores the claim of a locked Experiment
+    """
+    now = timezone.now()
+    first_claim = experiment.started is None
+    experiment.status = "RUNNING"
+    experiment.workerId = worker_id
+    experiment.leaseExpires = now + timedelta(seconds=lease_seconds)
+    if first_claim:
+        experiment.started = now
+    experiment.save(update_fields=["status", "workerId", "leaseExpires", "started"])
+    cache.invalidate_experiment(experiment.experimentId)
+    stats.experiment_claimed(experiment, "IN QUEUE", first_claim)
+    return experiment
@@ -0,0 +1,12 @@
+from django.urls import path
+
+from cdl_rest_api import consumers
+
+# websocket routes, served by the ASGI application in cdl_webservice/asgi.py
+websocket_urlpatterns = [
+    path("api2/ws/experiments/queue", consumers.ExperimentQueueConsumer),
+    path(
+        "api2/ws/experiments/<slug:experiment_id>/samples",
+        consumers.ExperimentSampleConsumer,
+    ),
+]
@@ -0,0 +1,151 @@
+"""
+Time series of the detector count rates of running Experiments.
+
+The hardware controller posts CountrateSamples while an Experiment runs, they
+are appended with one bulk INSERT per request. Clients read them
+incrementally: every read returns a cursor, passing it as since= returns only
+the samples stored after it (by id, so samples with the same or late
+timestamps are never skipped). Long ranges can be downsampled to at most
+points= averaged buckets of equal duration.
+"""
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils.dateparse import parse_datetime
+
+from cdl_rest_api import models
+from cdl_rest_api.export import DETECTORS
+
+FIELDS = ("id", "time", "interval") + DETECTORS
+
+
+def store(experiment, validated_data):
+    """
+    Appends the validated samples (see CountrateSampleSerializer) to the
+    time series of the Experiment and returns their number
+    """
+    models.CountrateSample.objects.bulk_create(
+        [
+            models.CountrateSample(
+                experiment=experiment,
+                time=sample["time"],
+                interval=sample["interval"],
+                **sample["countratePerDetector"]
+            )
+            for sample in validated_data
+        ],
+        batch_size=1000,
+    )
+    return len(validated_data)
+
+
+def _int(params, param, default, minimum):
+    value = params.get(param)
+    if value in (None, ""):
+        return default
+    if not value.isdigit() or int(value) < minimum:
+        raise ValueError("Invalid {}.".format(param))
+    return int(value)
+
+
+def filter_samples(queryset, params):
+    """
+    Applies the since (cursor), start and end (ISO 8601 timestamps on time)
+    query parameters. Raises ValueError for invalid parameters.
+    """
+    queryset = queryset.filter(id__gt=_int(params, "since", 0, 0))
+    for param, lookup in (("start", "time__gte"), ("end", "time__lt")):
+        if params.get(param):
+            timestamp = parse_datetime(params[param])
+            if timestamp is None:
+                raise ValueError("Invalid {}.".format(param))
+            queryset = queryset.filter(**{lookup: timestamp})
+    return queryset
+
+
+def _sample(row):
+    return {
+        "id": row[0],
+        "time": row[1],
+        "interval": row[2],
+        "countratePerDetector": dict(zip(DETECTORS, row[3:])),
+    }
+
+
+def read(queryset, params):
+    """
+    Returns the filtered samples in the order they were stored, at most
+    limit (SAMPLE_PAGE_SIZE by default), or downsampled to at most points
+    buckets if requested, and the cursor to pass as since= to continue.
+    Raises ValueError for invalid parameters.
+    """
+    queryset = filter_samples(queryset, params)
+    since = _int(params, "since", 0, 0)
+    points = _int(params, "points", None, 1)
+    if points is not None:
+        return _downsample(queryset, min(points, settings.SAMPLE_MAX_POINTS), since)
+    limit = min(
+        _int(params, "limit", settings.SAMPLE_PAGE_SIZE, 1), settings.SAMPLE_PAGE_SIZE
+    )
+    samples = [
+        _sample(row) for row in queryset.order_by("id").values_list(*FIELDS)[:limit]
+    ]
+    return {
+        "samples": samples,
+        "cursor": samples[-1]["id"] if samples else since,
+        "more": len(samples) == limit,
+    }
+
+
+def _downsample(queryset, points, since):
+    """
+    Averages the samples over points buckets of equal duration between the
+    first and the last sample. The rows are streamed, only the running sums
+    of the buckets are kept.
+    """
+    bounds = queryset.aggregate(first=Min("time"), last=Max("time"), cursor=Max("id"))
+    if bounds["first"] is None:
+        return {"samples": [], "cursor": since, "more": False}
+    first = bounds["first"]
+    width = (bounds["last"] - first) / points
+
+    buckets = {}
+    rows = (
+        queryset.filter(id__lte=bounds["cursor"])
+        .values_list(*FIELDS)
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    for row in rows:
+        index = min(int((row[1] - first) / width), points - 1) if width else 0
+        bucket = buckets.get(index)
+        if bucket is None:
+            bucket = buckets[index] = {
+                "samples": 0,
+                "interval": 0.0,
+                "sums": [0] * len(DETECTORS),
+                "counts": [0] * len(DETECTORS),
+            }
+        bucket["samples"] += 1
+        bucket["interval"] += row[2]
+        for i, value in enumerate(row[3:]):
+            if value is not None:
+                bucket["sums"][i] += value
+                bucket["counts"][i] += 1
+
+    samples = []
+    for index in sorted(buckets):
+        bucket = buckets[index]
+        samples.append(
+            {
+                "time": first + width * index,
+                "samples": bucket["samples"],
+                "interval": bucket["interval"],
+                "countratePerDetector": {
+                    detector: total / count if count else None
+                    for detector, total, count in zip(
+                        DETECTORS, bucket["sums"], bucket["counts"]
+                    )
+                },
+            }
+        )
+    return {"samples": samples, "cursor": bounds["cursor"], "more": False}
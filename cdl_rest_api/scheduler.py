@@ -0,0 +1,128 @@
+"""
+Decides which queued Experiment runs next.
+
+Experiments are picked in three steps:
+
+1. priority: only the highest priority tier with queued Experiments is
+   considered
+2. fair share: within the tier, the user with the smallest virtual time is
+   served (weighted fair queuing over SchedulerAccount), so a user who
+   submits hundreds of Experiments cannot starve everybody else
+3. shortest job first: among the Experiments of that user, the one with the
+   smallest maxRuntime runs first, ties are broken by submission time
+
+Every step is an index lookup (experiment_schedule_idx and
+scheduleraccount_vtime_idx), so picking stays fast when the queue grows.
+"""
+
+from django.db import connection
+from django.db.models import Exists, F, Min, OuterRef
+
+from cdl_rest_api import models
+
+# order within one user and priority tier, matches experiment_schedule_idx
+SCHEDULE_ORDER = ("runtimeEstimate", "created", "experimentId")
+
+
+def queued_experiments():
+    """
+    Returns all Experiments waiting in the queue
+    """
+    return models.Experiment.objects.filter(status="IN QUEUE")
+
+
+def current_virtual_time(exclude_user=None):
+    """
+    Returns the smallest virtual time of all users with queued Experiments,
+    i.e. the virtual time of the user that is served next
+    """
+    queued = queued_experiments()
+    if exclude_user is not None:
+        queued = queued.exclude(user_id=exclude_user)
+    return (
+        models.SchedulerAccount.objects.filter(
+            Exists(queued.filter(user_id=OuterRef("user_id")))
+        ).aggregate(virtualTime=Min("virtualTime"))["virtualTime"]
+        or 0
+    )
+
+
+def register_submission(user_id, experimentIds=()):
+    """
+    Called when a user puts Experiments into the queue, experimentIds are
+    the Experiments just queued. Users that were idle (no other Experiment
+    in the queue) are moved up to the current virtual time of the other
+    users, otherwise they could bank their idle time and monopolize the
+    hardware afterwards.
+    """
+    virtualTime = current_virtual_time(exclude_user=user_id)
+    account, created = models.SchedulerAccount.objects.get_or_create(
+        user_id=user_id,
+        defaults={"virtualTime": virtualTime},
+    )
+    if created or account.virtualTime >= virtualTime:
+        return
+    idle = (
+        not queued_experiments()
+        .filter(user_id=user_id)
+        .exclude(experimentId__in=list(experimentIds))
+        .exists()
+    )
+    if idle:
+        models.SchedulerAccount.objects.filter(
+            pk=account.pk, virtualTime__lt=virtualTime
+        ).update(virtualTime=virtualTime)
+
+
+def charge(experiment):
+    """
+    Advances the virtual time of the user by the runtime of the scheduled
+    Experiment
+    """
+    models.SchedulerAccount.objects.filter(user_id=experiment.user_id).update(
+        virtualTime=F("virtualTime")
+        + float(experiment.maxRuntime or 1) / F("weight")
+    )
+
+
+def pick_next(lock=False):
+    """
+    Returns the next Experiment to run, or None if the queue is empty.
+
+    With lock=True the row is selected FOR UPDATE SKIP LOCKED and the call
+    must happen inside a transaction; if the preferred Experiment is locked
+    by a concurrent worker, the next one in global order is taken instead.
+    """
+    queued = queued_experiments()
+    tier = (
+        queued.order_by("-priority").values_list("priority", flat=True).first()
+    )
+    if tier is None:
+        return None
+    queued = queued.filter(priority=tier)
+
+    account = (
+        models.SchedulerAccount.objects.filter(
+            Exists(queued.filter(user_id=OuterRef("user_id")))
+        )
+        .order_by("virtualTime", "id")
+        .first()
+    )
+    if lock:
+        queued = _lock(queued)
+    if account is not None:
+        experiment = (
+            queued.filter(user_id=account.user_id).order_by(*SCHEDULE_ORDER).first()
+        )
+        if experiment is not None:
+            return experiment
+    # Experiments of users without an account (submitted before the
+    # scheduler existed) or skipped because of a concurrent lock
+    return queued.order_by(*SCHEDULE_ORDER).first()
+
+
+def _lock(queryset):
+    if connection.features.has_select_for_update_skip_locked:
+        # only lock the Experiment row, not the joined ExperimentBase
+        return queryset.select_for_update(skip_locked=True, of=("self",))
+    return queryset
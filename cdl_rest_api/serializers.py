@@ -1,6 +1,7 @@
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 
-from cdl_rest_api import models
+from cdl_rest_api import coincidences, configurations, models
 
 # from django.contrib.auth.models import User
 
@@ -79,6 +80,9 @@ class qubitComputingSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+COMPUTE_SETTINGS_FIELDS = ("encodedQubitMeasurements", "qubitComputing", "clusterState")
+
+
 class ComputeSettingsSerializer(serializers.ModelSerializer):
     """
     Serializer for the ComputeSettings model
@@ -92,8 +96,23 @@ class ComputeSettingsSerializer(serializers.ModelSerializer):
         """
         create function for ComputeSettingsSerializer handles the array type of
         the encodedQubitMeasurements field. encodedQubitMeasurements is an array
-        of QubitMeasurementItems.
+        of QubitMeasurementItems. An identical tree that is already stored is
+        returned instead of a copy (see ComputeSettings.settingsHash).
         """
+        settingsHash = configurations.settings_hash(validated_data)
+        existing = models.ComputeSettings.objects.filter(
+            settingsHash=settingsHash
+        ).first()
+        if existing is not None:
+            return existing
+        try:
+            with transaction.atomic():
+                return self.create_tree(validated_data, settingsHash)
+        except IntegrityError:
+            # stored by a concurrent request in the meantime
+            return models.ComputeSettings.objects.get(settingsHash=settingsHash)
+
+    def create_tree(self, validated_data, settingsHash):
         encodedQubitMeasurementsData = validated_data.pop(
             "encodedQubitMeasurements")
         qubitComputingData = validated_data.pop("qubitComputing")
@@ -104,7 +123,9 @@ class ComputeSettingsSerializer(serializers.ModelSerializer):
         clusterStateData = validated_data.pop("clusterState")
         clusterState = models.clusterState.objects.create(**clusterStateData)
         ComputeSettings = models.ComputeSettings.objects.create(
-            clusterState=clusterState, qubitComputing=qubitComputing
+            clusterState=clusterState,
+            qubitComputing=qubitComputing,
+            settingsHash=settingsHash,
         )
         for encodedQubitMeasurement in encodedQubitMeasurementsData:
             models.QubitMeasurementItem.objects.create(
@@ -114,20 +135,140 @@ class ComputeSettingsSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.ComputeSettings
-        fields = ("encodedQubitMeasurements", "qubitComputing", "clusterState")
+        fields = COMPUTE_SETTINGS_FIELDS
         # return entire object of ForeignKey assignment not just id
         depth = 1
 
 
+class ExperimentListSerializer(serializers.ListSerializer):
+    """
+    Serializer for many Experiments at once, used by the bulk endpoint
+    """
+
+    def create(self, validated_data):
+        """
+        create function for ExperimentListSerializer writes each model layer
+        of the nested ComputeSettings with a single bulk insert instead of one
+        INSERT per object like ExperimentSerializer.create. Every distinct
+        tree is stored once, also if it occurs several times in the request.
+        """
+        computeSettingsData = [
+            item.pop("ComputeSettings") for item in validated_data
+        ]
+        settingsHashes = [
+            configurations.settings_hash(data) for data in computeSettingsData
+        ]
+        for item, data in zip(validated_data, computeSettingsData):
+            item["configurationHash"] = configurations.configuration_hash(
+                item.get("circuitId"), data
+            )
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    computeSettings = self.create_compute_settings(
+                        computeSettingsData, settingsHashes
+                    )
+            except IntegrityError:
+                # a concurrent request stored some of the trees in the meantime
+                computeSettings = self.create_compute_settings(
+                    computeSettingsData, settingsHashes
+                )
+            return models.Experiment.objects.bulk_create(
+                [
+                    models.Experiment(
+                        ComputeSettings=computeSettings[settingsHash], **item
+                    )
+                    for settingsHash, item in zip(settingsHashes, validated_data)
+                ]
+            )
+
+    def create_compute_settings(self, computeSettingsData, settingsHashes):
+        """
+        Returns the ComputeSettings by settingsHash, only the trees that are
+        not stored yet are inserted
+        """
+        computeSettings = {
+            computeSetting.settingsHash: computeSetting
+            for computeSetting in models.ComputeSettings.objects.filter(
+                settingsHash__in=set(settingsHashes)
+            )
+        }
+        missing = {}
+        for settingsHash, data in zip(settingsHashes, computeSettingsData):
+            if settingsHash not in computeSettings:
+                missing.setdefault(settingsHash, data)
+        if not missing:
+            return computeSettings
+        computeSettingsData = list(missing.values())
+
+        clusterStates = models.bulk_create_with_pks(
+            models.clusterState,
+            [
+                models.clusterState(**data["clusterState"])
+                for data in computeSettingsData
+            ],
+        )
+        qubitComputings = models.bulk_create_with_pks(
+            models.qubitComputing,
+            [models.qubitComputing() for data in computeSettingsData],
+        )
+        models.CircuitConfigurationItem.objects.bulk_create(
+            [
+                models.CircuitConfigurationItem(
+                    qubitComputing=qubitComputing, **circuitAngle
+                )
+                for qubitComputing, data in zip(qubitComputings, computeSettingsData)
+                for circuitAngle in data["qubitComputing"]["circuitAngles"]
+            ]
+        )
+        created = models.bulk_create_with_pks(
+            models.ComputeSettings,
+            [
+                models.ComputeSettings(
+                    clusterState=clusterState,
+                    qubitComputing=qubitComputing,
+                    settingsHash=settingsHash,
+                )
+                for clusterState, qubitComputing, settingsHash in zip(
+                    clusterStates, qubitComputings, missing
+                )
+            ],
+        )
+        models.QubitMeasurementItem.objects.bulk_create(
+            [
+                models.QubitMeasurementItem(
+                    ComputeSettings=computeSetting, **encodedQubitMeasurement
+                )
+                for computeSetting, data in zip(created, computeSettingsData)
+                for encodedQubitMeasurement in data["encodedQubitMeasurements"]
+            ]
+        )
+        computeSettings.update(zip(missing, created))
+        return computeSettings
+
+
 class ExperimentSerializer(serializers.ModelSerializer):
     """
     Serializer for the Experiment model
+
+    Takes an optional fields argument to render only a subset of the fields,
+    e.g. ExperimentSerializer(experiments, many=True, fields=SUMMARY_FIELDS)
     """
 
+    # slim representation for listings without the nested ComputeSettings
+    SUMMARY_FIELDS = ("experimentId", "experimentName", "status", "created")
+
     ComputeSettings = ComputeSettingsSerializer()
     user_id = serializers.ReadOnlyField()
     experimentId = serializers.ReadOnlyField()
 
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
     def create(self, validated_data):
         """
         create function for ExperimentSerializer handles the ForeignKey
@@ -136,6 +277,10 @@ class ExperimentSerializer(serializers.ModelSerializer):
         """
         print(validated_data)
         computeSettingsData = validated_data.pop("ComputeSettings")
+        # identifies identical Experiments, see configurations.py
+        validated_data["configurationHash"] = configurations.configuration_hash(
+            validated_data.get("circuitId"), computeSettingsData
+        )
         # codes lines reversed compared to above
         # Foreign Key is in Experiment, not ComputeSettings
         # pass ComputeSettings to ComputeSettingsSerializer
@@ -149,7 +294,48 @@ class ExperimentSerializer(serializers.ModelSerializer):
         )
         return Experiment
 
+    def validate(self, attrs):
+        """
+        validate function for ExperimentSerializer completes the
+        ComputeSettings of a partial update with the parts of the current
+        tree that are not given
+        """
+        if self.instance is not None and "ComputeSettings" in attrs:
+            computeSettings = dict(
+                configurations.compute_settings_data(self.instance.ComputeSettings)
+                or {},
+                **attrs["ComputeSettings"]
+            )
+            if any(
+                computeSettings.get(field) is None
+                for field in COMPUTE_SETTINGS_FIELDS
+            ):
+                raise serializers.ValidationError("Invalid ComputeSettings.")
+            attrs["ComputeSettings"] = computeSettings
+        return attrs
+
     # custom update function is needed to update nested models.
+    def update(self, instance, validated_data):
+        """
+        update function for ExperimentSerializer keeps the configurationHash
+        in sync with circuitId and ComputeSettings. ComputeSettings trees are
+        shared by Experiments and never modified: changed settings point the
+        Experiment to the tree of the new settings (copy on write).
+        """
+        circuitId = instance.circuitId
+        computeSettingsId = instance.ComputeSettings_id
+        if "ComputeSettings" in validated_data:
+            instance.ComputeSettings = ComputeSettingsSerializer().create(
+                validated_data.pop("ComputeSettings")
+            )
+        instance = super().update(instance, validated_data)
+        if (
+            instance.circuitId != circuitId
+            or instance.ComputeSettings_id != computeSettingsId
+        ):
+            instance.configurationHash = configurations.experiment_hash(instance)
+            instance.save(update_fields=["configurationHash"])
+        return instance
 
     class Meta:
         model = models.Experiment
@@ -164,8 +350,23 @@ class ExperimentSerializer(serializers.ModelSerializer):
             "experimentId",
             "circuitId",
             "ComputeSettings",
+            "priority",
         )
+        # admins may set the priority, it is only shown to the workers (see
+        # ExperimentQueueSerializer)
+        extra_kwargs = {"priority": {"write_only": True}}
         depth = 1
+        list_serializer_class = ExperimentListSerializer
+
+
+class ExperimentQueueSerializer(ExperimentSerializer):
+    """
+    Serializer for the Experiments handed to the workers by
+    ExperimentQueueView and ExperimentClaimView, includes the priority
+    """
+
+    class Meta(ExperimentSerializer.Meta):
+        extra_kwargs = {}
 
 
 class CountratesSerializer(serializers.ModelSerializer):
@@ -194,15 +395,22 @@ class ExperimentDataSerializer(serializers.ModelSerializer):
 
         countratesData = validated_data.pop("countratePerDetector")
         serializer = CountratesSerializer(data=countratesData)
-        serializer.is_valid()
+        serializer.is_valid(raise_exception=True)
         countrates = serializer.save()
-        coincidences = validated_data.pop("coincidenceCounts")
+        coincidenceCounts = validated_data.pop("coincidenceCounts")
+        # JSON or compact, see coincidences.py
         ExperimentData = models.ExperimentData.objects.create(
-            countratePerDetector=countrates, coincidenceCounts=coincidences
+            countratePerDetector=countrates,
+            **coincidences.storage_fields(coincidenceCounts)
         )
 
         return ExperimentData
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["coincidenceCounts"] = coincidences.get_counts(instance)
+        return data
+
     class Meta:
         model = models.ExperimentData
         fields = ("countratePerDetector", "coincidenceCounts")
@@ -221,7 +429,7 @@ class ExperimentResultPostSerializer(serializers.ModelSerializer):
         # Foreign Key is in Experiment, not ComputeSettings
         # 1 Experiment has 1 Compute Setting
         serializer = ExperimentDataSerializer(data=experimentData)
-        serializer.is_valid()
+        serializer.is_valid(raise_exception=True)
         # print(serializer.errors)
         experimentData = serializer.save()
         Experiment = models.ExperimentResult.objects.create(
@@ -242,6 +450,29 @@ class ExperimentResultPostSerializer(serializers.ModelSerializer):
         )
 
 
+class StagedResultSerializer(ExperimentResultPostSerializer):
+    """
+    Validates staged results (see ingest.py) without looking up their
+    Experiment, the flush worker checks all Experiment IDs of a batch with
+    one query
+    """
+
+    experiment = serializers.UUIDField(required=False, allow_null=True)
+
+
+class CountrateSampleSerializer(serializers.ModelSerializer):
+    """
+    Validates the count rate samples posted for a running Experiment, they
+    are stored in bulk by samples.store
+    """
+
+    countratePerDetector = CountratesSerializer()
+
+    class Meta:
+        model = models.CountrateSample
+        fields = ("time", "interval", "countratePerDetector")
+
+
 class ExperimentResultGetSerializer(serializers.ModelSerializer):
     """ """
 
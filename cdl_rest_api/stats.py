@@ -0,0 +1,371 @@
+"""
+Materialized Experiment statistics per user and projectId.
+
+Every change of an Experiment's status and every stored or deleted result
+adjusts the ExperimentStats row of the Experiment's user and projectId with
+an atomic UPDATE ... SET field = field + delta in the same transaction.
+The rows can be rebuilt from scratch with python3 manage.py rebuild_stats.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+
+from cdl_rest_api import models
+
+# status -> counter field of ExperimentStats
+STATUS_FIELDS = {
+    "INITIAL": "initialCount",
+    "IN QUEUE": "inQueueCount",
+    "RUNNING": "runningCount",
+    "FAILED": "failedCount",
+    "DONE": "doneCount",
+}
+RESULT_FIELDS = ("resultCount", "totalCounts", "totalTime")
+QUEUE_WAIT_FIELDS = ("queueWaitCount", "queueWaitTime")
+REUSE_FIELDS = ("reusedCount", "savedTime")
+FIELDS = (
+    tuple(STATUS_FIELDS.values()) + RESULT_FIELDS + QUEUE_WAIT_FIELDS + REUSE_FIELDS
+)
+# the fields that are all 0 in the row of a user and projectId without
+# Experiments
+COUNT_FIELDS = tuple(field for field in FIELDS if field != "queueWaitTime")
+
+
+def _key(experiment):
+    return (experiment.user_id, experiment.projectId or "")
+
+
+def state(experiment):
+    """
+    Returns what the statistics of an Experiment depend on, to be passed to
+    experiment_changed after the Experiment was modified
+    """
+    return _key(experiment), experiment.status
+
+
+def _increment(key, deltas):
+    """
+    Adds the deltas to the counters of the row of (user_id, projectId),
+    the row is created on first use
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    user_id, projectId = key
+    rows = models.ExperimentStats.objects.filter(user_id=user_id, projectId=projectId)
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if rows.update(**updates):
+        if sum(deltas.get(field, 0) for field in STATUS_FIELDS.values()) < 0:
+            # the row is deleted with the last Experiment, rebuild creates
+            # no rows without Experiments (queueWaitTime can keep a float
+            # residue when queueWaitCount is 0)
+            rows.filter(**{field: 0 for field in COUNT_FIELDS}).delete()
+        return
+    try:
+        with transaction.atomic():
+            models.ExperimentStats.objects.create(
+                user_id=user_id, projectId=projectId, **deltas
+            )
+    except IntegrityError:
+        # created by a concurrent request in the meantime
+        rows.update(**updates)
+
+
+def _apply(deltas_by_key):
+    for key, deltas in deltas_by_key.items():
+        _increment(key, deltas)
+
+
+def _queue_wait(experiment):
+    if experiment.started is None or experiment.created is None:
+        return None
+    return (experiment.started - experiment.created).total_seconds()
+
+
+def _result_deltas(reused, results, totalCounts, totalTime):
+    """
+    Returns what results contribute: the hardware time of reused results
+    (see configurations.py) was saved, not spent
+    """
+    if not reused:
+        return {
+            "resultCount": results,
+            "totalCounts": totalCounts,
+            "totalTime": totalTime,
+        }
+    return {
+        "resultCount": results,
+        "totalCounts": totalCounts,
+        "reusedCount": results,
+        "savedTime": totalTime,
+    }
+
+
+def _totals(experiments):
+    """
+    Returns the statistics each Experiment contributes apart from its
+    status: its results and its queue wait, by experimentId
+    """
+    totals = defaultdict(Counter)
+    experiments = {experiment.pk: experiment for experiment in experiments}
+    rows = (
+        models.ExperimentResult.objects.filter(
+            experiment__in=list(experiments)
+        )
+        .values("experiment")
+        .annotate(
+            resultCount=Count("id"),
+            totalCounts=Sum("totalCounts"),
+            totalTime=Sum("totalTime"),
+        )
+    )
+    for row in rows:
+        totals[row["experiment"]].update(
+            _result_deltas(
+                experiments[row["experiment"]].reusedFrom_id is not None,
+                row["resultCount"],
+                row["totalCounts"],
+                row["totalTime"],
+            )
+        )
+    for experiment in experiments.values():
+        waited = _queue_wait(experiment)
+        if waited is not None:
+            totals[experiment.pk].update(queueWaitCount=1, queueWaitTime=waited)
+    return totals
+
+
+def experiments_created(experiments):
+    """
+    Counts new Experiments
+    """
+    deltas = defaultdict(Counter)
+    for experiment in experiments:
+        field = STATUS_FIELDS.get(experiment.status)
+        if field is not None:
+            deltas[_key(experiment)][field] += 1
+    _apply(deltas)
+
+
+def experiments_deleted(experiments):
+    """
+    Removes Experiments and everything they contributed, must be called
+    before they are deleted
+    """
+    _count_experiments(experiments, -1)
+
+
+def experiments_restored(experiments):
+    """
+    Counts Experiments restored from the archive with everything they
+    contribute, must be called after their results are stored
+    """
+    _count_experiments(experiments, 1)
+
+
+def _count_experiments(experiments, sign):
+    experiments = list(experiments)
+    totals = _totals(experiments)
+    deltas = defaultdict(Counter)
+    for experiment in experiments:
+        key = _key(experiment)
+        field = STATUS_FIELDS.get(experiment.status)
+        if field is not None:
+            deltas[key][field] += sign
+        for name, value in totals[experiment.pk].items():
+            deltas[key][name] += sign * value
+    _apply(deltas)
+
+
+def experiment_changed(before, experiment):
+    """
+    Updates the statistics after an Experiment was modified, before is the
+    state() of the Experiment before the change. If user_id or projectId
+    changed, the results and queue wait of the Experiment move along.
+    """
+    key, status = before
+    if key == _key(experiment) and status == experiment.status:
+        return
+    deltas = defaultdict(Counter)
+    if STATUS_FIELDS.get(status) is not None:
+        deltas[key][STATUS_FIELDS[status]] -= 1
+    if STATUS_FIELDS.get(experiment.status) is not None:
+        deltas[_key(experiment)][STATUS_FIELDS[experiment.status]] += 1
+    if key != _key(experiment):
+        moved = _totals([experiment])[experiment.pk]
+        deltas[key].subtract(moved)
+        deltas[_key(experiment)].update(moved)
+    _apply(deltas)
+
+
+def experiment_claimed(experiment, previous_status, first_claim):
+    """
+    Moves an Experiment claimed by a worker from its previous status to
+    RUNNING and records its queue wait on the first claim
+    """
+    deltas = Counter({STATUS_FIELDS["RUNNING"]: 1})
+    if previous_status in STATUS_FIELDS:
+        deltas[STATUS_FIELDS[previous_status]] -= 1
+    if first_claim:
+        waited = _queue_wait(experiment)
+        if waited is not None:
+            deltas.update(queueWaitCount=1, queueWaitTime=waited)
+    _increment(_key(experiment), deltas)
+
+
+def experiments_requeued(keys):
+    """
+    Moves RUNNING Experiments back into the queue, keys are their
+    (user_id, projectId)
+    """
+    deltas = defaultdict(Counter)
+    for user_id, projectId in keys:
+        key = (user_id, projectId or "")
+        deltas[key][STATUS_FIELDS["RUNNING"]] -= 1
+        deltas[key][STATUS_FIELDS["IN QUEUE"]] += 1
+    _apply(deltas)
+
+
+def result_added(experimentResult):
+    """
+    Counts a stored ExperimentResult
+    """
+    results_added([experimentResult])
+
+
+def results_added(experimentResults):
+    """
+    Counts stored ExperimentResults
+    """
+    _count_results(experimentResults, 1)
+
+
+def result_deleted(experimentResult):
+    """
+    Removes a deleted ExperimentResult
+    """
+    _count_results([experimentResult], -1)
+
+
+def _count_results(experimentResults, sign):
+    deltas = defaultdict(Counter)
+    for experimentResult in experimentResults:
+        if experimentResult.experiment_id is None:
+            continue
+        experiment = experimentResult.experiment
+        deltas[_key(experiment)].update(
+            _result_deltas(
+                experiment.reusedFrom_id is not None,
+                sign,
+                sign * experimentResult.totalCounts,
+                sign * experimentResult.totalTime,
+            )
+        )
+    _apply(deltas)
+
+
+def summarize(queryset):
+    """
+    Sums the statistics rows of the queryset
+    """
+    totals = queryset.aggregate(**{field: Sum(field) for field in FIELDS})
+    totals = {field: totals[field] or 0 for field in FIELDS}
+    queueWaitCount = totals["queueWaitCount"]
+    return {
+        "experiments": {
+            status: totals[field] for status, field in STATUS_FIELDS.items()
+        },
+        "results": totals["resultCount"],
+        "totalCounts": totals["totalCounts"],
+        "totalTime": totals["totalTime"],
+        "queueWaitTime": totals["queueWaitTime"],
+        "meanQueueWaitTime": (
+            totals["queueWaitTime"] / queueWaitCount if queueWaitCount else None
+        ),
+        "reusedResults": totals["reusedCount"],
+        "savedTime": totals["savedTime"],
+    }
+
+
+def rebuild():
+    """
+    Recomputes all statistics rows from the Experiments and results and
+    returns the number of rows. On Postgres the table is locked against
+    concurrent increments for the duration, they are applied on top of the
+    rebuilt rows afterwards.
+    """
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "LOCK TABLE {} IN EXCLUSIVE MODE".format(
+                        connection.ops.quote_name(
+                            models.ExperimentStats._meta.db_table
+                        )
+                    )
+                )
+
+        rows = defaultdict(Counter)
+        for row in models.Experiment.objects.values(
+            "user_id", "projectId", "status"
+        ).annotate(experiments=Count("experimentId")):
+            field = STATUS_FIELDS.get(row["status"])
+            if field is not None:
+                rows[(row["user_id"], row["projectId"] or "")][field] += row[
+                    "experiments"
+                ]
+
+        for reused in (False, True):
+            results = models.ExperimentResult.objects.filter(
+                experiment__isnull=False, experiment__reusedFrom__isnull=not reused
+            )
+            for row in (
+                results.values("experiment__user_id", "experiment__projectId")
+                .annotate(
+                    resultCount=Count("id"),
+                    totalCounts=Sum("totalCounts"),
+                    totalTime=Sum("totalTime"),
+                )
+            ):
+                key = (row["experiment__user_id"], row["experiment__projectId"] or "")
+                rows[key].update(
+                    _result_deltas(
+                        reused,
+                        row["resultCount"],
+                        row["totalCounts"],
+                        row["totalTime"],
+                    )
+                )
+
+        for row in (
+            models.Experiment.objects.filter(
+                started__isnull=False, created__isnull=False
+            )
+            .values("user_id", "projectId")
+            .annotate(
+                queueWaitCount=Count("experimentId"),
+                queueWaitTime=Sum(
+                    ExpressionWrapper(
+                        F("started") - F("created"), output_field=DurationField()
+                    )
+                ),
+            )
+        ):
+            rows[(row["user_id"], row["projectId"] or "")].update(
+                queueWaitCount=row["queueWaitCount"],
+                queueWaitTime=row["queueWaitTime"].total_seconds(),
+            )
+
+        models.ExperimentStats.objects.all().delete()
+        models.ExperimentStats.objects.bulk_create(
+            [
+                models.ExperimentStats(
+                    user_id=user_id, projectId=projectId, **counters
+                )
+                for (user_id, projectId), counters in rows.items()
+            ],
+            batch_size=1000,
+        )
+    return len(rows)
@@ -1,3 +1,1529 @@
-from django.test import TestCase
+import ast
+import asyncio
+import base64
+import csv
+import json
+import os
+import time
+import uuid
+import zipfile
+from array import array
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import unquote
 
-# Create your tests here.
+import jwt
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.response import Response
+
+from cdl_rest_api import cache, consumers, ingest, models, orphans, queue, stats
+from cdl_rest_api.management.commands import check_query_plans
+from cdl_webservice import metrics, middlewares
+
+# prefix of the cdl_rest_api routes, see cdl_webservice/urls.py
+API = "/api2/"
+
+
+def auth(user_id, admin=False):
+    """
+    Returns the Authorization header of a signed JWT, as sent by the frontend
+    """
+    token = jwt.encode(
+        {"sub": user_id, "is_admin": admin, "is_staff": admin}, settings.SECRET_KEY
+    )
+    if isinstance(token, bytes):
+        token = token.decode()
+    return {"HTTP_AUTHORIZATION": "Bearer " + token}
+
+
+def experiment_data(i):
+    """
+    Returns the data of an Experiment with a full ComputeSettings tree,
+    distinct for every i (identical trees are stored once)
+    """
+    return {
+        "experimentName": "test {}".format(i),
+        "circuitId": 1,
+        "projectId": "test-project",
+        "maxRuntime": 10,
+        "ComputeSettings": {
+            "clusterState": {"amountQubits": 2, "presetSettings": "linear"},
+            "qubitComputing": {
+                "circuitAngles": [
+                    {"circuitAngleName": "alpha", "circuitAngleValue": i % 360},
+                    {"circuitAngleName": "beta", "circuitAngleValue": 10},
+                ]
+            },
+            "encodedQubitMeasurements": [
+                {"encodedQubitIndex": 1, "theta": i % 180, "phi": 0},
+                {"encodedQubitIndex": 2, "theta": 90, "phi": 10},
+            ],
+        },
+    }
+
+
+def result_data(experimentId, totalCounts=100, coincidenceCounts=None):
+    """
+    Returns the data of a result of the Experiment, as posted by the
+    hardware controller
+    """
+    return {
+        "experiment": experimentId,
+        "totalCounts": totalCounts,
+        "numberOfDetectors": 8,
+        "singlePhotonRate": "1.50",
+        "totalTime": 10,
+        "experimentData": {
+            "countratePerDetector": {"d{}".format(i): i for i in range(1, 9)},
+            "coincidenceCounts": coincidenceCounts or {"d1d2": 3},
+        },
+    }
+
+
+class APITestCase(TestCase):
+    """
+    Base class of the API tests, sends requests as a user or an admin user
+    """
+
+    user_id = "test-user"
+
+    def setUp(self):
+        # cached representations and verified tokens outlive the test
+        # transactions
+        cache.cache.clear()
+
+    def get(self, path, params=None, admin=False, user_id=None, **extra):
+        return self.client.get(
+            API + path, params or {}, **auth(user_id or self.user_id, admin), **extra
+        )
+
+    def delete(self, path, user_id=None):
+        return self.client.delete(API + path, **auth(user_id or self.user_id))
+
+    def post(self, path, data, admin=False, user_id=None):
+        return self.client.post(
+            API + path,
+            data,
+            content_type="application/json",
+            **auth(user_id or self.user_id, admin)
+        )
+
+    def patch(self, path, data, admin=True):
+        return self.client.patch(
+            API + path,
+            data,
+            content_type="application/json",
+            **auth(self.user_id, admin)
+        )
+
+    def create_experiments(self, count):
+        """
+        Submits count Experiments through experiments/bulk, returns their ids
+        """
+        start = getattr(self, "created", 0)
+        self.created = start + count
+        response = self.post(
+            "experiments/bulk",
+            [experiment_data(i) for i in range(start, start + count)],
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()["experimentIds"]
+
+    def create_result(self, experimentId, totalCounts=100, coincidenceCounts=None):
+        """
+        Posts a result of the Experiment through results
+        """
+        response = self.post(
+            "results",
+            result_data(experimentId, totalCounts, coincidenceCounts),
+            admin=True,
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def count_queries(self, request):
+        """
+        Returns the response of request() and the number of its queries
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        return response, len(context)
+
+
+class ExperimentListViewTest(APITestCase):
+    """
+    Listing Experiments takes the same number of queries for any number of
+    Experiments and ComputeSettings trees
+    """
+
+    # ?limit= paginates, indented JSON is rendered by ExperimentSerializer
+    # instead of the fast read path
+    REQUESTS = {
+        "json": ({}, {}),
+        "json ?limit=": ({"limit": 100}, {}),
+        "serializer": ({}, {"HTTP_ACCEPT": "application/json; indent=2"}),
+        "serializer ?limit=": (
+            {"limit": 100},
+            {"HTTP_ACCEPT": "application/json; indent=2"},
+        ),
+    }
+
+    def list_queries(self, count):
+        queries = {}
+        for name, (params, extra) in self.REQUESTS.items():
+            response, queries[name] = self.count_queries(
+                lambda: self.get("experiments", params, **extra)
+            )
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            if "limit" in params:
+                data = data["results"]
+            self.assertEqual(len(data), count)
+            computeSettings = data[0]["ComputeSettings"]
+            self.assertEqual(len(computeSettings["encodedQubitMeasurements"]), 2)
+        return queries
+
+    def test_constant_queries(self):
+        self.create_experiments(5)
+        before = self.list_queries(5)
+        self.create_experiments(5)
+        self.assertEqual(self.list_queries(10), before)
+
+
+class ExperimentAccessTest(APITestCase):
+    """
+    The detail, result and delete views read an Experiment and its latest
+    result with a fixed number of queries (see ExperimentQuerySet)
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.experimentId, self.finishedId = self.create_experiments(2)
+        self.create_result(self.finishedId)
+
+    def test_detail(self):
+        with self.assertNumQueries(3):
+            response = self.get("experiments/" + self.experimentId)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["experimentId"], self.experimentId)
+        # served from the cached representation
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.get("experiments/" + self.experimentId).status_code, 200
+            )
+
+    def test_result(self):
+        with self.assertNumQueries(2):
+            response = self.get("experiments/{}/results".format(self.finishedId))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["totalCounts"], 100)
+        # without a result the Experiment is rendered
+        with self.assertNumQueries(3):
+            response = self.get(
+                "experiments/{}/results".format(self.experimentId)
+            )
+        self.assertEqual(response.json()["experimentId"], self.experimentId)
+
+    def test_delete(self):
+        with self.assertNumQueries(10):
+            response = self.delete("experiments/" + self.experimentId)
+        self.assertEqual(response.status_code, 204)
+        # with the result, which is detached, its ExperimentData and countrates
+        with self.assertNumQueries(12):
+            response = self.delete("experiments/{}/results".format(self.finishedId))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get("experiments").json(), [])
+
+    def test_not_found(self):
+        # the archive is searched as well before answering 404
+        for path, queries in (
+            ("experiments/" + self.experimentId, 7),
+            ("experiments/{}/results".format(self.experimentId), 7),
+            ("experiments/" + str(uuid.uuid4()), 7),
+            # not a UUID
+            ("experiments/not-a-uuid", 5),
+            ("experiments/not-a-uuid/results", 5),
+        ):
+            with self.subTest(path=path), self.assertNumQueries(queries):
+                response = self.get(path, user_id="other-user")
+            self.assertEqual(response.status_code, 404)
+
+    def test_delete_not_found(self):
+        for path, queries in (
+            ("experiments/" + self.experimentId, 9),
+            ("experiments/{}/results".format(self.experimentId), 9),
+            ("experiments/not-a-uuid", 7),
+            ("experiments/not-a-uuid/results", 7),
+        ):
+            with self.subTest(path=path), self.assertNumQueries(queries):
+                response = self.delete(path, user_id="other-user")
+            self.assertEqual(response.status_code, 404)
+        # still there for its owner
+        self.assertEqual(self.get("experiments/" + self.experimentId).status_code, 200)
+
+
+class BenchmarkAPITest(APITestCase):
+    """
+    Runs the load generator (management command benchmark_api) at a small
+    scale and fails if an endpoint needs more queries per request than in
+    benchmark_baseline.json, saved with the same arguments:
+
+    python3 manage.py benchmark_api --users 2 --experiments 50 --requests 5
+        --queue-depths 5 50 --save-baseline cdl_rest_api/benchmark_baseline.json
+    """
+
+    BASELINE = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+
+    def test_queries_per_request(self):
+        stdout = StringIO()
+        call_command(
+            "benchmark_api",
+            users=2,
+            experiments=50,
+            requests=5,
+            queue_depths=[5, 50],
+            baseline=self.BASELINE,
+            queries_only=True,
+            stdout=stdout,
+            stderr=StringIO(),
+        )
+        self.assertIn("No regressions", stdout.getvalue())
+
+
+class ExperimentClaimTest(APITestCase):
+    """
+    Workers claim every queued Experiment exactly once, expired leases put
+    it back into the queue
+    """
+
+    def claim(self, data=None):
+        return self.post("experiments/queue/claim", data or {}, admin=True)
+
+    def test_claim(self):
+        experimentIds = self.create_experiments(2)
+        claimed = [self.claim({"workerId": "worker-{}".format(i)}) for i in range(2)]
+        self.assertEqual([r.status_code for r in claimed], [200, 200])
+        self.assertCountEqual(
+            [r.json()["experimentId"] for r in claimed], experimentIds
+        )
+        self.assertEqual(claimed[0].json()["status"], "RUNNING")
+        self.assertEqual(claimed[0].json()["workerId"], "worker-0")
+        self.assertEqual(self.claim().status_code, 204)
+
+    def test_lease_expiry(self):
+        (experimentId,) = self.create_experiments(1)
+        self.assertEqual(self.claim({"leaseSeconds": 60}).status_code, 200)
+        self.assertEqual(self.claim().status_code, 204)
+        models.Experiment.objects.filter(experimentId=experimentId).update(
+            leaseExpires=timezone.now()
+        )
+        response = self.claim({"workerId": "second"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["experimentId"], experimentId)
+        self.assertEqual(response.json()["workerId"], "second")
+
+    def test_invalid(self):
+        self.create_experiments(1)
+        for data in (
+            {"leaseSeconds": 0},
+            {"leaseSeconds": -5},
+            {"leaseSeconds": "x"},
+            {"wait": -1},
+            # no JSON object
+            [1, 2],
+            "worker",
+        ):
+            with self.subTest(data=data):
+                response = self.post("experiments/queue/claim", data, admin=True)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post("experiments/queue/claim", {}).status_code, 403)
+        # the Experiment is still queued
+        self.assertEqual(self.claim().status_code, 200)
+
+
+class QueueNotificationTest(APITestCase):
+    """
+    Waiting workers are woken by the queue dispatcher of the process, the
+    number of long-poll requests is limited
+    """
+
+    def test_dispatcher(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        enqueued = queue.dispatcher.subscribe(loop)
+        with queue.QueueListener() as listener:
+            queue.dispatcher.notify()
+            self.assertTrue(listener.wait(0))
+            self.assertFalse(listener.wait(0))
+        loop.run_until_complete(asyncio.wait_for(enqueued.wait(), 1))
+        queue.dispatcher.unsubscribe(enqueued)
+        self.assertNotIn(enqueued, queue.dispatcher.events)
+
+    def test_long_poll(self):
+        (experimentId,) = self.create_experiments(1)
+        response = self.post("experiments/queue/claim", {"wait": 1}, admin=True)
+        self.assertEqual(response.json()["experimentId"], experimentId)
+        with override_settings(EXPERIMENT_QUEUE_MAX_LONG_POLLS=0):
+            response = self.get("experiments/queue", {"wait": 1}, admin=True)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "1")
+            # without waiting
+            response = self.get("experiments/queue", admin=True)
+            self.assertEqual(response.status_code, 200)
+
+
+class SchedulerTest(APITestCase):
+    """
+    Workers are served the Experiments of all users in turn, also when they
+    take them from GET experiments/queue and start them with PATCH
+    """
+
+    def submit(self, user_id, count, **data):
+        start = getattr(self, "created", 0)
+        self.created = start + count
+        response = self.post(
+            "experiments/bulk",
+            [dict(experiment_data(i), **data) for i in range(start, start + count)],
+            user_id=user_id,
+            admin=bool(data),
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_legacy_queue(self):
+        self.submit("user-a", 5)
+        self.submit("user-b", 1)
+        served = []
+        for i in range(6):
+            experiment = self.get("experiments/queue", admin=True).json()
+            served.append(
+                models.Experiment.objects.get(
+                    experimentId=experiment["experimentId"]
+                ).user_id
+            )
+            response = self.patch(
+                "experiments/" + experiment["experimentId"], {"status": "RUNNING"}
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(served, ["user-a", "user-b"] + ["user-a"] * 4)
+        # the empty queue is rendered with null fields
+        self.assertIsNone(self.get("experiments/queue", admin=True).json()["status"])
+
+    def test_priority(self):
+        self.submit("user-a", 1)
+        self.submit("user-b", 1, priority=2)
+        # the priority is only shown to the workers
+        experiment = self.get("experiments/queue", admin=True).json()
+        self.assertEqual(experiment["priority"], 2)
+        listed = self.get("experiments", user_id="user-b").json()
+        self.assertNotIn("priority", listed[0])
+        detail = self.get("experiments/" + experiment["experimentId"], user_id="user-b")
+        self.assertNotIn("priority", detail.json())
+        response = self.post("experiments/queue/claim", {}, admin=True)
+        self.assertEqual(response.json()["experimentId"], experiment["experimentId"])
+        self.assertEqual(response.json()["priority"], 2)
+        # users cannot prioritize their own Experiments
+        self.post("experiments", dict(experiment_data(9), priority=5), user_id="user-c")
+        self.assertEqual(models.Experiment.objects.get(user_id="user-c").priority, 0)
+
+
+class ExperimentBulkTest(APITestCase):
+    """
+    experiments/bulk creates all Experiments or none
+    """
+
+    def test_bulk_submit(self):
+        experimentIds = self.create_experiments(3)
+        self.assertEqual(
+            [e["experimentId"] for e in self.get("experiments").json()], experimentIds
+        )
+        self.assertEqual(models.ExperimentStats.objects.get().inQueueCount, 3)
+
+    def test_invalid(self):
+        valid = [experiment_data(i) for i in range(3)]
+        invalid = dict(experiment_data(3), maxRuntime="x")
+        for data in (
+            valid + [invalid],
+            valid + ["experiment"],
+            [],
+            experiment_data(0),
+        ):
+            with self.subTest(data=data):
+                response = self.post("experiments/bulk", data)
+                self.assertEqual(response.status_code, 400)
+        with override_settings(EXPERIMENT_BULK_MAX_SIZE=2):
+            self.assertEqual(self.post("experiments/bulk", valid).status_code, 400)
+        self.assertFalse(models.Experiment.objects.exists())
+
+    def test_rollback(self):
+        # fails after the Experiments were inserted
+        with mock.patch(
+            "cdl_rest_api.stats.experiments_created", side_effect=DatabaseError
+        ):
+            with self.assertRaises(DatabaseError):
+                self.post("experiments/bulk", [experiment_data(i) for i in range(3)])
+        self.assertFalse(models.Experiment.objects.exists())
+        self.assertFalse(models.ComputeSettings.objects.exists())
+        self.assertFalse(models.ExperimentStats.objects.exists())
+
+
+class PaginationTest(APITestCase):
+    """
+    Keyset pagination with ?limit= and ?cursor=, field selection with
+    ?fields= and ?expand=
+    """
+
+    INDENTED = {"HTTP_ACCEPT": "application/json; indent=2"}
+
+    def test_cursor(self):
+        experimentIds = self.create_experiments(7)
+        for extra in ({}, self.INDENTED):
+            with self.subTest(extra=extra):
+                pages = []
+                response = self.get("experiments", {"limit": 3}, **extra)
+                while True:
+                    self.assertEqual(response.status_code, 200)
+                    data = response.json()
+                    pages.append([e["experimentId"] for e in data["results"]])
+                    if data["next"] is None:
+                        break
+                    response = self.client.get(
+                        data["next"], **auth(self.user_id), **extra
+                    )
+                self.assertEqual([len(page) for page in pages], [3, 3, 1])
+                self.assertEqual(sum(pages, []), experimentIds)
+
+    def test_invalid_cursor(self):
+        self.create_experiments(2)
+
+        def cursor(values):
+            return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+        for path, cursors in (
+            (
+                "experiments",
+                [
+                    "not base64",
+                    cursor({"created": 1}),
+                    cursor([str(timezone.now())]),
+                    cursor(["x", "y"]),
+                    cursor([str(timezone.now()), "not-a-uuid"]),
+                    cursor([1, str(uuid.uuid4())]),
+                    cursor(["", str(uuid.uuid4())]),
+                ],
+            ),
+            ("results", [cursor(["x"]), cursor([1.5]), cursor([None])]),
+        ):
+            for value in cursors:
+                for extra in ({}, self.INDENTED):
+                    with self.subTest(path=path, cursor=value, extra=extra):
+                        params = {"limit": 1, "cursor": value}
+                        response = self.get(path, params, admin=True, **extra)
+                        self.assertEqual(response.status_code, 400)
+        response = self.get(
+            "experiments",
+            {"limit": 1, "cursor": cursor([str(timezone.now()), str(uuid.uuid4())])},
+        )
+        self.assertEqual(response.json(), {"next": None, "results": []})
+
+    def test_fields(self):
+        self.create_experiments(2)
+        summary = ["experimentId", "experimentName", "status", "created"]
+        for params, fields in (
+            ({"fields": "summary"}, summary),
+            ({"fields": "summary", "limit": 1}, summary),
+            ({"fields": "experimentId,maxRuntime"}, ["maxRuntime", "experimentId"]),
+            (
+                {"fields": "experimentId", "expand": "ComputeSettings"},
+                ["experimentId", "ComputeSettings"],
+            ),
+        ):
+            for extra in ({}, self.INDENTED):
+                with self.subTest(params=params, extra=extra):
+                    data = self.get("experiments", params, **extra).json()
+                    if "limit" in params:
+                        data = data["results"]
+                    self.assertCountEqual(data[0], fields)
+
+
+class ResultExportTest(APITestCase):
+    """
+    results/export streams the results of the user as NDJSON or CSV
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.experimentIds = self.create_experiments(2)
+        for i, experimentId in enumerate(self.experimentIds):
+            self.create_result(
+                experimentId, totalCounts=i, coincidenceCounts={"d1": i}
+            )
+        self.user_id = "other-user"
+        self.create_result(self.create_experiments(1)[0])
+        self.user_id = "test-user"
+
+    def export(self, params):
+        response = self.get("results/export", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.export({}).splitlines()]
+        self.assertEqual([row["experiment"] for row in rows], self.experimentIds)
+        self.assertEqual([row["totalCounts"] for row in rows], [0, 1])
+        self.assertEqual(rows[1]["coincidenceCounts"], {"d1": 1})
+        self.assertEqual(rows[1]["countratePerDetector"]["d8"], 8)
+        self.assertEqual(rows[1]["projectId"], "test-project")
+        self.assertEqual(rows[1]["singlePhotonRate"], "1.50")
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export({"output": "csv"}))))
+        self.assertEqual([row["experiment"] for row in rows], self.experimentIds)
+        self.assertEqual([row["totalCounts"] for row in rows], ["0", "1"])
+        self.assertEqual(json.loads(rows[1]["coincidenceCounts"]), {"d1": 1})
+        self.assertEqual(rows[1]["d8"], "8")
+
+    def test_filters(self):
+        self.assertEqual(self.export({"projectId": "other-project"}), "")
+        self.assertEqual(self.export({"since": "2100-01-01T00:00:00Z"}), "")
+        until = self.export({"until": "2100-01-01T00:00:00Z"})
+        self.assertEqual(len(until.splitlines()), 2)
+        for params in ({"output": "xml"}, {"since": "yesterday"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get("results/export", params).status_code, 400)
+
+
+def load_npz(content):
+    """
+    Returns the arrays of an npz export as {name: (shape, values)}, read
+    without numpy for the numeric and byte string dtypes of export.py
+    """
+    arrays = {}
+    with zipfile.ZipFile(BytesIO(content)) as archive:
+        for name in archive.namelist():
+            data = archive.read(name)
+            length = int.from_bytes(data[8:10], "little")
+            header = ast.literal_eval(data[10 : 10 + length].decode("latin1"))
+            body = data[10 + length :]
+            dtype = header["descr"]
+            if dtype.startswith("|S"):
+                width = int(dtype[2:])
+                values = [
+                    body[i : i + width].rstrip(b"\0").decode()
+                    for i in range(0, len(body), width)
+                ]
+            else:
+                typecode = {"<i8": "q", "<M8[us]": "q", "<u4": "I", "<f8": "d"}
+                values = array(typecode[dtype], body).tolist()
+            arrays[name[: -len(".npy")]] = (header["shape"], values)
+    return arrays
+
+
+class ResultExportNpzTest(APITestCase):
+    """
+    results/export?output=npz writes column arrays, results whose
+    coincidence counts don't fit into int64 are listed in skipped
+    """
+
+    def test_npz(self):
+        experimentIds = self.create_experiments(5)
+        for experimentId, coincidenceCounts in zip(
+            experimentIds,
+            (
+                {"d1": 2 ** 33, "d1d2": -4},
+                {"d1": 1},
+                {"d1": "many"},
+                {"d1d2": 2 ** 64},
+                {"d1": 3.0, "d1d2": "5"},
+            ),
+        ):
+            self.create_result(experimentId, coincidenceCounts=coincidenceCounts)
+        resultIds = list(
+            models.ExperimentResult.objects.order_by("id").values_list("id", flat=True)
+        )
+        response = self.get("results/export", {"output": "npz"})
+        self.assertEqual(response.status_code, 200)
+        arrays = load_npz(b"".join(response.streaming_content))
+        self.assertEqual(arrays["patterns"], ((2,), ["d1", "d1d2"]))
+        self.assertEqual(
+            arrays["coincidences"], ((3, 2), [2 ** 33, -4, 1, 0, 3, 5])
+        )
+        exported = [resultIds[i] for i in (0, 1, 4)]
+        self.assertEqual(arrays["resultId"], ((3,), exported))
+        self.assertEqual(
+            arrays["experiment"], ((3,), [experimentIds[i] for i in (0, 1, 4)])
+        )
+        self.assertEqual(arrays["countrates"][0], (3, 8))
+        self.assertEqual(arrays["skipped"], ((2,), [resultIds[2], resultIds[3]]))
+
+
+class TokenCacheTest(APITestCase):
+    """
+    Verified tokens are cached until their exp claim, at the latest for
+    ORIGIN_TOKEN_CACHE_MAX_AGE seconds
+    """
+
+    def setUp(self):
+        super().setUp()
+        middlewares.token_cache.clear()
+
+    def request(self, claims):
+        token = jwt.encode(claims, settings.SECRET_KEY)
+        if isinstance(token, bytes):
+            token = token.decode()
+        return self.client.get(
+            API + "experiments", HTTP_AUTHORIZATION="Bearer " + token
+        )
+
+    def test_expiry(self):
+        exp = int(time.time()) + 60
+        claims = {"sub": self.user_id, "exp": exp}
+        self.assertEqual(self.request(claims).status_code, 200)
+        before = middlewares.token_cache.stats()
+        self.assertEqual(self.request(claims).status_code, 200)
+        self.assertEqual(middlewares.token_cache.stats()["hits"], before["hits"] + 1)
+        # past the exp claim the token is verified again
+        with mock.patch.object(middlewares.time, "time", return_value=exp + 1):
+            self.request(claims)
+        after = middlewares.token_cache.stats()
+        self.assertEqual(after["misses"], before["misses"] + 1)
+
+    def test_expired_token(self):
+        claims = {"sub": self.user_id, "exp": int(time.time()) - 1}
+        self.assertEqual(self.request(claims).status_code, 403)
+        self.assertEqual(self.request(claims).status_code, 403)
+        self.assertEqual(middlewares.token_cache.stats()["size"], 0)
+
+    def test_max_age(self):
+        tokens = middlewares.TokenCache(max_size=2, max_age=10)
+        user = middlewares.OriginUser("user")
+        with mock.patch.object(middlewares.time, "time", return_value=1000):
+            tokens.set("a", user)
+            tokens.set("b", user, exp=1005)
+        with mock.patch.object(middlewares.time, "time", return_value=1006):
+            self.assertIs(tokens.get("a"), user)
+            self.assertIsNone(tokens.get("b"))
+        with mock.patch.object(middlewares.time, "time", return_value=1011):
+            self.assertIsNone(tokens.get("a"))
+        # least recently used tokens are dropped
+        for token in "cde":
+            tokens.set(token, user)
+        self.assertEqual(tokens.stats()["size"], 2)
+        self.assertIsNone(tokens.get("c"))
+        self.assertIs(tokens.get("e"), user)
+
+
+class ExperimentCacheTest(APITestCase):
+    """
+    The detail and result views are served from versioned cache entries
+    with ETags, changes invalidate them
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.experimentId,) = self.create_experiments(1)
+        # TestCase never commits, invalidate at once
+        patcher = mock.patch("cdl_rest_api.cache.transaction")
+        patcher.start().on_commit.side_effect = lambda callback: callback()
+        self.addCleanup(patcher.stop)
+
+    def test_etag(self):
+        path = "experiments/" + self.experimentId
+        response = self.get(path)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.patch(path, {"status": "RUNNING"}).status_code, 200)
+        response = self.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "RUNNING")
+        self.assertNotEqual(response["ETag"], etag)
+        # the result view is invalidated as well
+        self.get(path + "/results")
+        self.create_result(self.experimentId)
+        self.assertEqual(self.get(path + "/results").json()["totalCounts"], 100)
+
+    def test_owner(self):
+        path = "experiments/" + self.experimentId
+        self.assertEqual(self.get(path).status_code, 200)
+        self.assertEqual(self.get(path, user_id="other-user").status_code, 404)
+        self.assertEqual(self.get(path, admin=True, user_id="admin").status_code, 200)
+
+    def test_stale_store(self):
+        # a request reads the Experiment, a change is committed and
+        # invalidates, then the request stores what it read
+        user = middlewares.OriginUser(self.user_id)
+        entry, version = cache.get_representation(self.experimentId, "detail", user)
+        self.assertIsNone(entry)
+        cache.invalidate_experiment(self.experimentId)
+        cache.set_representation(
+            self.experimentId, "detail", self.user_id, {"status": "old"}, version
+        )
+        entry, version = cache.get_representation(self.experimentId, "detail", user)
+        self.assertIsNone(entry)
+        cache.set_representation(
+            self.experimentId, "detail", self.user_id, {"status": "new"}, version
+        )
+        entry, version = cache.get_representation(self.experimentId, "detail", user)
+        self.assertEqual(entry["data"], {"status": "new"})
+
+    @override_settings(EXPERIMENT_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        for i in range(2):
+            with self.assertNumQueries(3):
+                response = self.get("experiments/" + self.experimentId)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("ETag", response)
+
+
+class ResultAggregateTest(APITestCase):
+    """
+    results/aggregate groups the results by a compute setting, JSON and
+    compactly stored coincidence counts alike
+    """
+
+    def setUp(self):
+        super().setUp()
+        # theta of qubit 1 is 0, 1 and 0, alpha 0, 1 and 180
+        response = self.post(
+            "experiments/bulk", [experiment_data(i) for i in (0, 1, 180)]
+        )
+        first, second, third = response.json()["experimentIds"]
+        self.create_result(first, coincidenceCounts={"d1d2": 2})
+        self.create_result(second, coincidenceCounts={"d1d2": 10, "d3d4": 1})
+        with override_settings(COINCIDENCES_COMPACT=True):
+            self.create_result(third, coincidenceCounts={"d1d2": 4})
+        self.assertTrue(
+            models.ExperimentData.objects.filter(
+                coincidencePattern__isnull=False
+            ).exists()
+        )
+        # not aggregated for test-user
+        response = self.post(
+            "experiments/bulk", [experiment_data(0)], user_id="other-user"
+        )
+        self.create_result(
+            response.json()["experimentIds"][0], coincidenceCounts={"d1d2": 1000}
+        )
+
+    def aggregate(self, params):
+        response = self.get("results/aggregate", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_theta(self):
+        data = self.aggregate({"parameter": "theta", "coincidences": "d1d2,d3d4"})
+        self.assertEqual(data["qubit"], "1")
+        self.assertEqual(
+            [(group["value"], group["results"]) for group in data["groups"]],
+            [("0.00", 2), ("1.00", 1)],
+        )
+        d1d2 = data["groups"][0]["coincidenceCounts"]["d1d2"]
+        self.assertEqual(d1d2, {"count": 2, "sum": 6.0, "mean": 3.0, "std": 1.0})
+        self.assertEqual(data["groups"][0]["coincidenceCounts"]["d3d4"]["count"], 0)
+        self.assertEqual(data["groups"][1]["coincidenceCounts"]["d1d2"]["sum"], 10.0)
+        d8 = data["groups"][0]["countratePerDetector"]["d8"]
+        self.assertEqual(d8, {"count": 2, "sum": 16.0, "mean": 8.0, "std": 0.0})
+        visibility = data["visibility"]
+        self.assertAlmostEqual(visibility["coincidenceCounts"]["d1d2"], 7 / 13)
+        self.assertEqual(visibility["countratePerDetector"]["d8"], 0)
+
+    def test_circuit_angle(self):
+        data = self.aggregate({"parameter": "circuitAngleValue", "angle": "alpha"})
+        self.assertEqual(
+            [(group["value"], group["results"]) for group in data["groups"]],
+            [("0.000", 1), ("1.000", 1), ("180.000", 1)],
+        )
+        data = self.aggregate({"parameter": "phi", "qubit": "3"})
+        self.assertEqual(data["groups"], [])
+
+    def test_invalid(self):
+        for params in (
+            {},
+            {"parameter": "amountQubits"},
+            {"parameter": "theta", "qubit": "x"},
+            {"parameter": "circuitAngleValue"},
+            {"parameter": "theta", "coincidences": "d1 d2"},
+        ):
+            with self.subTest(params=params):
+                response = self.get("results/aggregate", params)
+                self.assertEqual(response.status_code, 400)
+
+
+class ExperimentStatsTest(APITestCase):
+    """
+    The incrementally updated statistics equal the ones rebuilt from
+    scratch after any sequence of changes
+    """
+
+    def snapshot(self):
+        rows = models.ExperimentStats.objects.order_by("user_id", "projectId")
+        rows = list(rows.values("user_id", "projectId", *stats.FIELDS))
+        for row in rows:
+            row["queueWaitTime"] = round(row["queueWaitTime"], 6)
+        return rows
+
+    def assertRebuilt(self):
+        incremental = self.snapshot()
+        stats.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+        return incremental
+
+    def test_rebuild(self):
+        first, second, third = self.create_experiments(3)
+        for i in range(2):
+            response = self.post("experiments/queue/claim", {}, admin=True)
+            self.assertEqual(response.status_code, 200)
+        models.Experiment.objects.filter(status="RUNNING").update(
+            leaseExpires=timezone.now()
+        )
+        queue.release_expired_leases()
+        self.patch("experiments/" + first, {"status": "DONE"})
+        self.patch("experiments/" + second, {"projectId": "other-project"})
+        self.create_result(first)
+        self.create_result(first)
+        # reuses the result of first
+        data = dict(experiment_data(0), reuseResult=True)
+        self.assertEqual(self.post("experiments", data).status_code, 200)
+        self.user_id = "other-user"
+        self.create_experiments(2)
+        rows = self.assertRebuilt()
+        self.assertEqual(len(rows), 3)
+
+        self.delete("experiments/{}/results".format(first))
+        self.delete("experiments/" + third)
+        self.assertRebuilt()
+
+        # deleting all Experiments of a user and project removes the row
+        response = self.client.delete(
+            API + "experiments/bulk?projectId=test-project", **auth("other-user")
+        )
+        self.assertEqual(response.json(), {"deleted": 2})
+        rows = self.assertRebuilt()
+        self.assertNotIn("other-user", [row["user_id"] for row in rows])
+
+
+class ResultBatchTest(APITestCase):
+    """
+    results/batch stages results, the flush worker stores them in batches
+    and keeps the invalid ones with their errors
+    """
+
+    def test_flush(self):
+        experimentIds = self.create_experiments(2)
+        batch = [result_data(experimentId) for experimentId in experimentIds * 2]
+        batch[1]["numberOfDetectors"] = 9
+        batch.append(result_data(str(uuid.uuid4())))
+        response = self.post("results/batch", batch, admin=True)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {"staged": 5})
+        self.assertEqual(
+            self.get("results/batch", admin=True).json(), {"pending": 5, "failed": 0}
+        )
+        stdout = StringIO()
+        call_command("flush_results", once=True, batch_size=2, stdout=stdout)
+        self.assertEqual(
+            self.get("results/batch", admin=True).json(), {"pending": 0, "failed": 2}
+        )
+        self.assertEqual(models.ExperimentResult.objects.count(), 3)
+        self.assertEqual(models.ExperimentStats.objects.get().resultCount, 3)
+        errors = models.StagedResult.objects.order_by("id").values_list(
+            "error", flat=True
+        )
+        self.assertIn("numberOfDetectors", errors[0])
+        self.assertIn("object does not exist", errors[1])
+        response = self.get("experiments/{}/results".format(experimentIds[0]))
+        self.assertEqual(response.json()["totalCounts"], 100)
+
+    def test_database_error(self):
+        (experimentId,) = self.create_experiments(1)
+        batch = [result_data(experimentId, totalCounts=i) for i in range(3)]
+        response = self.post("results/batch", batch, admin=True)
+        self.assertEqual(response.status_code, 202)
+        store = ingest._store
+
+        def reject(items):
+            # the database rejects the result with totalCounts 1
+            if any(data["totalCounts"] == 1 for experiment, data in items):
+                raise DatabaseError("rejected")
+            return store(items)
+
+        with mock.patch("cdl_rest_api.ingest._store", side_effect=reject):
+            self.assertEqual(ingest.flush(), (2, 1))
+        self.assertCountEqual(
+            models.ExperimentResult.objects.values_list("totalCounts", flat=True),
+            [0, 2],
+        )
+        self.assertIn(
+            "rejected", models.StagedResult.objects.values_list("error", flat=True)[0]
+        )
+        # invalid results are not retried
+        self.assertEqual(ingest.flush(), (0, 0))
+
+    def test_invalid(self):
+        for data in ([], {"experiment": None}, [1]):
+            with self.subTest(data=data):
+                response = self.post("results/batch", data, admin=True)
+                self.assertEqual(response.status_code, 400)
+        with override_settings(RESULT_BATCH_MAX_SIZE=1):
+            response = self.post("results/batch", [{}, {}], admin=True)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post("results/batch", [{}]).status_code, 403)
+
+
+class ExperimentSampleTest(APITestCase):
+    """
+    Count rate samples are read incrementally with the cursor of the
+    previous read, over HTTP and by the websocket consumer
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.experimentId,) = self.create_experiments(1)
+        self.path = "experiments/{}/samples".format(self.experimentId)
+        # posted as JSON with millisecond precision
+        self.start = timezone.now().replace(microsecond=0)
+
+    def post_samples(self, first, count):
+        data = [
+            {
+                "time": self.start + timezone.timedelta(seconds=i),
+                "interval": 1,
+                "countratePerDetector": {"d1": i, "d2": 2 * i},
+            }
+            for i in range(first, first + count)
+        ]
+        response = self.post(self.path, data, admin=True)
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def read(self, params):
+        response = self.get(self.path, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def d1(self, data):
+        return [sample["countratePerDetector"]["d1"] for sample in data["samples"]]
+
+    def test_cursor(self):
+        self.post_samples(0, 3)
+        data = self.read({})
+        self.assertEqual(self.d1(data), [0, 1, 2])
+        self.assertIsNone(data["samples"][0]["countratePerDetector"]["d3"])
+        cursor = data["cursor"]
+        self.assertEqual(self.read({"since": cursor})["samples"], [])
+        self.post_samples(3, 2)
+        data = self.read({"since": cursor, "limit": 1})
+        self.assertEqual(self.d1(data), [3])
+        self.assertTrue(data["more"])
+        data = self.read({"since": data["cursor"]})
+        self.assertEqual(self.d1(data), [4])
+        self.assertFalse(data["more"])
+
+    def test_downsample(self):
+        self.post_samples(0, 10)
+        data = self.read({"points": 2})
+        self.assertEqual([s["samples"] for s in data["samples"]], [5, 5])
+        self.assertEqual(data["samples"][0]["countratePerDetector"]["d1"], 2)
+        self.assertEqual(data["samples"][1]["countratePerDetector"]["d2"], 14)
+        end = (self.start + timezone.timedelta(seconds=4)).isoformat()
+        self.assertEqual(len(self.read({"end": end})["samples"]), 4)
+
+    def test_consumer(self):
+        self.post_samples(0, 2)
+        consumer = consumers.ExperimentSampleConsumer({"type": "websocket"})
+        consumer.experiment = models.Experiment.objects.get(
+            experimentId=self.experimentId
+        )
+        consumer.cursor = "0"
+        status, data = consumer.read()
+        self.assertEqual((status, len(data["samples"])), ("IN QUEUE", 2))
+        self.post_samples(2, 1)
+        status, data = consumer.read()
+        self.assertEqual(self.d1(data), [2])
+        self.assertEqual(consumer.read()[1]["samples"], [])
+
+    def test_invalid(self):
+        for params in (
+            {"since": "x"},
+            {"points": "0"},
+            {"limit": "-1"},
+            {"start": "x"},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(self.path, params).status_code, 400)
+        self.assertEqual(self.get(self.path, user_id="other-user").status_code, 404)
+        self.assertEqual(self.post(self.path, []).status_code, 403)
+        self.assertEqual(self.post(self.path, [], admin=True).status_code, 400)
+        response = self.post(self.path, [{"time": "x"}], admin=True)
+        self.assertEqual(response.status_code, 400)
+
+
+class ConfigurationReuseTest(APITestCase):
+    """
+    Identical configurations get the same configurationHash, submissions
+    with reuseResult reuse a recent result of one instead of being queued
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.sourceId,) = self.create_experiments(1)
+        self.patch("experiments/" + self.sourceId, {"status": "DONE"})
+        self.create_result(self.sourceId, totalCounts=42)
+
+    def identical(self, **data):
+        # the configuration of experiment_data(0) in another order and
+        # notation
+        experiment = experiment_data(0)
+        computeSettings = experiment["ComputeSettings"]
+        computeSettings["encodedQubitMeasurements"].reverse()
+        computeSettings["encodedQubitMeasurements"][1]["theta"] = "0.0"
+        computeSettings["qubitComputing"]["circuitAngles"].reverse()
+        experiment["experimentName"] = "identical"
+        return dict(experiment, **data)
+
+    def test_hash(self):
+        self.post("experiments", self.identical())
+        self.post("experiments", experiment_data(1))
+        hashes = list(
+            models.Experiment.objects.order_by("created").values_list(
+                "configurationHash", flat=True
+            )
+        )
+        self.assertEqual(hashes[0], hashes[1])
+        self.assertNotEqual(hashes[0], hashes[2])
+
+    def test_reuse(self):
+        response = self.post("experiments", self.identical(reuseResult=True))
+        data = response.json()
+        self.assertEqual(data["status"], "DONE")
+        self.assertEqual(data["reusedFrom"], self.sourceId)
+        self.assertEqual(data["savedTime"], 10)
+        response = self.get("experiments/{}/results".format(data["experimentId"]))
+        self.assertEqual(response.json()["totalCounts"], 42)
+        self.assertEqual(models.ExperimentData.objects.count(), 1)
+        row = models.ExperimentStats.objects.get()
+        self.assertEqual((row.reusedCount, row.savedTime, row.totalTime), (1, 10, 10))
+        response = self.post("experiments/queue/claim", {}, admin=True)
+        self.assertEqual(response.status_code, 204)
+
+    def test_not_reused(self):
+        for data in (
+            # not requested
+            self.identical(),
+            self.identical(reuseResult="yes"),
+            self.identical(reuseResult=True, maxRuntime=20),
+            dict(experiment_data(1), reuseResult=True),
+        ):
+            with self.subTest(data=data):
+                response = self.post("experiments", data)
+                self.assertEqual(response.json()["status"], "IN QUEUE")
+        # the result is older than EXPERIMENT_REUSE_WINDOW
+        models.ExperimentResult.objects.update(
+            startTime=timezone.now() - timezone.timedelta(hours=2)
+        )
+        response = self.post("experiments", self.identical(reuseResult=True))
+        self.assertEqual(response.json()["status"], "IN QUEUE")
+        self.assertEqual(models.ExperimentStats.objects.get().reusedCount, 0)
+
+    def test_bulk(self):
+        response = self.post(
+            "experiments/bulk",
+            [
+                self.identical(reuseResult=True),
+                dict(experiment_data(1), reuseResult=True),
+            ],
+        )
+        data = response.json()
+        reusedId, queuedId = data["experimentIds"]
+        self.assertEqual(data["reusedFrom"], {reusedId: self.sourceId})
+        self.assertEqual(data["savedTime"], 10)
+        claimed = self.post("experiments/queue/claim", {}, admin=True).json()
+        self.assertEqual(claimed["experimentId"], queuedId)
+
+
+class ComputeSettingsSharingTest(APITestCase):
+    """
+    Identical ComputeSettings trees are stored once and shared, changing
+    the settings of one Experiment leaves the shared tree unchanged
+    """
+
+    def tree(self, experimentId):
+        experiment = models.Experiment.objects.get(experimentId=experimentId)
+        return experiment.ComputeSettings_id
+
+    def test_shared(self):
+        response = self.post(
+            "experiments/bulk",
+            [experiment_data(0), experiment_data(1), experiment_data(0)],
+        )
+        first, second, third = response.json()["experimentIds"]
+        self.post("experiments", experiment_data(1))
+        self.assertEqual(models.ComputeSettings.objects.count(), 2)
+        self.assertEqual(models.QubitMeasurementItem.objects.count(), 4)
+        self.assertEqual(self.tree(first), self.tree(third))
+        self.assertNotEqual(self.tree(first), self.tree(second))
+
+    def test_copy_on_write(self):
+        first, second = self.create_experiments(2)
+        computeSettings = experiment_data(0)["ComputeSettings"]
+        self.patch("experiments/" + second, {"ComputeSettings": computeSettings})
+        shared = self.tree(first)
+        self.assertEqual(self.tree(second), shared)
+        before = self.get("experiments/" + first).json()
+
+        # only clusterState changes, the rest of the tree is kept
+        response = self.patch(
+            "experiments/" + second,
+            {
+                "ComputeSettings": {
+                    "clusterState": {"amountQubits": 4, "presetSettings": "linear"}
+                }
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        changed = response.json()["ComputeSettings"]
+        self.assertEqual(changed["clusterState"]["amountQubits"], 4)
+        self.assertEqual(len(changed["encodedQubitMeasurements"]), 2)
+        self.assertNotEqual(self.tree(second), shared)
+        cache.cache.clear()
+        self.assertEqual(self.get("experiments/" + first).json(), before)
+        hashes = models.Experiment.objects.values_list("configurationHash", flat=True)
+        self.assertEqual(len(set(hashes)), 2)
+
+        # back to the settings of first, the shared tree is used again
+        self.patch("experiments/" + second, {"ComputeSettings": computeSettings})
+        self.assertEqual(self.tree(second), shared)
+        self.assertEqual(len(set(hashes.all())), 1)
+
+    def test_invalid(self):
+        (experimentId,) = self.create_experiments(1)
+        tree = self.tree(experimentId)
+        response = self.patch(
+            "experiments/" + experimentId,
+            {"ComputeSettings": {"clusterState": {"amountQubits": "many"}}},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.tree(experimentId), tree)
+
+    def test_share_command(self):
+        self.create_experiments(2)
+        self.post("experiments", experiment_data(0))
+        # trees stored before the settingsHash existed
+        models.ComputeSettings.objects.update(settingsHash=None)
+        self.post("experiments", experiment_data(1))
+        self.assertEqual(models.ComputeSettings.objects.count(), 3)
+        call_command("share_compute_settings", stdout=StringIO())
+        trees = models.Experiment.objects.values_list("ComputeSettings", flat=True)
+        self.assertEqual(len(set(trees)), 2)
+
+
+class OrphanCollectionTest(APITestCase):
+    """
+    The garbage collector only deletes results detached by the deletion of
+    their Experiment, after the grace period, and the rows only they used
+    """
+
+    def test_collect(self):
+        deleted, kept = self.create_experiments(2)
+        self.create_result(deleted)
+        self.create_result(kept)
+        # posted without Experiment, still served by the result views
+        response = self.post("results", result_data(None), admin=True)
+        self.assertEqual(response.status_code, 201, response.content)
+        models.ExperimentResult.objects.update(
+            startTime=timezone.now() - timezone.timedelta(days=2)
+        )
+        self.assertEqual(self.delete("experiments/" + deleted).status_code, 204)
+        detached = models.ExperimentResult.objects.get(detached__isnull=False)
+        self.assertIsNone(detached.experiment_id)
+
+        # within the grace period, the tree of the Experiment is deleted
+        collected = orphans.collect()
+        self.assertEqual(collected["ExperimentResult"], 0)
+        self.assertEqual(collected["ComputeSettings"], 1)
+        models.ExperimentResult.objects.filter(pk=detached.pk).update(
+            detached=timezone.now() - timezone.timedelta(days=2)
+        )
+        self.assertEqual(orphans.count()["ExperimentResult"], 1)
+        collected = orphans.collect(chunk_size=1)
+        self.assertEqual(collected["ExperimentResult"], 1)
+        self.assertEqual(collected["ExperimentData"], 1)
+        self.assertEqual(collected["Countrates"], 1)
+        self.assertFalse(models.ExperimentResult.objects.filter(pk=detached.pk))
+        self.assertEqual(models.ExperimentResult.objects.count(), 2)
+        self.assertEqual(models.ExperimentData.objects.count(), 2)
+        self.assertEqual(
+            set(models.ExperimentResult.objects.values_list("experiment", flat=True)),
+            {uuid.UUID(kept), None},
+        )
+        self.assertEqual(self.get("experiments/" + kept).status_code, 200)
+        self.assertEqual(sum(orphans.count().values()), 0)
+
+
+class ExperimentArchiveTest(APITestCase):
+    """
+    Finished Experiments are archived with their results and restored
+    unchanged when they are accessed again
+    """
+
+    def test_round_trip(self):
+        finished, queued = self.create_experiments(2)
+        self.create_result(finished, coincidenceCounts={"d1d2": 3, "d3d4": 7})
+        self.create_result(finished, totalCounts=200)
+        self.patch("experiments/" + finished, {"status": "DONE"})
+        cache.cache.clear()
+        experiment = self.get("experiments/" + finished).json()
+        results = self.get("experiments/{}/results".format(finished)).json()
+
+        response = self.post("experiments/archive", {"olderThan": 0}, admin=True)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json(), {"archived": 1})
+        self.assertFalse(models.Experiment.objects.filter(experimentId=finished))
+        archived = self.get("experiments/archive").json()
+        self.assertEqual([e["experimentId"] for e in archived], [finished])
+        self.assertEqual(
+            [e["experimentId"] for e in self.get("experiments").json()], [queued]
+        )
+
+        # restored on access
+        cache.cache.clear()
+        self.assertEqual(self.get("experiments/" + finished).json(), experiment)
+        self.assertEqual(self.get("experiments/archive").json(), [])
+        cache.cache.clear()
+        self.assertEqual(
+            self.get("experiments/{}/results".format(finished)).json(), results
+        )
+
+    def test_invalid(self):
+        self.assertEqual(
+            self.post("experiments/archive", {"olderThan": 0}).status_code, 403
+        )
+        for data in ([{"olderThan": 0}], "0", {"olderThan": -1}, {"olderThan": "1"}):
+            response = self.post("experiments/archive", data, admin=True)
+            self.assertEqual(response.status_code, 400, data)
+            self.assertEqual(response.json(), "Invalid data.")
+
+
+class QueryPlanTest(TestCase):
+    """
+    The hot queries of the views use their indexes (see check_query_plans)
+    """
+
+    def test_query_plans(self):
+        out = StringIO()
+        call_command("check_query_plans", experiments=1000, users=10, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertTrue(line.endswith(" ok"), line)
+        self.assertFalse(models.Experiment.objects.exists())
+
+    def test_sequential_scan(self):
+        # experimentName has no index
+        queries = [
+            (
+                "unindexed",
+                models.Experiment.objects.filter(experimentName="plan"),
+                (models.Experiment, models.ExperimentBase),
+            )
+        ]
+        with mock.patch.object(
+            check_query_plans.Command, "queries", return_value=queries
+        ):
+            with self.assertRaises(CommandError):
+                call_command("check_query_plans", experiments=100, stdout=StringIO())
+
+
+class MetricsTest(APITestCase):
+    """
+    Requests are counted by route and the metrics endpoint renders the sums
+    of all workers in the Prometheus text format
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.cache.clear()
+        patcher = mock.patch.object(metrics, "registry", metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self):
+        response = self.get("metrics", admin=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        # the sample of every metric by its name and labels
+        return dict(
+            line.rsplit(" ", 1)
+            for line in response.content.decode().splitlines()
+            if not line.startswith("#")
+        )
+
+    def test_metrics(self):
+        (experimentId,) = self.create_experiments(1)
+        self.get("experiments/" + experimentId)
+        self.get("experiments/" + experimentId)
+        self.get("experiments/" + str(uuid.uuid4()))
+        samples = self.scrape()
+        route = 'route="api2/experiments/<slug:experiment_id>",method="GET"'
+        self.assertEqual(
+            samples["cdl_http_requests_total{" + route + ',status="200"}'], "2"
+        )
+        self.assertEqual(
+            samples["cdl_http_requests_total{" + route + ',status="404"}'], "1"
+        )
+        duration = "cdl_http_request_duration_seconds"
+        self.assertEqual(samples[duration + "_bucket{" + route + ',le="+Inf"}'], "3")
+        self.assertEqual(samples[duration + "_count{" + route + "}"], "3")
+        self.assertGreater(int(samples["cdl_db_queries_total{" + route + "}"]), 0)
+        self.assertGreater(
+            int(samples["cdl_http_response_size_bytes_total{" + route + "}"]), 0
+        )
+        self.assertIn("cdl_token_cache_hits_total", samples)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        self.get("experiments")
+        samples = self.scrape()
+        self.assertEqual(
+            samples[
+                'cdl_http_requests_total{route="api2/experiments",method="GET",'
+                'status="200"}'
+            ],
+            "1",
+        )
+        self.assertFalse(
+            [name for name in samples if name.startswith("cdl_http_request_duration")]
+        )
+
+    def test_workers(self):
+        # another process writing its snapshot to the shared cache
+        worker = metrics.Registry()
+        worker.count("api2/experiments", "GET", 200)
+        worker.flush()
+        self.get("experiments")
+        samples = self.scrape()
+        self.assertEqual(
+            samples[
+                'cdl_http_requests_total{route="api2/experiments",method="GET",'
+                'status="200"}'
+            ],
+            "2",
+        )
+
+    def test_admin_only(self):
+        self.assertEqual(self.get("metrics").status_code, 403)
+
+
+class QueryInspectorTest(APITestCase):
+    """
+    The opt-in query inspector reports repeated identical queries and slow
+    queries once per QUERY_LOG_INTERVAL
+    """
+
+    def setUp(self):
+        super().setUp()
+        middlewares._reports.clear()
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            middlewares.fingerprint(
+                "SELECT a FROM t WHERE id IN (%s, %s, %s) AND name = 'x''y' LIMIT 21"
+            ),
+            "SELECT a FROM t WHERE id IN (...) AND name = '?' LIMIT ?",
+        )
+        self.assertEqual(
+            middlewares.fingerprint("INSERT INTO t (a) VALUES (%s), (%s)"),
+            "INSERT INTO t (a) VALUES ...",
+        )
+
+    @override_settings(QUERY_REPEAT_THRESHOLD=3, QUERY_SLOW_THRESHOLD=60)
+    def test_repeated(self):
+        request = mock.Mock(method="GET", resolver_match=mock.Mock(route="route"))
+        inspector = middlewares.QueryInspector(request)
+        with connection.execute_wrapper(inspector):
+            for i in range(3):
+                models.Experiment.objects.filter(experimentName=str(i)).exists()
+            models.ExperimentResult.objects.exists()
+        with mock.patch.object(middlewares.query_logger, "warning") as warning:
+            inspector.report()
+            self.assertEqual(warning.call_count, 1)
+            args = warning.call_args[0]
+            self.assertEqual(args[1:3], (3, "GET route"))
+            self.assertIn("cdl_rest_api_experiment", args[5])
+            self.assertIn("tests.py", args[6])
+            # reported once per QUERY_LOG_INTERVAL
+            inspector.report()
+            self.assertEqual(warning.call_count, 1)
+
+    @override_settings(QUERY_INSPECTOR=True, QUERY_SLOW_THRESHOLD=0)
+    def test_slow(self):
+        with mock.patch.object(middlewares.query_logger, "warning") as warning:
+            self.get("experiments")
+            self.assertTrue(warning.call_count)
+            for call in warning.call_args_list:
+                self.assertTrue(call[0][0].startswith("Slow query"))
+                self.assertEqual(call[0][1], "GET api2/experiments")
+            count = warning.call_count
+            self.get("experiments")
+            self.assertEqual(warning.call_count, count)
+
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            middlewares.QueryInspectorMiddleware(lambda request: None)
+
+
+class ExperimentFastPathTest(APITestCase):
+    """
+    The fast read path of the Experiment listings renders the same bytes as
+    ExperimentSerializer with DRF's JSONRenderer (see representations.py)
+    """
+
+    def test_same_bytes(self):
+        experimentIds = self.create_experiments(3)
+        # escaped differently by json.dumps and JSONRenderer
+        names = ("quote \" \\ \u2028 \u2029 end", "\u00e9 \U0001f600")
+        for i, name in enumerate(names):
+            data = dict(experiment_data(10 + i), experimentName=name)
+            response = self.post("experiments", dict(data, projectId=None))
+            self.assertEqual(response.status_code, 200, response.content)
+        self.create_result(experimentIds[0])
+        self.patch(
+            "experiments/" + experimentIds[1], {"status": "DONE", "priority": 2}
+        )
+        # the ComputeSettings field is stored in the parent table
+        models.ExperimentBase.objects.filter(
+            experiment__experimentId=experimentIds[2]
+        ).update(ComputeSettings=None)
+        first = self.get("experiments", {"limit": 2}).json()
+        for params in (
+            {},
+            {"fields": "summary"},
+            {"fields": "summary", "expand": "ComputeSettings"},
+            {"fields": "experimentId,created,ComputeSettings"},
+            {"limit": 2},
+            {"limit": 2, "cursor": unquote(first["next"].split("cursor=")[1])},
+        ):
+            for admin in (False, True):
+                fast = self.get("experiments", params, admin=admin)
+                with mock.patch(
+                    "cdl_rest_api.views._renders_plain_json", return_value=False
+                ):
+                    drf = self.get("experiments", params, admin=admin)
+                self.assertEqual(fast.status_code, 200)
+                self.assertNotIsInstance(fast, Response)
+                self.assertIsInstance(drf, Response)
+                self.assertEqual(fast.content, drf.content, params)
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command(
+            "benchmark_serializers", experiments=50, trees=5, repeat=1, stdout=out
+        )
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        self.assertFalse(models.Experiment.objects.exists())
@@ -6,13 +6,24 @@ urlpatterns = [
     # as_view is the standard function to convert APIView class
     # to be rendered by url
     path("experiments", views.ExperimentListView.as_view()),
+    path("experiments/bulk", views.ExperimentBulkView.as_view()),
     # /queue before slug otherwise there is error
     path("experiments/queue", views.ExperimentQueueView.as_view()),
+    path("experiments/queue/claim", views.ExperimentClaimView.as_view()),
+    path("experiments/stats", views.ExperimentStatsView.as_view()),
+    path("experiments/archive", views.ExperimentArchiveView.as_view()),
     path("experiments/<slug:experiment_id>",
          views.ExperimentDetailView.as_view()),
     path("results", views.ResultView.as_view()),
+    path("results/batch", views.ResultBatchView.as_view()),
+    path("results/export", views.ResultExportView.as_view()),
+    path("results/aggregate", views.ResultAggregateView.as_view()),
     path("results/<int:pk>", views.ResultDetailView.as_view()),
+    path("metrics", views.MetricsView.as_view()),
     path(
         "experiments/<slug:experiment_id>/results", views.ExperimentResultView.as_view()
     ),
+    path(
+        "experiments/<slug:experiment_id>/samples", views.ExperimentSampleView.as_view()
+    ),
 ]
@@ -1,12 +1,23 @@
 
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import generics, status
 # from rest_framework.settings import api_settings
 from rest_framework.response import Response  # Standard Response object
 from rest_framework.views import APIView
 
-from cdl_rest_api import models, serializers
+from cdl_rest_api import (aggregation, archive, cache, configurations, export,
+                          ingest, models, queue, representations, samples,
+                          scheduler, serializers, stats)
+from cdl_rest_api.pagination import ExperimentPagination, ResultPagination
 from cdl_rest_api.permissions import (IsOriginAdminUser, IsOriginAuthenticated,
                                       UpdateOwnProfile)
+from cdl_webservice import metrics
 
 
 # Multiple endpoints for detail view and list view
@@ -23,93 +34,39 @@ class ExperimentDetailView(APIView):
         """
         GET function for ExperimentDetailView
         """
+        return _cached_get(self, request, experiment_id, "detail")
 
-        experiment = None
-        experimentResult = None
-        if experiment_id is not None:
-            if request.origin_user.is_admin:
-                # if Experiment exists, else remain None
-                if models.Experiment.objects.filter(
-                    experimentId=experiment_id
-                ).exists():
-                    # get targets experiment_id specified in URL
-                    # not JSON id, or Project ID
-                    experiment = models.Experiment.objects.get(
-                        experimentId=experiment_id
-                    )
-                    # if Experiment Result for Experiment exists
-                    if models.ExperimentResult.objects.filter(
-                        experiment=experiment
-                    ).exists():
-                        # one Experiment can have multiple results, and only
-                        # the latest is returned in the view response
-                        experimentResult = models.ExperimentResult.objects.filter(
-                            # experiment is a ForeignKey in ExperimentResult model
-                            experiment=experiment
-                        ).last()
-                else:
-                    return Response(
-                        "An Experiment with the specified ID was not found.",
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
-            # if enduser
-            else:
-                if models.Experiment.objects.filter(
-                    experimentId=experiment_id,
-                    # additional filter: Experiment belongs to user
-                    user_id=request.origin_user.id,
-                ).exists():
-                    experiment = models.Experiment.objects.get(
-                        experimentId=experiment_id,
-                    )
-                    if models.ExperimentResult.objects.filter(
-                        experiment=experiment
-                    ).exists():
-                        experimentResult = models.ExperimentResult.objects.filter(
-                            experiment=experiment
-                        ).last()
-                else:
-                    return Response(
-                        "An Experiment with the specified ID was not found or does not belong to the current user.",
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
-
-        # this is an if statement independent from the one above:
-        # logic returns required status messages according to api specs
-        if experiment is not None:
-            if experimentResult is not None:
-                experiment_serializer = serializers.ExperimentSerializer(
-                    experiment,
-                )
-                result_serializer = serializers.ExperimentResultGetSerializer(
-                    experimentResult,
-                )
-
-                # print(experiment_serializer.data)
-                return Response(
-                    {
-                        "experimentConfiguration": experiment_serializer.data,
-                        "experimentResult": result_serializer.data,
-                    },
-                    status=status.HTTP_200_OK,
-                )
+    def get_experiment(self, request, experiment_id):
+        """
+        Reads the Experiment with its latest result in one query, plus the
+        prefetched lists of its ComputeSettings
+        """
+        return (
+            models.Experiment.objects.with_compute_settings()
+            .with_latest_result()
+            .get_accessible(request.origin_user, experiment_id)
+        )
 
-            else:
-                experiment_serializer = serializers.ExperimentSerializer(
-                    experiment,
-                )
-                # experiment_serializer.is_valid()
-                # print(experiment_serializer.data)
-                return Response(
-                    experiment_serializer.data,
-                    status=status.HTTP_200_OK,
-                )
-        else:
-            # logic should not allow for this error to occur
-            return Response(
-                "Unexpected error.",
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
+    def render(self, experiment):
+        """
+        Renders the Experiment and its latest result
+        """
+        experiment_serializer = serializers.ExperimentSerializer(
+            experiment,
+        )
+        # one Experiment can have multiple results, and only
+        # the latest is returned in the view response
+        experimentResult = experiment.latest_result
+        if experimentResult is None:
+            return experiment_serializer.data
+
+        result_serializer = serializers.ExperimentResultGetSerializer(
+            experimentResult,
+        )
+        return {
+            "experimentConfiguration": experiment_serializer.data,
+            "experimentResult": result_serializer.data,
+        }
 
     # use patch to update status field of experiment object
     # alternative: generic view + permission class isAdmin, but requires additional
@@ -120,28 +77,48 @@ class ExperimentDetailView(APIView):
         """
 
         if request.origin_user.is_admin:
-            if models.Experiment.objects.filter(experimentId=experiment_id).exists():
-                experiment = models.Experiment.objects.get(
-                    experimentId=experiment_id)
-            else:
-                return Response(
-                    "An Experiment with the specified ID was not found.",
-                    status=status.HTTP_404_NOT_FOUND,
+            # locked until the statistics are updated, see stats.py
+            with transaction.atomic():
+                queryset = models.Experiment.objects.select_for_update()
+                experiment = queryset.get_accessible(
+                    request.origin_user, experiment_id
                 )
-            serializer = serializers.ExperimentSerializer(
-                # Need experiment to overwrite, if experiment was missing
-                # method would fail due to missing required fields.
-                # Convert experiment from db to JSON and merge fields from data.
-                experiment,
-                data=request.data,
-                partial=True,
-            )
-            # if the merged JSON is valid
-            if serializer.is_valid():
+                if experiment is None and _restore_archived(request, experiment_id):
+                    experiment = queryset.get_accessible(
+                        request.origin_user, experiment_id
+                    )
+                if experiment is None:
+                    return _experiment_not_found(request)
+                serializer = serializers.ExperimentSerializer(
+                    # Need experiment to overwrite, if experiment was missing
+                    # method would fail due to missing required fields.
+                    # Convert experiment from db to JSON and merge fields from data.
+                    experiment,
+                    data=request.data,
+                    partial=True,
+                )
+                # if the merged JSON is not valid
+                if not serializer.is_valid():
+                    return Response(
+                        "Invalid data.", status=status.HTTP_400_BAD_REQUEST
+                    )
+                before = stats.state(experiment)
                 serializer.save()
-                # print(serializer.data)
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+                stats.experiment_changed(before, experiment)
+                # a worker that took the Experiment from GET experiments/queue
+                # starts it here, charged to the fair share as in
+                # queue.claim_next_experiment
+                if before[1] == "IN QUEUE" and experiment.status == "RUNNING":
+                    scheduler.charge(experiment)
+            cache.invalidate_experiment(experiment.experimentId)
+            # Experiment was put (back) into the queue
+            if serializer.validated_data.get("status") == "IN QUEUE":
+                scheduler.register_submission(
+                    experiment.user_id, [experiment.experimentId]
+                )
+                queue.notify_experiment_enqueued()
+            # print(serializer.data)
+            return Response(serializer.data, status=status.HTTP_200_OK)
 
         else:
             return Response(
@@ -153,49 +130,83 @@ class ExperimentDetailView(APIView):
         """
         DELETE function for ExperimentDetailView
         """
+        return _delete_experiment(request, experiment_id)
 
-        if experiment_id is not None:
-            if request.origin_user.is_admin:
-                if models.Experiment.objects.filter(
-                    experimentId=experiment_id
-                ).exists():
-                    models.Experiment.objects.filter(
-                        experimentId=experiment_id
-                    ).delete()
-                    return Response(
-                        "OK - Experiment deleted successfully.",
-                        status=status.HTTP_204_NO_CONTENT,
-                    )
-                else:
-                    return Response(
-                        "An Experiment with the specified ID was not found.",
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
-            else:
-                if models.Experiment.objects.filter(
-                    experimentId=experiment_id,
-                    user_id=request.origin_user.id,
-                ).exists():
-                    models.Experiment.objects.filter(
-                        experimentId=experiment_id
-                    ).delete()
-                    return Response(
-                        "OK - Experiment deleted successfully.",
-                        status=status.HTTP_204_NO_CONTENT,
-                    )
-                else:
-                    return Response(
-                        "An Experiment with the specified ID was not found or does not belong to the current user.",
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
-        # 401 Authorization information is missing or invalid is authomatically
-        # handled with Django
-        # TO DO: is this the right response here?
-        else:
-            return Response(
-                "Unexpected error.",
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
+
+def _cached_get(view, request, experiment_id, name):
+    """
+    Serves a GET of the detail and result views from the cached
+    representation of the Experiment. Answers 304 Not Modified without
+    touching the database if the ETag sent in If-None-Match is still valid.
+    """
+    entry, version = cache.get_representation(
+        experiment_id, name, request.origin_user
+    )
+    if entry is None:
+        experiment = view.get_experiment(request, experiment_id)
+        if experiment is None and _restore_archived(request, experiment_id):
+            experiment = view.get_experiment(request, experiment_id)
+        if experiment is None:
+            return _experiment_not_found(request)
+        entry = cache.set_representation(
+            experiment_id,
+            name,
+            experiment.user_id,
+            view.render(experiment),
+            version,
+        )
+
+    if request.META.get("HTTP_IF_NONE_MATCH") == entry["etag"]:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(entry["data"], status=status.HTTP_200_OK)
+    response["ETag"] = entry["etag"]
+    return response
+
+
+def _delete_experiment(request, experiment_id):
+    """
+    Deletes the Experiment if the user may access it
+    """
+    with transaction.atomic():
+        # locked, so concurrent deletes don't both update the statistics
+        experiment = models.Experiment.objects.select_for_update().get_accessible(
+            request.origin_user, experiment_id
+        )
+        if experiment is None:
+            if archive.delete_archived(request.origin_user, experiment_id):
+                return Response(
+                    "OK - Experiment deleted successfully.",
+                    status=status.HTTP_204_NO_CONTENT,
+                )
+            return _experiment_not_found(request)
+        stats.experiments_deleted([experiment])
+        experiment.delete()
+    cache.invalidate_experiment(experiment_id)
+    return Response(
+        "OK - Experiment deleted successfully.",
+        status=status.HTTP_204_NO_CONTENT,
+    )
+
+
+def _restore_archived(request, experiment_id):
+    """
+    Restores an archived Experiment the user may access when it is accessed
+    again (see archive.py), returns whether there was one
+    """
+    return archive.restore(request.origin_user, experiment_id) is not None
+
+
+def _experiment_not_found(request):
+    if request.origin_user.is_admin:
+        return Response(
+            "An Experiment with the specified ID was not found.",
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    return Response(
+        "An Experiment with the specified ID was not found or does not belong to the current user.",
+        status=status.HTTP_404_NOT_FOUND,
+    )
 
 
 class ExperimentListView(generics.ListCreateAPIView):
@@ -209,20 +220,56 @@ class ExperimentListView(generics.ListCreateAPIView):
     # actually occurs until you do something to evaluate the queryset
     queryset = models.Experiment.objects.all()
     serializer_class = serializers.ExperimentSerializer
+    pagination_class = ExperimentPagination
     permission_classes = [
         IsOriginAuthenticated,
     ]
 
     def list(self, request):
+        # ?fields=summary or ?fields=<field>,<field> renders only these
+        # fields, ?expand=ComputeSettings adds the nested settings back
+        fields = _get_experiment_fields(request)
         # Note the use of `get_queryset()` instead of `self.queryset`
-        if request.origin_user.is_admin:
-            queryset = self.get_queryset()
-        else:
-            queryset = models.Experiment.objects.filter(
-                user_id=request.origin_user.id)
-        serializer = serializers.ExperimentSerializer(queryset, many=True)
+        queryset = self.get_queryset()
+        if _renders_plain_json(request):
+            return self.list_values(request, queryset, fields)
+        if fields is None or "ComputeSettings" in fields:
+            queryset = queryset.with_compute_settings()
+        if not request.origin_user.is_admin:
+            queryset = queryset.filter(user_id=request.origin_user.id)
+
+        # only paginated if requested with ?limit=
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = serializers.ExperimentSerializer(
+                page, many=True, fields=fields
+            )
+            return self.get_paginated_response(serializer.data)
+        serializer = serializers.ExperimentSerializer(
+            queryset, many=True, fields=fields
+        )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def list_values(self, request, queryset, fields):
+        """
+        Renders the same response as list from .values() rows, without
+        ExperimentSerializer (see representations.py)
+        """
+        if not request.origin_user.is_admin:
+            queryset = queryset.filter(user_id=request.origin_user.id)
+        queryset = representations.experiment_values(queryset)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            data = {
+                "next": self.paginator.get_next_link(),
+                "results": representations.experiments(page, fields),
+            }
+        else:
+            data = representations.experiments(queryset, fields)
+        return HttpResponse(
+            representations.render_json(data), content_type="application/json"
+        )
+
     # need to overwrite create to save user to experiment
     # user_id=request.origin_user.id is what the standard method doesn't do
     def create(self, request):
@@ -231,16 +278,221 @@ class ExperimentListView(generics.ListCreateAPIView):
         # cleaner alternative: set default in model
         # leave for now
         data["status"] = "IN QUEUE"
+        # only admin users may prioritize Experiments over the fair share
+        if not request.origin_user.is_admin:
+            data.pop("priority", None)
+        # opt-in: finish at once with the recent result of an identical
+        # Experiment if there is one, see configurations.py
+        reuse = data.pop("reuseResult", False) is True
         serializer = serializers.ExperimentSerializer(data=data)
         # print(request.data)
         if serializer.is_valid():
-            serializer.save(user_id=request.origin_user.id)
+            with transaction.atomic():
+                experiment = serializer.save(user_id=request.origin_user.id)
+                reused = configurations.reuse_results([experiment]) if reuse else []
+                stats.experiments_created([experiment])
+                stats.results_added(reused)
+            if not reused:
+                scheduler.register_submission(
+                    request.origin_user.id, [experiment.experimentId]
+                )
+                queue.notify_experiment_enqueued()
             # print(serializer.data)
+            if reuse:
+                return Response(
+                    dict(
+                        serializer.data,
+                        reusedFrom=experiment.reusedFrom_id,
+                        savedTime=sum(result.totalTime for result in reused),
+                    ),
+                    status=status.HTTP_200_OK,
+                )
             return Response(serializer.data, status=status.HTTP_200_OK)
         else:
             return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
 
 
+class ExperimentStatsView(APIView):
+    """
+    This view returns the Experiment statistics of the authenticated user:
+    number of Experiments per status, number of results, total detector
+    counts, total hardware time, queue wait time and the hardware time saved
+    by reused results. ?projectId= restricts
+    them to one project, admin users get the statistics of all users or of
+    ?user_id=.
+    """
+
+    permission_classes = (IsOriginAuthenticated,)
+
+    def get(self, request):
+        """
+        GET function for ExperimentStatsView
+        """
+        queryset = models.ExperimentStats.objects.all()
+        if request.origin_user.is_admin:
+            if request.query_params.get("user_id"):
+                queryset = queryset.filter(user_id=request.query_params["user_id"])
+        else:
+            queryset = queryset.filter(user_id=request.origin_user.id)
+        if "projectId" in request.query_params:
+            queryset = queryset.filter(projectId=request.query_params["projectId"])
+        return Response(stats.summarize(queryset), status=status.HTTP_200_OK)
+
+
+class ExperimentArchiveView(APIView):
+    """
+    This view lists the archived Experiments of the authenticated user (all
+    Experiments or ?user_id= for admin users, ?projectId= restricts them to
+    one project). Archived Experiments are restored as soon as they are
+    accessed via experiments/<id>.
+
+    Admin users archive finished Experiments created more than olderThan
+    days ago with POST, taking the same filters as DELETE experiments/bulk.
+    """
+
+    permission_classes = (IsOriginAuthenticated,)
+
+    def get(self, request):
+        """
+        GET function for ExperimentArchiveView
+        """
+        queryset = models.ArchivedExperiment.objects.order_by("created")
+        if request.origin_user.is_admin:
+            if request.query_params.get("user_id"):
+                queryset = queryset.filter(user_id=request.query_params["user_id"])
+        else:
+            queryset = queryset.filter(user_id=request.origin_user.id)
+        if request.query_params.get("projectId"):
+            queryset = queryset.filter(projectId=request.query_params["projectId"])
+        return Response(
+            list(
+                queryset.values(
+                    "experimentId",
+                    "experimentName",
+                    "projectId",
+                    "status",
+                    "created",
+                    "archived",
+                )
+            ),
+            status=status.HTTP_200_OK,
+        )
+
+    def post(self, request):
+        """
+        POST function for ExperimentArchiveView
+        """
+        if not request.origin_user.is_admin:
+            return Response(
+                "Please authenticate as admin user to archive Experiments.",
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        # a JSON array or scalar has no fields
+        if not isinstance(request.data, dict):
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+        olderThan = request.data.get("olderThan")
+        if type(olderThan) is not int or olderThan < 0:
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+        try:
+            queryset = archive.filter_experiments(
+                models.Experiment.objects.filter(
+                    created__lt=timezone.now() - timedelta(days=olderThan)
+                ),
+                request.query_params,
+                request.origin_user,
+            )
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"archived": archive.archive_experiments(queryset)},
+            status=status.HTTP_200_OK,
+        )
+
+
+class ExperimentBulkView(APIView):
+    """
+    This view lets users submit many Experiments at once, e.g. all points of
+    a parameter sweep. Either all Experiments are created or none.
+
+    DELETE deletes all Experiments matching the filters projectId, status,
+    since and until (created) and, for admin users, user_id. At least one
+    filter is required. The Experiments are deleted in chunks, each in its
+    own transaction.
+    """
+
+    permission_classes = (IsOriginAuthenticated,)
+
+    def delete(self, request):
+        """
+        DELETE function for ExperimentBulkView
+        """
+        if not any(request.query_params.get(param) for param in archive.FILTERS):
+            return Response("Invalid filter.", status=status.HTTP_400_BAD_REQUEST)
+        try:
+            queryset = archive.filter_experiments(
+                models.Experiment.objects.all(),
+                request.query_params,
+                request.origin_user,
+            )
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"deleted": archive.delete_experiments(queryset)},
+            status=status.HTTP_200_OK,
+        )
+
+    def post(self, request):
+        """
+        POST function for ExperimentBulkView
+        """
+        data = request.data
+        if (
+            not isinstance(data, list)
+            or not data
+            or len(data) > settings.EXPERIMENT_BULK_MAX_SIZE
+        ):
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+        for item in data:
+            if not isinstance(item, dict):
+                return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+            # see ExperimentListView.create
+            item["status"] = "IN QUEUE"
+            if not request.origin_user.is_admin:
+                item.pop("priority", None)
+        reuse = [item.pop("reuseResult", False) is True for item in data]
+        serializer = serializers.ExperimentSerializer(data=data, many=True)
+        if serializer.is_valid():
+            with transaction.atomic():
+                experiments = serializer.save(user_id=request.origin_user.id)
+                reused = configurations.reuse_results(
+                    [
+                        experiment
+                        for experiment, reuseResult in zip(experiments, reuse)
+                        if reuseResult
+                    ]
+                )
+                stats.experiments_created(experiments)
+                stats.results_added(reused)
+            if len(reused) < len(experiments):
+                scheduler.register_submission(
+                    request.origin_user.id,
+                    [experiment.experimentId for experiment in experiments],
+                )
+                queue.notify_experiment_enqueued()
+            response = {
+                "experimentIds": [experiment.experimentId for experiment in experiments]
+            }
+            if any(reuse):
+                response["reusedFrom"] = {
+                    str(result.experiment.experimentId): result.experiment.reusedFrom_id
+                    for result in reused
+                }
+                response["savedTime"] = sum(result.totalTime for result in reused)
+            return Response(response, status=status.HTTP_200_OK)
+        else:
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+
+
 class ExperimentResultView(APIView):
     """
     This view returns the latest ExperimentResult object for a given Experiment
@@ -254,98 +506,48 @@ class ExperimentResultView(APIView):
         """
         GET function for ExperimentResultView
         """
-        experiment = None
-        experimentResult = None
-        if experiment_id is not None:
-            # retrieve data from db and store in experiment and
-            # experimentResult variables:
-            # if staff user
-            if request.origin_user.is_admin:
-                if models.Experiment.objects.filter(
-                    experimentId=experiment_id
-                ).exists():
-                    # get targets experiment_id specified in URL
-                    # not JSON id, or Project ID (see urls.py)
-                    experiment = models.Experiment.objects.get(
-                        experimentId=experiment_id
-                    )
-                    # if ExperimentResult exists, else remains None
-                    if models.ExperimentResult.objects.filter(
-                        experiment=experiment
-                    ).exists():
-                        experimentResult = models.ExperimentResult.objects.filter(
-                            experiment=experiment
-                        ).last()
-                else:
-                    return Response(
-                        "An Experiment with the specified ID was not found.",
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
-            # if enduser
-            else:
-                if models.Experiment.objects.filter(
-                    experimentId=experiment_id,
-                    # filter also: Experiment belongs to user
-                    user_id=request.origin_user.id,
-                ).exists():
-                    experiment = models.Experiment.objects.get(
-                        experimentId=experiment_id,
-                    )
-                    if models.ExperimentResult.objects.filter(
-                        experiment=experiment
-                    ).exists():
-                        experimentResult = models.ExperimentResult.objects.filter(
-                            experiment=experiment
-                        ).last()
-                else:
-                    return Response(
-                        "An Experiment with the specified ID was not found or does not belong to the current user.",
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
+        return _cached_get(self, request, experiment_id, "result")
 
-        # this if statement is independent from the one above, and applies only
-        # if and experiment has been identified:
-        # logic returns required status messages according to api specs
-        # print(experiment)
-        if experiment is not None:
-            if experimentResult is not None:
-                experiment_serializer = serializers.ExperimentSerializer(
-                    experiment,
-                )
-                result_serializer = serializers.ExperimentResultPostSerializer(
-                    experimentResult,
-                )
+    def get_experiment(self, request, experiment_id):
+        """
+        Reads the Experiment with its latest result in one query. The
+        ComputeSettings lists are only needed without a result, see render.
+        """
+        return (
+            models.Experiment.objects.select_related(
+                *models.ExperimentQuerySet.COMPUTE_SETTINGS_JOINS
+            )
+            .with_latest_result()
+            .get_accessible(request.origin_user, experiment_id)
+        )
 
-                # print(experiment_serializer.data)
-                return Response(
-                    result_serializer.data,
-                    # {
-                    #     "experimentConfiguration": experiment_serializer.data,
-                    #     "experimentResult": result_serializer.data,
-                    # },
-                    status=status.HTTP_200_OK,
-                )
-            # TO DO: Here some more logic is needed: currently experiment
-            # object is returned in case no result is available
-            else:
-                experiment_serializer = serializers.ExperimentSerializer(
-                    experiment,
-                )
-                # experiment_serializer.is_valid()
-                # print(experiment_serializer.data)
-                return Response(
-                    # {
-                    #     "experimentConfiguration": experiment_serializer.data,
-                    # },
-                    experiment_serializer.data,
-                    status=status.HTTP_200_OK,
+    def render(self, experiment):
+        """
+        Renders the latest result of the Experiment
+        """
+        experimentResult = experiment.latest_result
+        if experimentResult is not None:
+            # experimentData with its countrates in one query
+            if experimentResult.experimentData_id is not None:
+                experimentResult.experimentData = (
+                    models.ExperimentData.objects.select_related(
+                        "countratePerDetector"
+                    ).get(pk=experimentResult.experimentData_id)
                 )
-        else:
-            # logic should not allow for this error to occur
-            return Response(
-                "Unexpected error.",
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            result_serializer = serializers.ExperimentResultPostSerializer(
+                experimentResult,
             )
+            return result_serializer.data
+
+        # TO DO: Here some more logic is needed: currently experiment
+        # object is returned in case no result is available
+        prefetch_related_objects(
+            [experiment], *models.ExperimentQuerySet.COMPUTE_SETTINGS_PREFETCHES
+        )
+        experiment_serializer = serializers.ExperimentSerializer(
+            experiment,
+        )
+        return experiment_serializer.data
 
     def delete(self, request, experiment_id):
         """
@@ -354,47 +556,7 @@ class ExperimentResultView(APIView):
         # TO DO: this Endpoint still needs to be adjusted to Result
         # currently user deletes Experiment not Result
         # TO DO: check if obsolete due to ResultDetailView endpoint
-        if experiment_id is not None:
-            if request.origin_user.is_admin:
-                if models.Experiment.objects.filter(
-                    experimentId=experiment_id
-                ).exists():
-                    models.Experiment.objects.filter(
-                        experimentId=experiment_id
-                    ).delete()
-                    return Response(
-                        "OK - Experiment deleted successfully.",
-                        status=status.HTTP_204_NO_CONTENT,
-                    )
-                else:
-                    return Response(
-                        "An Experiment with the specified ID was not found.",
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
-            else:
-                if models.Experiment.objects.filter(
-                    experimentId=experiment_id,
-                    user_id=request.origin_user.id,
-                ).exists():
-                    models.Experiment.objects.filter(
-                        experimentId=experiment_id
-                    ).delete()
-                    return Response(
-                        "OK - Experiment deleted successfully.",
-                        status=status.HTTP_204_NO_CONTENT,
-                    )
-                else:
-                    return Response(
-                        "An Experiment with the specified ID was not found or does not belong to the current user.",
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
-        # 401 Authorization information is missing or invalid. is authomatically
-        # handled with Django
-        else:
-            return Response(
-                "Unexpected error.",
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
+        return _delete_experiment(request, experiment_id)
 
 
 class ExperimentQueueView(generics.RetrieveUpdateAPIView):
@@ -409,12 +571,205 @@ class ExperimentQueueView(generics.RetrieveUpdateAPIView):
     ]
 
     def retrieve(self, request):
+        # ?wait=<seconds> holds the request until an Experiment is enqueued
+        # instead of making the worker poll in a tight loop
+        try:
+            wait = _get_wait_seconds(request.query_params.get("wait"))
+        except ValueError:
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+        if wait:
+            with queue.long_poll() as reserved:
+                if not reserved:
+                    return _too_many_waiting()
+                queryset = queue.wait_for_experiment(scheduler.pick_next, wait)
+        else:
+            queryset = scheduler.pick_next()
         # if no object with status "IN QUEUE" exists returns null fields
-        queryset = models.Experiment.objects.filter(status="IN QUEUE").first()
-        serializer = serializers.ExperimentSerializer(queryset, many=False)
+        serializer = serializers.ExperimentQueueSerializer(queryset, many=False)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class ExperimentClaimView(APIView):
+    """
+    This view lets a worker (hardware controller) claim the next Experiment
+    in the queue. The claimed Experiment is set to RUNNING, so multiple
+    workers can drain the queue in parallel without running an Experiment
+    twice.
+    """
+
+    permission_classes = (IsOriginAdminUser,)
+
+    def post(self, request):
+        """
+        POST function for ExperimentClaimView
+        """
+        # a JSON array or scalar has no fields
+        if not isinstance(request.data, dict):
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+        # workers may identify themselves, otherwise the token subject is used
+        worker_id = request.data.get("workerId") or request.origin_user.id
+        try:
+            lease_seconds = _get_lease_seconds(request.data.get("leaseSeconds"))
+            wait = _get_wait_seconds(
+                request.data.get("wait", request.query_params.get("wait"))
+            )
+        except (TypeError, ValueError):
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+
+        def claim():
+            return queue.claim_next_experiment(
+                worker_id, lease_seconds=lease_seconds
+            )
+
+        if wait:
+            with queue.long_poll() as reserved:
+                if not reserved:
+                    return _too_many_waiting()
+                experiment = queue.wait_for_experiment(claim, wait)
+        else:
+            experiment = claim()
+        if experiment is None:
+            return Response(
+                "No Experiment in queue.",
+                status=status.HTTP_204_NO_CONTENT,
+            )
+        serializer = serializers.ExperimentQueueSerializer(experiment)
+        return Response(
+            dict(
+                serializer.data,
+                workerId=experiment.workerId,
+                leaseExpires=experiment.leaseExpires,
+            ),
+            status=status.HTTP_200_OK,
+        )
+
+
+class ExperimentSampleView(APIView):
+    """
+    This view returns the count rate time series of an Experiment, recorded
+    by the hardware controller while the Experiment runs. ?since=<cursor>
+    returns only the samples after the cursor of the previous response,
+    ?start= and ?end= restrict the time range and ?points= downsamples it.
+    Running under the ASGI server, new samples can also be received over the
+    websocket channel (see consumers.py). Admin users post new samples.
+    """
+
+    permission_classes = (IsOriginAuthenticated,)
+
+    def get(self, request, experiment_id):
+        """
+        GET function for ExperimentSampleView
+        """
+        queryset = models.Experiment.objects.only("experimentId", "user_id")
+        experiment = queryset.get_accessible(request.origin_user, experiment_id)
+        if experiment is None and _restore_archived(request, experiment_id):
+            experiment = queryset.get_accessible(request.origin_user, experiment_id)
+        if experiment is None:
+            return _experiment_not_found(request)
+        try:
+            data = samples.read(
+                models.CountrateSample.objects.filter(experiment=experiment),
+                request.query_params,
+            )
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_200_OK)
+
+    def post(self, request, experiment_id):
+        """
+        POST function for ExperimentSampleView
+        """
+        if not request.origin_user.is_admin:
+            return Response(
+                "Please authenticate as admin user to post samples.",
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        experiment = models.Experiment.objects.only("experimentId").get_accessible(
+            request.origin_user, experiment_id
+        )
+        if experiment is None:
+            return _experiment_not_found(request)
+        data = request.data
+        if (
+            not isinstance(data, list)
+            or not data
+            or len(data) > settings.SAMPLE_BATCH_MAX_SIZE
+        ):
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+        serializer = serializers.CountrateSampleSerializer(data=data, many=True)
+        if not serializer.is_valid():
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+        stored = samples.store(experiment, serializer.validated_data)
+        return Response({"stored": stored}, status=status.HTTP_201_CREATED)
+
+
+def _get_experiment_fields(request):
+    """
+    Parses the fields and expand query parameters of Experiment listings,
+    returns None if all fields are requested
+    """
+    fields = request.query_params.get("fields")
+    if not fields:
+        return None
+    if fields == "summary":
+        fields = list(serializers.ExperimentSerializer.SUMMARY_FIELDS)
+    else:
+        fields = fields.split(",")
+    expand = request.query_params.get("expand")
+    if expand:
+        fields += expand.split(",")
+    return fields
+
+
+def _renders_plain_json(request):
+    """
+    Whether the response is rendered as compact JSON, the format of
+    representations.render_json (and not e.g. the browsable API or indented)
+    """
+    return (
+        request.accepted_renderer.format == "json"
+        and "indent" not in request.accepted_media_type
+    )
+
+
+def _get_lease_seconds(value):
+    """
+    Parses the lease requested by a claiming worker, capped at
+    EXPERIMENT_LEASE_MAX_SECONDS. A lease below one second would expire at
+    once and put the Experiment back into the queue while it still runs.
+    """
+    if value is None:
+        return None
+    lease = int(value)
+    if lease < 1:
+        raise ValueError("leaseSeconds must be positive")
+    return min(lease, settings.EXPERIMENT_LEASE_MAX_SECONDS)
+
+
+def _get_wait_seconds(value):
+    """
+    Parses the long-poll timeout of the queue endpoints, capped at
+    EXPERIMENT_QUEUE_MAX_WAIT. Long-polling blocks a server thread (at most
+    EXPERIMENT_QUEUE_MAX_LONG_POLLS per process), workers running under the
+    ASGI server should prefer the websocket channel (see consumers.py).
+    """
+    if value in (None, ""):
+        return 0
+    wait = float(value)
+    if wait < 0:
+        raise ValueError("wait must not be negative")
+    return min(wait, settings.EXPERIMENT_QUEUE_MAX_WAIT)
+
+
+def _too_many_waiting():
+    response = Response(
+        "Too many requests waiting for the queue, please retry.",
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+    response["Retry-After"] = "1"
+    return response
+
+
 # TO DO: check if obsolete
 class ExperimentDataView(generics.RetrieveAPIView):
     """ """
@@ -439,12 +794,120 @@ class ResultView(generics.ListCreateAPIView):
     This view enables admin user to post new results and all list existing results
     """
 
-    queryset = models.ExperimentResult.objects.all()
+    queryset = models.ExperimentResult.objects.select_related(
+        "experimentData__countratePerDetector"
+    )
     serializer_class = serializers.ExperimentResultPostSerializer
+    # only paginated if requested with ?limit=
+    pagination_class = ResultPagination
     permission_classes = [
         IsOriginAdminUser,
     ]
 
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            experimentResult = serializer.save()
+            stats.result_added(experimentResult)
+        # the new result is now the latest result of the Experiment
+        cache.invalidate_experiment(experimentResult.experiment_id)
+
+
+class ResultBatchView(APIView):
+    """
+    This view lets the hardware controller post many results at once. They
+    are only staged and acknowledged with 202 Accepted, the flush worker
+    stores them shortly after (see ingest.py). GET returns the number of
+    pending and invalid staged results.
+    """
+
+    permission_classes = (IsOriginAdminUser,)
+
+    def get(self, request):
+        """
+        GET function for ResultBatchView
+        """
+        return Response(ingest.pending(), status=status.HTTP_200_OK)
+
+    def post(self, request):
+        """
+        POST function for ResultBatchView
+        """
+        data = request.data
+        if (
+            not isinstance(data, list)
+            or not data
+            or len(data) > settings.RESULT_BATCH_MAX_SIZE
+            or not all(isinstance(item, dict) for item in data)
+        ):
+            return Response("Invalid data.", status=status.HTTP_400_BAD_REQUEST)
+        return Response({"staged": ingest.stage(data)}, status=status.HTTP_202_ACCEPTED)
+
+
+class ResultExportView(APIView):
+    """
+    This view streams ExperimentResults with their ExperimentData as NDJSON
+    (?output=ndjson, default), CSV (?output=csv) or as column-oriented numpy
+    arrays (?output=npz). Results can be filtered
+    with projectId, since and until, admin users can also filter by user_id.
+    End users only get the results of their own Experiments.
+    """
+
+    permission_classes = (IsOriginAuthenticated,)
+
+    def get(self, request):
+        """
+        GET function for ResultExportView
+        """
+        # not named "format", that is reserved by DRF for content negotiation
+        exportFormat = request.query_params.get("output", "ndjson")
+        if exportFormat not in export.FORMATS:
+            return Response("Invalid format.", status=status.HTTP_400_BAD_REQUEST)
+        try:
+            queryset = export.filter_results(
+                models.ExperimentResult.objects.all(),
+                request.query_params,
+                request.origin_user,
+            )
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        generator, content_type, extension = export.FORMATS[exportFormat]
+        response = StreamingHttpResponse(
+            generator(queryset), content_type=content_type
+        )
+        response["Content-Disposition"] = (
+            'attachment; filename="results.{}"'.format(extension)
+        )
+        return response
+
+
+class ResultAggregateView(APIView):
+    """
+    This view aggregates ExperimentResults over a parameter sweep: results
+    are grouped by ?parameter=theta|phi (of the encoded qubit ?qubit=,
+    default 1) or ?parameter=circuitAngleValue (of the circuit angle
+    ?angle=) and sum, mean and standard deviation of the detector count
+    rates and of the coincidenceCounts keys in ?coincidences=d1d2,... are
+    returned per parameter value. Takes the same filters as ResultExportView.
+    """
+
+    permission_classes = (IsOriginAuthenticated,)
+
+    def get(self, request):
+        """
+        GET function for ResultAggregateView
+        """
+        try:
+            queryset = export.filter_results(
+                models.ExperimentResult.objects.all(),
+                request.query_params,
+                request.origin_user,
+            )
+            data = aggregation.aggregate_sweep(queryset, request.query_params)
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_200_OK)
+
 
 # TO DO: check against delete function in ExperimentResultView
 class ResultDetailView(generics.RetrieveDestroyAPIView):
@@ -456,6 +919,30 @@ class ResultDetailView(generics.RetrieveDestroyAPIView):
         IsOriginAdminUser,
     ]
 
+    def perform_destroy(self, instance):
+        cache.invalidate_experiment(instance.experiment_id)
+        with transaction.atomic():
+            stats.result_deleted(instance)
+            instance.delete()
+
+
+class MetricsView(APIView):
+    """
+    This view returns the request metrics of all server processes in the
+    Prometheus text format (see cdl_webservice/metrics.py), for admin users,
+    e.g. a Prometheus scraper with an admin token
+    """
+
+    permission_classes = (IsOriginAdminUser,)
+
+    def get(self, request):
+        """
+        GET function for MetricsView
+        """
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
 
 class RegisterView(generics.CreateAPIView):
     """
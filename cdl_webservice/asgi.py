@@ -0,0 +1,29 @@
+"""
+ASGI config for cdl_webservice project.
+
+Extends the bifrost ASGI application (GraphQL subscriptions) with the
+websocket routes of cdl_rest_api. HTTP requests are handled by the default
+Django handler of channels.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cdl_webservice.settings.dev")
+
+django.setup()
+
+from bifrost.urls import websocket_urlpatterns as bifrost_websocket_urlpatterns  # noqa
+from channels.auth import AuthMiddlewareStack  # noqa
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa
+
+from cdl_rest_api.routing import websocket_urlpatterns  # noqa
+
+application = ProtocolTypeRouter(
+    {
+        "websocket": AuthMiddlewareStack(
+            URLRouter(websocket_urlpatterns + bifrost_websocket_urlpatterns)
+        )
+    }
+)
@@ -0,0 +1,243 @@
+"""
+Per-route request metrics in the Prometheus text format.
+
+MetricsMiddleware (see middlewares.py) counts every request by route, method
+and status. A sampled share of the requests (METRICS_SAMPLE_RATE) is also
+timed: latency histogram, number and time of the database queries, render
+time of the response and response size. Other components register
+counters of their own (COUNTERS) with add_counters, e.g. the hits and misses
+of the JWT cache of OriginMidddleware.
+
+Every process keeps its metrics in memory and writes a snapshot to the
+cache at most every METRICS_FLUSH_INTERVAL seconds, registered in a list of
+workers. The metrics endpoint sums the snapshots of all workers that
+flushed within METRICS_WORKER_TIMEOUT seconds, so with a shared cache
+(production) it reports all daphne workers. The list of workers is updated
+without a lock, a worker lost by a concurrent update registers again with
+its next flush. The values are cumulative since the start of each worker.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+# upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# sums kept per route and method of the sampled requests
+SUMS = ("duration", "queries", "queryTime", "renderTime", "size")
+
+# counters registered with Registry.add_counters and their help texts
+COUNTERS = {
+    "cdl_token_cache_hits_total": "Requests whose JWT was found in the token cache.",
+    "cdl_token_cache_misses_total": "Requests whose JWT had to be verified.",
+}
+
+WORKERS_KEY = "cdl:metrics:workers"
+
+
+def _worker_key(worker):
+    return "cdl:metrics:worker:{}".format(worker)
+
+
+class Registry:
+    """
+    Metrics of this process
+    """
+
+    def __init__(self):
+        self.worker = "{}-{}-{}".format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]
+        )
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.sampled = {}
+        self.counters = []
+        self.flushed = 0
+
+    def add_counters(self, counters):
+        """
+        Registers a function returning the current values of COUNTERS of
+        another component, by name
+        """
+        self.counters.append(counters)
+
+    def count(self, route, method, status):
+        with self.lock:
+            self.requests[(route, method, str(status))] += 1
+        self.maybe_flush()
+
+    def observe(self, route, method, status, **values):
+        """
+        Records a sampled request, values are the SUMS of the request
+        """
+        with self.lock:
+            self.requests[(route, method, str(status))] += 1
+            series = self.sampled.get((route, method))
+            if series is None:
+                series = self.sampled[(route, method)] = {
+                    "count": 0,
+                    "buckets": [0] * len(BUCKETS),
+                    **{name: 0 for name in SUMS},
+                }
+            series["count"] += 1
+            for i, bound in enumerate(BUCKETS):
+                if values["duration"] <= bound:
+                    series["buckets"][i] += 1
+            for name in SUMS:
+                series[name] += values[name]
+        self.maybe_flush()
+
+    def snapshot(self):
+        counters = {}
+        for function in self.counters:
+            counters.update(function())
+        with self.lock:
+            return {
+                "requests": [list(key) + [n] for key, n in self.requests.items()],
+                "sampled": [
+                    list(key) + [dict(series, buckets=list(series["buckets"]))]
+                    for key, series in self.sampled.items()
+                ],
+                "counters": counters,
+            }
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the snapshot of this process to the cache
+        """
+        self.flushed = time.monotonic()
+        timeout = settings.METRICS_WORKER_TIMEOUT
+        cache.set(_worker_key(self.worker), self.snapshot(), timeout)
+        now = time.time()
+        workers = {
+            worker: seen
+            for worker, seen in (cache.get(WORKERS_KEY) or {}).items()
+            if seen > now - timeout
+        }
+        workers[self.worker] = now
+        cache.set(WORKERS_KEY, workers, timeout)
+
+
+registry = Registry()
+
+
+def collect():
+    """
+    Returns the summed snapshots of all workers: requests, sampled
+    requests and counters
+    """
+    registry.flush()
+    workers = cache.get(WORKERS_KEY) or {}
+    snapshots = cache.get_many([_worker_key(worker) for worker in workers])
+    requests = defaultdict(int)
+    sampled = {}
+    counters = defaultdict(int)
+    for snapshot in snapshots.values():
+        # snapshots of workers started before the counters existed have none
+        for name, n in snapshot.get("counters", {}).items():
+            counters[name] += n
+        for route, method, status, n in snapshot["requests"]:
+            requests[(route, method, status)] += n
+        for route, method, series in snapshot["sampled"]:
+            total = sampled.get((route, method))
+            if total is None:
+                sampled[(route, method)] = series
+                continue
+            total["count"] += series["count"]
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], series["buckets"])]
+            for name in SUMS:
+                total[name] += series[name]
+    return requests, sampled, counters
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(
+        '{}="{}"'.format(name, _escape(str(value))) for name, value in labels.items()
+    ) + "}"
+
+
+def render():
+    """
+    Returns the metrics of all workers in the Prometheus text format
+    """
+    requests, sampled, counters = collect()
+    lines = [
+        "# HELP cdl_http_requests_total Requests by route, method and status.",
+        "# TYPE cdl_http_requests_total counter",
+    ]
+    for (route, method, status), n in sorted(requests.items()):
+        lines.append(
+            "cdl_http_requests_total{} {}".format(
+                _labels(route=route, method=method, status=status), n
+            )
+        )
+
+    lines += [
+        "# HELP cdl_http_request_duration_seconds Latency of the sampled requests.",
+        "# TYPE cdl_http_request_duration_seconds histogram",
+    ]
+    for (route, method), series in sorted(sampled.items()):
+        for bound, n in zip(BUCKETS, series["buckets"]):
+            lines.append(
+                "cdl_http_request_duration_seconds_bucket{} {}".format(
+                    _labels(route=route, method=method, le=bound), n
+                )
+            )
+        labels = _labels(route=route, method=method)
+        lines += [
+            "cdl_http_request_duration_seconds_bucket{} {}".format(
+                _labels(route=route, method=method, le="+Inf"), series["count"]
+            ),
+            "cdl_http_request_duration_seconds_sum{} {}".format(
+                labels, series["duration"]
+            ),
+            "cdl_http_request_duration_seconds_count{} {}".format(
+                labels, series["count"]
+            ),
+        ]
+
+    for name, key, help in (
+        ("cdl_db_queries_total", "queries", "Database queries of the sampled requests."),
+        (
+            "cdl_db_query_duration_seconds_total",
+            "queryTime",
+            "Time spent in database queries by the sampled requests.",
+        ),
+        (
+            "cdl_render_duration_seconds_total",
+            "renderTime",
+            "Time spent rendering the responses of the sampled requests.",
+        ),
+        (
+            "cdl_http_response_size_bytes_total",
+            "size",
+            "Size of the responses of the sampled requests, except streams.",
+        ),
+    ):
+        lines += ["# HELP {} {}".format(name, help), "# TYPE {} counter".format(name)]
+        for (route, method), series in sorted(sampled.items()):
+            lines.append(
+                "{}{} {}".format(name, _labels(route=route, method=method), series[key])
+            )
+
+    for name, help in COUNTERS.items():
+        lines += [
+            "# HELP {} {}".format(name, help),
+            "# TYPE {} counter".format(name),
+            "{} {}".format(name, counters.get(name, 0)),
+        ]
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,135 @@
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
 import jwt
 from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from cdl_webservice import metrics
+
+logger = logging.getLogger(__name__)
+query_logger = logging.getLogger("cdl_webservice.queries")
+
+
+class OriginUser:
+    """
+    User of the iam user service, decoded from the JWT of the request
+    """
+
+    __slots__ = ("id", "is_staff", "is_admin")
+
+    def __init__(self, user_id=None, is_staff=False, is_admin=False):
+        self.id = user_id
+        self.is_staff = is_staff
+        self.is_admin = is_admin
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified tokens, so the signature of a token is
+    only checked once instead of on every request of a polling client.
+    Entries are keyed by the SHA-256 of the token and expire with the exp
+    claim of the token, at the latest after max_age seconds.
+    """
+
+    def __init__(self, max_size, max_age):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        key = hashlib.sha256(token.encode()).digest()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                user, expires = entry
+                if expires > time.time():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return user
+                del self.entries[key]
+            self.misses += 1
+        return None
+
+    def set(self, token, user, exp=None):
+        expires = time.time() + self.max_age
+        if exp is not None:
+            expires = min(expires, exp)
+        key = hashlib.sha256(token.encode()).digest()
+        with self.lock:
+            self.entries[key] = (user, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the current size
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+            }
+
+
+token_cache = TokenCache(
+    max_size=settings.ORIGIN_TOKEN_CACHE_SIZE,
+    max_age=settings.ORIGIN_TOKEN_CACHE_MAX_AGE,
+)
 
-class OriginMidddleware:
 
+def _token_cache_counters():
+    stats = token_cache.stats()
+    return {
+        "cdl_token_cache_hits_total": stats["hits"],
+        "cdl_token_cache_misses_total": stats["misses"],
+    }
+
+
+# served by the metrics endpoint, see metrics.py
+metrics.registry.add_counters(_token_cache_counters)
+
+
+def get_origin_user(token):
+    """
+    Returns the OriginUser of a token or None if the token is invalid
+    """
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    try:
+        decoded: dict = jwt.decode(token, key=settings.SECRET_KEY)
+    except Exception as e:
+        logger.info("Error in origin user: %s", e)
+        return None
+
+    user = OriginUser(
+        user_id=decoded.get("sub"),
+        is_staff=decoded.get("is_staff"),
+        is_admin=decoded.get("is_admin"),
+    )
+    exp = decoded.get("exp")
+    token_cache.set(token, user, exp if isinstance(exp, (int, float)) else None)
+    return user
+
+
+class OriginMidddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
@@ -14,35 +141,244 @@ class OriginMidddleware:
 
     def process_request(self, request):
 
-        class OriginUser:
-            def __init__(self, user_id=None, is_staff=False, is_admin=False):
-                self.id = user_id
-                self.is_staff = is_staff
-                self.is_admin = is_admin
-
         user = None
 
-        # Check if the request has a token
-        if "HTTP_AUTHORIZATION" in request.META:
+        # Check if the request has a token, only for paths that need it
+        # (static files and Wagtail pages don't)
+        if "HTTP_AUTHORIZATION" in request.META and request.path.startswith(
+            settings.ORIGIN_AUTH_PATH_PREFIXES
+        ):
+            parts = request.META["HTTP_AUTHORIZATION"].split(" ")
+            if len(parts) == 2:
+                user = get_origin_user(parts[1])
+
+        request.origin_user = user
+
+        return None
+
+
+class QueryTimer:
+    """
+    Execute wrapper counting the database queries of a request and the time
+    spent in them
+    """
+
+    __slots__ = ("queries", "queryTime", "renderTime")
+
+    def __init__(self):
+        self.queries = 0
+        self.queryTime = 0.0
+        self.renderTime = 0.0
 
-            token = request.META["HTTP_AUTHORIZATION"].split(" ")[1]
-            try:
-                decoded: dict = jwt.decode(token, key=settings.SECRET_KEY)
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.queryTime += time.perf_counter() - start
 
-                user_id = decoded.get("sub")
-                is_staff = decoded.get("is_staff")
-                is_admin = decoded.get("is_admin")
 
-                user = OriginUser(
-                    user_id=user_id,
-                    is_staff=is_staff,
-                    is_admin=is_admin,
+class MetricsMiddleware:
+    """
+    Records the metrics of the requests to METRICS_PATH_PREFIXES by route
+    (the URL pattern, not the path), see metrics.py. Only a share of
+    METRICS_SAMPLE_RATE of the requests is timed, all are counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith(settings.METRICS_PATH_PREFIXES):
+            return self.get_response(request)
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            response = self.get_response(request)
+            metrics.registry.count(
+                _route(request), request.method, response.status_code
+            )
+            return response
+
+        timer = request.metrics_timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        metrics.registry.observe(
+            _route(request),
+            request.method,
+            response.status_code,
+            duration=duration,
+            queries=timer.queries,
+            queryTime=timer.queryTime,
+            renderTime=timer.renderTime,
+            size=0 if response.streaming else len(response.content),
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view, timed until the render
+        # callback
+        timer = getattr(request, "metrics_timer", None)
+        if timer is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                timer.renderTime += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def _route(request):
+    # unresolved paths share one label, every path would be a new series
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.route
+
+
+# normalization of SQL statements to their shape: parameter lists, VALUES
+# lists, string and number literals
+SQL_SHAPES = (
+    (re.compile(r"\bIN \((?:%s, )*%s\)"), "IN (...)"),
+    (re.compile(r"\bVALUES .*", re.DOTALL), "VALUES ..."),
+    (re.compile(r"'(?:[^']|'')*'"), "'?'"),
+    (re.compile(r"\b\d+\b"), "?"),
+)
+
+
+def fingerprint(sql):
+    """
+    Returns the shape of an SQL statement, equal for statements that only
+    differ in their parameters
+    """
+    for pattern, replacement in SQL_SHAPES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def call_site():
+    """
+    Returns the innermost frames of the project code on the stack, without
+    this module
+    """
+    frames = [
+        frame
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(settings.BASE_DIR)
+        and "site-packages" not in frame.filename
+        and frame.filename != __file__
+    ]
+    return "".join(traceback.format_list(frames[-8:]))
+
+
+class QueryInspector:
+    """
+    Execute wrapper grouping the queries of a request by their shape
+    (fingerprint). Keeps the number, the time and the call site of the first
+    query of every shape, and logs single queries slower than
+    QUERY_SLOW_THRESHOLD seconds at once.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.shapes = {}
+
+    @property
+    def route(self):
+        return "{} {}".format(self.request.method, _route(self.request))
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            shape = fingerprint(sql)
+            entry = self.shapes.get(shape)
+            if entry is None:
+                entry = self.shapes[shape] = [0, 0.0, call_site()]
+            entry[0] += 1
+            entry[1] += duration
+            if (
+                duration >= settings.QUERY_SLOW_THRESHOLD
+                and _should_log("slow", self.route, shape) is not False
+            ):
+                query_logger.warning(
+                    "Slow query on %s (%.0f ms): %s\n%s",
+                    self.route,
+                    1000 * duration,
+                    sql,
+                    call_site(),
                 )
 
-            except Exception as e:
-                print("Error in origin user", e)
-                user = None
+    def report(self):
+        """
+        Logs the shapes that were queried at least QUERY_REPEAT_THRESHOLD
+        times, e.g. a related object loaded once per row of a list (N+1)
+        """
+        for shape, (count, duration, site) in self.shapes.items():
+            if count < settings.QUERY_REPEAT_THRESHOLD:
+                continue
+            suppressed = _should_log("repeated", self.route, shape)
+            if suppressed is False:
+                continue
+            query_logger.warning(
+                "%d identical queries on %s (%.0f ms, %d similar reports "
+                "suppressed): %s\nfirst called from:\n%s",
+                count,
+                self.route,
+                1000 * duration,
+                suppressed,
+                shape,
+                site,
+            )
 
-        request.origin_user = user
 
-        return None
+# last report and number of suppressed reports per kind, route and shape
+_reports = {}
+_reports_lock = threading.Lock()
+
+
+def _should_log(kind, route, shape):
+    """
+    Returns False if the same report was logged within QUERY_LOG_INTERVAL
+    seconds, otherwise the number of reports suppressed since then
+    """
+    key = (kind, route, shape)
+    now = time.monotonic()
+    with _reports_lock:
+        last, suppressed = _reports.get(key, (None, 0))
+        if last is not None and now - last < settings.QUERY_LOG_INTERVAL:
+            _reports[key] = (last, suppressed + 1)
+            return False
+        _reports[key] = (now, 0)
+        return suppressed
+
+
+class QueryInspectorMiddleware:
+    """
+    Opt-in (QUERY_INSPECTOR) detection of repeated identical queries (N+1)
+    and slow queries of the requests to METRICS_PATH_PREFIXES. A share of
+    QUERY_INSPECTOR_SAMPLE_RATE of the requests is inspected, every report
+    is logged at most once per QUERY_LOG_INTERVAL seconds and route through
+    the cdl_webservice.queries logger.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSPECTOR:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (
+            not request.path.startswith(settings.METRICS_PATH_PREFIXES)
+            or random.random() >= settings.QUERY_INSPECTOR_SAMPLE_RATE
+        ):
+            return self.get_response(request)
+        inspector = QueryInspector(request)
+        with connection.execute_wrapper(inspector):
+            response = self.get_response(request)
+        inspector.report()
+        return response
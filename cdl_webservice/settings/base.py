@@ -56,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "cdl_webservice.middlewares.MetricsMiddleware",
+    "cdl_webservice.middlewares.QueryInspectorMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -103,7 +105,7 @@ DATABASES = {
     }
 }
 
-ASGI_APPLICATION = "bifrost.asgi.application"
+ASGI_APPLICATION = "cdl_webservice.asgi.application"
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -196,6 +198,102 @@ BIFROST_APPS = {
 
 APPEND_SLASH = False
 
+# Paths for which OriginMidddleware verifies the JWT of the request
+ORIGIN_AUTH_PATH_PREFIXES = ("/api2/",)
+
+# Verified tokens are cached by OriginMidddleware (LRU, at most
+# ORIGIN_TOKEN_CACHE_SIZE tokens for at most ORIGIN_TOKEN_CACHE_MAX_AGE seconds)
+ORIGIN_TOKEN_CACHE_SIZE = 1024
+ORIGIN_TOKEN_CACHE_MAX_AGE = 300
+
+# Number of seconds a worker may hold a claimed Experiment before it is put
+# back into the queue (see cdl_rest_api/queue.py), and the longest lease a
+# worker may request with leaseSeconds
+EXPERIMENT_LEASE_SECONDS = 300
+EXPERIMENT_LEASE_MAX_SECONDS = 86400
+
+# Maximum number of seconds a long-poll request on the queue endpoints is held
+# open while waiting for a new Experiment
+EXPERIMENT_QUEUE_MAX_WAIT = 30
+
+# Maximum number of long-poll requests waiting at the same time per process,
+# further ones are answered with 503 (each one holds a server thread)
+EXPERIMENT_QUEUE_MAX_LONG_POLLS = 32
+
+# Maximum number of Experiments accepted by one request to experiments/bulk
+EXPERIMENT_BULK_MAX_SIZE = 5000
+
+# Number of Experiments deleted or archived per transaction by the bulk
+# endpoints, and the age in days from which archive_experiments archives
+# finished Experiments (see cdl_rest_api/archive.py)
+EXPERIMENT_BULK_CHUNK_SIZE = 500
+EXPERIMENT_ARCHIVE_DAYS = 365
+
+# Number of seconds a finished result can be reused by Experiments submitted
+# with "reuseResult": true and an identical configuration (see
+# cdl_rest_api/configurations.py)
+EXPERIMENT_REUSE_WINDOW = 3600
+
+# Number of seconds the rendered Experiment detail and result views are
+# cached (see cdl_rest_api/cache.py); entries are also invalidated on change.
+# 0 disables the cache, the cache backend has to be shared by all processes.
+EXPERIMENT_CACHE_TIMEOUT = 300
+
+# Number of rows fetched per round trip by the streaming result export
+EXPORT_CHUNK_SIZE = 2000
+
+# Store new coincidenceCounts compactly against the shared pattern dictionary
+# instead of as JSON (see cdl_rest_api/coincidences.py)
+COINCIDENCES_COMPACT = False
+
+# Maximum number of results accepted by one request to results/batch
+RESULT_BATCH_MAX_SIZE = 5000
+
+# Number of staged results the flush worker stores per transaction and the
+# seconds it sleeps when no results are staged (see cdl_rest_api/ingest.py)
+RESULT_FLUSH_BATCH_SIZE = 1000
+RESULT_FLUSH_INTERVAL = 1
+
+# Maximum number of count rate samples accepted by one request to
+# experiments/<id>/samples, returned by one read and after downsampling with
+# ?points= (see cdl_rest_api/samples.py)
+SAMPLE_BATCH_MAX_SIZE = 5000
+SAMPLE_PAGE_SIZE = 1000
+SAMPLE_MAX_POINTS = 1000
+
+# Number of seconds between two reads of new samples for the websocket
+# clients of a running Experiment
+SAMPLE_POLL_INTERVAL = 1
+
+# Garbage collection of unreachable rows (see cdl_rest_api/orphans.py):
+# rows deleted per transaction, seconds to sleep between two chunks and the
+# seconds after the deletion of their Experiment from which results are deleted
+GC_CHUNK_SIZE = 1000
+GC_CHUNK_PAUSE = 0
+GC_RESULT_GRACE = 86400
+
+# Requests to METRICS_PATH_PREFIXES are counted by MetricsMiddleware, a share
+# of METRICS_SAMPLE_RATE of them is timed. Every process writes its metrics to
+# the cache every METRICS_FLUSH_INTERVAL seconds and is dropped from the
+# metrics endpoint after METRICS_WORKER_TIMEOUT seconds without flushing
+# (see cdl_webservice/metrics.py)
+METRICS_PATH_PREFIXES = ("/api2/",)
+METRICS_SAMPLE_RATE = 1.0
+METRICS_FLUSH_INTERVAL = 10
+METRICS_WORKER_TIMEOUT = 300
+
+# Opt-in logging of slow queries (at least QUERY_SLOW_THRESHOLD seconds) and
+# of queries repeated at least QUERY_REPEAT_THRESHOLD times with the same
+# shape in one request (N+1), with their call site. A share of
+# QUERY_INSPECTOR_SAMPLE_RATE of the requests is inspected, the same report is
+# logged at most every QUERY_LOG_INTERVAL seconds (see
+# QueryInspectorMiddleware in cdl_webservice/middlewares.py)
+QUERY_INSPECTOR = False
+QUERY_INSPECTOR_SAMPLE_RATE = 1.0
+QUERY_SLOW_THRESHOLD = 0.5
+QUERY_REPEAT_THRESHOLD = 10
+QUERY_LOG_INTERVAL = 300
+
 CORS_ALLOWED_ORIGINS = [
     "https://photonq.at",
     "https://quco.exp.univie.ac.at",
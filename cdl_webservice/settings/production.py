@@ -175,6 +175,24 @@ DATABASES = {
 # Configure caches from cache url
 CACHES = {"default": django_cache_url.config()}
 
+# The cached Experiment representations (see cdl_rest_api/cache.py) are
+# invalidated by other processes as well, e.g. the result-flusher service.
+# They are only cached in a cache shared by all processes (CACHE_URL, e.g.
+# pymemcached://memcached:11211), not in the default local-memory cache.
+if CACHES["default"]["BACKEND"] in (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+):
+    EXPERIMENT_CACHE_TIMEOUT = 0
+
+
+# Log slow and repeated (N+1) queries, see base.py
+if "QUERY_INSPECTOR" in os.environ:
+    QUERY_INSPECTOR = os.environ["QUERY_INSPECTOR"] == "on"
+    QUERY_INSPECTOR_SAMPLE_RATE = float(
+        os.environ.get("QUERY_INSPECTOR_SAMPLE_RATE", QUERY_INSPECTOR_SAMPLE_RATE)
+    )
+
 
 # > Logging
 # This logging is configured to be used with Sentry and console logs. Console
@@ -218,5 +236,11 @@ LOGGING = {
             "level": "WARNING",
             "propagate": False,
         },
+        # slow and repeated queries, see QUERY_INSPECTOR
+        "cdl_webservice.queries": {
+            "handlers": ["console"],
+            "level": "WARNING",
+            "propagate": False,
+        },
     },
 }